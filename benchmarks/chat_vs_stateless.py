@@ -0,0 +1,101 @@
+"""
+Compares the latency and token usage of the stateless pipeline with the chat session pipeline.
+
+Both paths render the new asset in the room and apply one follow-up tweak:
+- stateless: analyze_room, remove_asset_from_image, combine_images and combine_images again with the tweak
+- chat: analyze_room, then removal, insertion and the tweak as three turns in one chat session
+
+The prompt tokens of every chat turn are printed as well: the Gemini API keeps no chat state, so the chat sends its
+whole history, including the generated images, with every turn and the tokens grow with every turn.
+
+Usage: python -m benchmarks.chat_vs_stateless --resources test-sofa --runs 3
+"""
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv('gemini.env'))
+
+from src.chat_pipeline import ChatPipeline
+from src.config import Configuration
+from src.ImageOpener import ImageOpener
+from src.llm_client import LlmClient
+
+
+class UsageRecordingClient:
+    """Wraps a genai client to add up the token usage of all client.models.generate_content calls."""
+
+    def __init__(self, client):
+        self.client = client
+        self.models = self
+        self.prompt_tokens = 0
+        self.candidate_tokens = 0
+
+    def generate_content(self, **kwargs):
+        response = self.client.models.generate_content(**kwargs)
+        if response.usage_metadata is not None:
+            self.prompt_tokens += response.usage_metadata.prompt_token_count or 0
+            self.candidate_tokens += response.usage_metadata.candidates_token_count or 0
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def run_stateless(client, room, asset, asset_dimensions, tweak):
+    recorder = client.client = UsageRecordingClient(client.client)
+    try:
+        analysis = client.analyze_room(room, "sofa")
+        cleaned = client.remove_asset_from_image(room, "sofa")
+        client.combine_images(cleaned, asset, analysis.dimensions_text(), asset_dimensions, analysis.location_orientation_text())
+        client.combine_images(cleaned, asset, analysis.dimensions_text(), asset_dimensions, f"{analysis.location_orientation_text()}\n{tweak}")
+    finally:
+        client.client = recorder.client
+    return recorder.prompt_tokens, recorder.candidate_tokens
+
+
+def run_chat(pipeline, room, asset, asset_dimensions, tweak):
+    recorder = pipeline.llm_client.client = UsageRecordingClient(pipeline.llm_client.client)
+    try:
+        session_id, _ = pipeline.start(room, asset, asset_dimensions)
+        pipeline.tweak(session_id, tweak)
+        usage = pipeline.usage(session_id)
+        pipeline.close(session_id)
+    finally:
+        pipeline.llm_client.client = recorder.client
+    # the analysis is a stateless call, the chat turns are counted by the session
+    print(f"     chat: prompt tokens per turn {usage['turn_prompt_tokens']}")
+    return recorder.prompt_tokens + usage["prompt_tokens"], recorder.candidate_tokens + usage["candidate_tokens"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resources", default="test-sofa", help="resources folder with input/room and input/asset")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--asset-dimensions", default="width=220 cm, depth=90 cm, height=80 cm")
+    parser.add_argument("--tweak", default="move the sofa a bit to the left")
+    args = parser.parse_args()
+
+    config = Configuration(args.resources)
+    client = LlmClient(config)
+    pipeline = ChatPipeline(config, client)
+    room = ImageOpener.open_image(config.get_room_image_path(""))
+    asset = ImageOpener.open_image(config.get_asset_image_path(""))
+
+    for name, run in (("stateless", lambda: run_stateless(client, room, asset, args.asset_dimensions, args.tweak)),
+                      ("chat", lambda: run_chat(pipeline, room, asset, args.asset_dimensions, args.tweak))):
+        latencies, prompt_tokens, candidate_tokens = [], [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            prompt, candidates = run()
+            latencies.append(time.perf_counter() - start)
+            prompt_tokens.append(prompt)
+            candidate_tokens.append(candidates)
+        print(f"{name:>9}: median {statistics.median(latencies):.1f}s, min {min(latencies):.1f}s, max {max(latencies):.1f}s, "
+              f"prompt tokens {statistics.mean(prompt_tokens):.0f}, candidate tokens {statistics.mean(candidate_tokens):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+A local stand-in for the Gemini API, to measure the pipelines without calling the real models.
+
+The server answers the requests the genai SDK sends for:
+- models/{model}:generateContent: an image for the image models, JSON for structured output, text otherwise
+- models/{model}:batchGenerateContent and batches/{name}: the batch succeeds [batch_seconds] after it was created
+- the resumable file upload of the Files API
+
+Every request waits a random latency (log-normal around [latency_seconds]) and fails with a 503 with probability
+[error_rate], so retries, fallbacks and concurrency limits behave as they would against the real API.
+
+Usage:
+    with FakeGeminiServer(FakeGeminiSettings(latency_seconds=0.5), image_models=[...]) as server:
+        config.llm_base_url = server.base_url
+"""
+import base64
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+ANALYSIS_RESPONSE = {
+    "assets": [
+        {"name": "sofa", "area": 19800, "depth": 90, "width": 220, "height": 80},
+        {"name": "coffee table", "area": 6000, "depth": 60, "width": 100, "height": 45},
+    ],
+    "target": {"location": "against the back wall, left of the window", "orientation": "facing the viewer", "bounding_box": [450, 200, 800, 650]},
+}
+DIMENSIONS_RESPONSE = ("sofa: area=19800, depth=90, width=220, height=80\ncoffee table: area=6000, depth=60, width=100, height=45\n"
+                       "rug: area=60000, depth=200, width=300, height=1\nplant: area=2500, depth=50, width=50, height=180")
+LOCATION_RESPONSE = "location: against the back wall, left of the window\norientation: facing the viewer"
+
+
+@dataclass
+class FakeGeminiSettings:
+    """The behaviour of the fake server."""
+    latency_seconds: float = 0.5        # median latency of generateContent
+    latency_sigma: float = 0.3          # spread of the log-normal latency, 0 for a fixed latency
+    upload_latency_seconds: float = 0.05
+    batch_seconds: float = 2.0          # time until a batch job succeeds
+    error_rate: float = 0.0             # fraction of generateContent requests answered with a 503
+    image_size: tuple = (1024, 768)     # size of the images in the responses
+    seed: int = None
+
+
+class FakeGeminiServer:
+    """Runs the fake Gemini API on a free port of localhost in a background thread.
+
+    Args:
+        settings (FakeGeminiSettings): latency, error rate and response size.
+        image_models (list): the models that answer with an image, the other models answer with text.
+    """
+
+    def __init__(self, settings: FakeGeminiSettings = None, image_models=()):
+        self.settings = settings if settings is not None else FakeGeminiSettings()
+        self.image_models = {model.split("/")[-1] for model in image_models}
+        self.counters = {"generate_content": 0, "errors": 0, "batches": 0, "batch_requests": 0, "uploads": 0, "bytes_received": 0, "bytes_sent": 0}
+        self._random = random.Random(self.settings.seed)
+        self._ids = itertools.count(1)
+        self._batches = {}
+        self._uploads = {}
+        self._image_bytes = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def start(self) -> "FakeGeminiServer":
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+    def generate_content(self, model: str, request: dict):
+        """Returns the status and the body of a generateContent request."""
+        self._count("generate_content")
+        self._sleep(self.settings.latency_seconds, self.settings.latency_sigma)
+        if self._random_error():
+            self._count("errors")
+            return 503, {"error": {"code": 503, "message": "The model is overloaded. Please try again later.", "status": "UNAVAILABLE"}}
+        return 200, self._response(model, request)
+
+
+    def create_batch(self, model: str, body: dict):
+        requests = body.get("batch", {}).get("inputConfig", {}).get("requests", {}).get("requests", [])
+        name = f"batches/fake-{next(self._ids)}"
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["batch_requests"] += len(requests)
+            self._batches[name] = (model, requests, time.monotonic())
+        return 200, self._batch(name)
+
+
+    def get_batch(self, name: str):
+        if name not in self._batches:
+            return 404, {"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}}
+        return 200, self._batch(name)
+
+
+    def start_upload(self, body: dict):
+        upload_id = str(next(self._ids))
+        with self._lock:
+            self._uploads[upload_id] = body.get("file", {})
+        return upload_id
+
+
+    def finish_upload(self, upload_id: str, data: bytes):
+        self._count("uploads")
+        self._sleep(self.settings.upload_latency_seconds, 0)
+        with self._lock:
+            file = self._uploads.pop(upload_id, {})
+        name = f"files/fake-{upload_id}"
+        expiration = datetime.now(timezone.utc) + timedelta(hours=48)
+        return 200, {"file": {
+            "name": name,
+            "mimeType": file.get("mimeType", "application/octet-stream"),
+            "sizeBytes": str(len(data)),
+            "uri": f"{self.base_url}/v1beta/{name}",
+            "state": "ACTIVE",
+            "expirationTime": expiration.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        }}
+
+
+    def _batch(self, name):
+        model, requests, created = self._batches[name]
+        metadata = {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch", "model": model, "displayName": name}
+        if time.monotonic() - created < self.settings.batch_seconds:
+            metadata["state"] = "BATCH_STATE_RUNNING"
+        else:
+            metadata["state"] = "BATCH_STATE_SUCCEEDED"
+            responses = [{"response": self._response(model, entry.get("request", {})), "metadata": entry.get("metadata", {})} for entry in requests]
+            metadata["output"] = {"inlinedResponses": {"inlinedResponses": responses}}
+        return {"name": name, "metadata": metadata}
+
+
+    def _response(self, model, request):
+        generation_config = request.get("generationConfig") or {}
+        if generation_config.get("responseMimeType") == "application/json":
+            part = {"text": json.dumps(ANALYSIS_RESPONSE)}
+        elif model.split("/")[-1] in self.image_models:
+            part = {"inlineData": {"mimeType": "image/png", "data": self._image()}}
+        elif "orientation" in json.dumps(request.get("contents", [])):
+            part = {"text": LOCATION_RESPONSE}
+        else:
+            part = {"text": DIMENSIONS_RESPONSE}
+        candidate_tokens = {"modality": "IMAGE", "tokenCount": 1290} if "inlineData" in part else {"modality": "TEXT", "tokenCount": 120}
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": 1290,
+                "candidatesTokenCount": candidate_tokens["tokenCount"],
+                "totalTokenCount": 1290 + candidate_tokens["tokenCount"],
+                "promptTokensDetails": [{"modality": "TEXT", "tokenCount": 32}, {"modality": "IMAGE", "tokenCount": 1258}],
+                "candidatesTokensDetails": [candidate_tokens],
+            },
+            "modelVersion": model,
+        }
+
+
+    def _image(self) -> str:
+        """Returns the base64 encoded image of the responses, a noisy image so the PNG has a realistic size."""
+        with self._lock:
+            if self._image_bytes is None:
+                width, height = self.settings.image_size
+                image = Image.effect_noise((width, height), 64).convert("RGB")
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+                self._image_bytes = base64.b64encode(buffer.getvalue()).decode("ascii")
+            return self._image_bytes
+
+
+    def _sleep(self, median, sigma):
+        if median > 0:
+            with self._lock:
+                latency = self._random.lognormvariate(0, sigma) * median if sigma else median
+            time.sleep(latency)
+
+
+    def _random_error(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.settings.error_rate
+
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes the requests of the genai SDK to the FakeGeminiServer in [fake]."""
+
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    _GENERATE = re.compile(r"^/v1\w*/(?:models/)?(?P<model>[^/:]+):generateContent$")
+    _BATCH_CREATE = re.compile(r"^/v1\w*/(?:models/)?(?P<model>[^/:]+):batchGenerateContent$")
+    _BATCH_GET = re.compile(r"^/v1\w*/(?P<name>batches/[^/?]+)$")
+    _UPLOAD = re.compile(r"^/upload/v1\w*/files")
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.fake._count("bytes_received", len(data))
+
+        if self._UPLOAD.match(path):
+            if "upload_id=" in query:
+                self._send(*self.fake.finish_upload(query.split("upload_id=")[1].split("&")[0], data), headers={"X-Goog-Upload-Status": "final"})
+            else:
+                upload_id = self.fake.start_upload(json.loads(data or b"{}"))
+                self._send(200, {}, headers={"X-Goog-Upload-URL": f"{self.fake.base_url}/upload/v1beta/files?upload_id={upload_id}", "X-Goog-Upload-Status": "active"})
+            return
+
+        match = self._GENERATE.match(path)
+        if match:
+            self._send(*self.fake.generate_content(match.group("model"), json.loads(data)))
+            return
+        match = self._BATCH_CREATE.match(path)
+        if match:
+            self._send(*self.fake.create_batch(match.group("model"), json.loads(data)))
+            return
+        self._send(404, {"error": {"code": 404, "message": f"unknown path {path}", "status": "NOT_FOUND"}})
+
+
+    def do_GET(self):
+        match = self._BATCH_GET.match(self.path.partition("?")[0])
+        if match:
+            self._send(*self.fake.get_batch(match.group("name")))
+            return
+        self._send(404, {"error": {"code": 404, "message": f"unknown path {self.path}", "status": "NOT_FOUND"}})
+
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.fake._count("bytes_sent", len(data))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        pass
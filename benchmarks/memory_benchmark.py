@@ -0,0 +1,129 @@
+"""
+Measures the peak memory (RSS) per concurrent render of large room photos, with the full-resolution image loading of
+before and the bounded loading of image_loading after.
+
+The benchmark writes a room photo of [--room-size] and an asset to a temporary resources folder and renders it
+[--runs] times with [--parallel] renders in flight, against the local fake Gemini server (no network or API key):
+- before: every image is decoded at full resolution and there is no memory budget
+- after: draft decoding down to the largest upload size and the memory budget of [--budget-mb]
+
+Every mode runs in its own process, because the peak RSS of a process only grows. The peak per render is the growth of
+the peak RSS during the renders, divided by [--parallel].
+
+Usage: python -m benchmarks.memory_benchmark --room-size 4000x3000 --parallel 8 --runs 16
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from benchmarks.fake_gemini import FakeGeminiServer, FakeGeminiSettings
+from src.config import Configuration
+from src.image_loading import ImageMemoryBudget
+from src.image_processor import ImageProcessor
+from src.llm_client import LlmClient
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+MODES = ("before", "after")
+ASSET_DIMENSIONS = "width=220 cm, depth=90 cm, height=80 cm"
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_resources(directory: str, room_size: tuple):
+    """Writes a noisy room photo (so it compresses like a real photo) and a small asset to [directory]."""
+    os.makedirs(os.path.join(directory, "input", "room"))
+    os.makedirs(os.path.join(directory, "input", "asset"))
+    room = Image.merge("RGB", [Image.effect_noise(room_size, sigma) for sigma in (40, 60, 80)])
+    room.save(os.path.join(directory, "input", "room", "room.jpg"), quality=90)
+    Image.new("RGBA", (1200, 800), color=(150, 30, 30, 255)).save(os.path.join(directory, "input", "asset", "asset.png"))
+
+
+def run_mode(mode: str, resources: str, base_url: str, runs: int, parallel: int, budget_mb: int) -> dict:
+    """Renders in this process with the loading of [mode] and returns the peak RSS and the latency."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = Configuration(resources)
+    config.llm_api_key = "fake"
+    config.llm_base_url = base_url
+    config.image_draft_decoding = mode == "after"
+    config.image_memory_budget_bytes = budget_mb * 1024 * 1024 if mode == "after" else None
+    # the fake server has no quota, don't let the rate scheduler wait for it
+    processor = ImageProcessor(config, LlmClient(config, ResilientCaller.from_config(config), rate_scheduler=RateScheduler({})))
+
+    def render(_):
+        start = time.perf_counter()
+        processor.insert_asset_into_room("asset.png", "room.jpg", ASSET_DIMENSIONS, concurrent=True)
+        return time.perf_counter() - start
+
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=parallel) as executor:
+        latencies = sorted(executor.map(render, range(runs)))
+    wall_seconds = time.perf_counter() - start
+    budget = ImageMemoryBudget.shared(config)
+    return {
+        "mode": mode,
+        "baseline_rss_mb": baseline,
+        "peak_rss_mb": max_rss_mb(),
+        "peak_rss_per_render_mb": (max_rss_mb() - baseline) / parallel,
+        "budget_peak_mb": budget.peak / 1024 / 1024 if budget is not None else None,
+        "p50": latencies[len(latencies) // 2],
+        "throughput": runs / wall_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--room-size", default="4000x3000", help="size of the room photo, 4000x3000 is 12 megapixel")
+    parser.add_argument("--runs", type=int, default=16, help="renders per mode")
+    parser.add_argument("--parallel", type=int, default=8, help="renders in flight at the same time")
+    parser.add_argument("--latency", type=float, default=0.2, help="median latency of generateContent in seconds")
+    parser.add_argument("--budget-mb", type=int, default=Configuration.image_memory_budget_bytes // 1024 // 1024, help="memory budget of the after mode")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--resources", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if resource is None:
+        parser.error("the peak RSS can't be measured on this platform")
+
+    if args.mode:
+        # a child process of one mode, prints its result as JSON
+        print(json.dumps(run_mode(args.mode, args.resources, args.base_url, args.runs, args.parallel, args.budget_mb)))
+        return
+
+    width, height = (int(value) for value in args.room_size.lower().split("x"))
+    image_models = [Configuration.llm_model_name_image_processing, Configuration.llm_model_name_image_processing_fallback]
+    settings = FakeGeminiSettings(latency_seconds=args.latency, latency_sigma=0.1)
+    with FakeGeminiServer(settings, image_models) as server, tempfile.TemporaryDirectory() as resources:
+        write_resources(resources, (width, height))
+        print(f"room {width}x{height}, {args.runs} renders, {args.parallel} in flight")
+        print(f"{'mode':>8} {'baseline':>9} {'peak rss':>9} {'per render':>10} {'budget peak':>11} {'p50':>7} {'renders/s':>9}")
+        for mode in MODES:
+            command = [sys.executable, "-m", "benchmarks.memory_benchmark", "--mode", mode, "--resources", resources, "--base-url", server.base_url,
+                       "--runs", str(args.runs), "--parallel", str(args.parallel), "--budget-mb", str(args.budget_mb)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            budget_peak = f"{result['budget_peak_mb']:.0f}MB" if result["budget_peak_mb"] is not None else "-"
+            print(f"{mode:>8} {result['baseline_rss_mb']:>7.0f}MB {result['peak_rss_mb']:>7.0f}MB {result['peak_rss_per_render_mb']:>8.1f}MB "
+                  f"{budget_peak:>11} {result['p50']:>6.2f}s {result['throughput']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Measures the serial, concurrent and batched pipelines against the local fake Gemini server, without network or API key.
+
+For every room image in tests/resources (from small to large) the benchmark renders the asset of the same resources
+folder [--runs] times, with [--parallel] renders in flight at the same time:
+- serial: ImageProcessor.insert_asset_into_room, one stage after the other
+- concurrent: ImageProcessor.insert_asset_into_room with concurrent=True
+- batched: BatchRenderer.render with all runs in one set of batch jobs
+
+and reports the p50/p95/p99 latency of a render, the throughput in renders per second and the peak memory.
+
+Usage: python -m benchmarks.pipeline_benchmark --latency 0.5 --error-rate 0.05 --runs 20 --parallel 4
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from benchmarks.fake_gemini import FakeGeminiServer, FakeGeminiSettings
+from src.batch_renderer import BatchRenderer, RenderJob
+from src.config import Configuration
+from src.image_processor import ImageProcessor
+from src.llm_client import LlmClient
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "resources")
+ASSET_DIMENSIONS = "width=220 cm, depth=90 cm, height=80 cm"
+PIPELINES = ("serial", "concurrent", "batched")
+
+
+def percentile(values: list, p: float) -> float:
+    """Returns the [p]th percentile of [values] with linear interpolation between the closest ranks."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def find_rooms(resources_path: str = RESOURCES_PATH) -> list:
+    """Returns (resources folder, room file name, asset file name, room size) for every room image, smallest first."""
+    rooms = []
+    for folder in sorted(os.listdir(resources_path)):
+        room_path = os.path.join(resources_path, folder, "input", "room")
+        asset_path = os.path.join(resources_path, folder, "input", "asset")
+        if not os.path.isdir(room_path) or not os.path.isdir(asset_path) or not os.listdir(asset_path):
+            continue
+        asset = sorted(os.listdir(asset_path))[0]
+        for room in sorted(os.listdir(room_path)):
+            with Image.open(os.path.join(room_path, room)) as image:
+                size = image.size
+            rooms.append((os.path.join(resources_path, folder), room, asset, size))
+    return sorted(rooms, key=lambda entry: entry[3][0] * entry[3][1])
+
+
+def run_serial(config, room, asset, runs, parallel, concurrent=False) -> list:
+    """Renders [runs] times through ImageProcessor and returns the latency of every render."""
+    # the fake server has no quota, don't let the rate scheduler wait for it
+    processor = ImageProcessor(config, LlmClient(config, ResilientCaller.from_config(config), rate_scheduler=RateScheduler({})))
+
+    def render(_):
+        start = time.perf_counter()
+        processor.insert_asset_into_room(asset, room, ASSET_DIMENSIONS, concurrent=concurrent)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return list(executor.map(render, range(runs)))
+
+
+def run_concurrent(config, room, asset, runs, parallel) -> list:
+    return run_serial(config, room, asset, runs, parallel, concurrent=True)
+
+
+def run_batched(config, room, asset, runs, parallel) -> list:
+    """Renders [runs] times in one BatchRenderer.render call, every render takes as long as the whole batch."""
+    start = time.perf_counter()
+    results = BatchRenderer(config).render([RenderJob(room, asset, ASSET_DIMENSIONS) for _ in range(runs)])
+    seconds = time.perf_counter() - start
+    return [seconds for result in results if result["status"] == "succeeded"]
+
+
+def measure(run, config, room, asset, runs, parallel, verbose=False) -> dict:
+    """Runs one pipeline and returns its latency percentiles, throughput and memory."""
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with output:
+            latencies = run(config, room, asset, runs, parallel)
+    finally:
+        wall_seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "renders": len(latencies),
+        "p50": percentile(latencies, 50) if latencies else float("nan"),
+        "p95": percentile(latencies, 95) if latencies else float("nan"),
+        "p99": percentile(latencies, 99) if latencies else float("nan"),
+        "throughput": len(latencies) / wall_seconds,
+        "python_peak_mb": peak / 1024 / 1024,
+        # ru_maxrss is in kB on Linux, it only grows, so it is the peak of the process so far
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="median latency of generateContent in seconds")
+    parser.add_argument("--sigma", type=float, default=0.3, help="spread of the log-normal latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail with a 503")
+    parser.add_argument("--batch-seconds", type=float, default=2.0, help="time until a batch job succeeds")
+    parser.add_argument("--image-size", default="1024x768", help="size of the images returned by the fake server")
+    parser.add_argument("--runs", type=int, default=10, help="renders per room image and pipeline")
+    parser.add_argument("--parallel", type=int, default=1, help="renders in flight at the same time")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="comma separated subset of " + ", ".join(PIPELINES))
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="show the output of the pipelines")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.image_size.lower().split("x"))
+    settings = FakeGeminiSettings(latency_seconds=args.latency, latency_sigma=args.sigma, batch_seconds=args.batch_seconds,
+                                  error_rate=args.error_rate, image_size=(width, height), seed=args.seed)
+    runners = {"serial": run_serial, "concurrent": run_concurrent, "batched": run_batched}
+    pipelines = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+
+    image_models = [Configuration.llm_model_name_image_processing, Configuration.llm_model_name_image_processing_fallback]
+    with FakeGeminiServer(settings, image_models) as server, tempfile.TemporaryDirectory() as output_path:
+        print(f"{'room':<40} {'size':>10} {'pipeline':>10} {'renders':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'renders/s':>9} {'py peak':>8} {'max rss':>8}")
+        for resources, room, asset, size in find_rooms():
+            with contextlib.redirect_stdout(io.StringIO()):
+                config = Configuration(resources)
+            config.llm_api_key = "fake"
+            config.llm_base_url = server.base_url
+            config.output_path = output_path
+            config.batch_poll_interval_seconds = min(1.0, args.batch_seconds / 4)
+            for name in pipelines:
+                result = measure(runners[name], config, room, asset, args.runs, args.parallel, args.verbose)
+                print(f"{room[:40]:<40} {size[0]:>4}x{size[1]:<5} {name:>10} {result['renders']:>7} {result['p50']:>6.2f}s {result['p95']:>6.2f}s "
+                      f"{result['p99']:>6.2f}s {result['throughput']:>9.2f} {result['python_peak_mb']:>6.0f}MB {result['max_rss_mb']:>6.0f}MB")
+        print(f"fake server: {server.counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,138 @@
 import os
+import threading
+import time
+from dataclasses import dataclass
 
 from PIL import Image, UnidentifiedImageError
 
 from src.config import Configuration
 
 
+@dataclass
+class ImageEntry:
+    """An image file in an ImageIndex, read from the header of the file."""
+    name: str
+    path: str
+    format: str
+    size: tuple      # (width, height) in pixels
+    mtime_ns: int
+    file_size: int
+
+
+class ImageIndex:
+    """An index of the image files in a directory, with their format, dimensions and modification time.
+
+    The directory is read with os.scandir and only the header of every file is read, the pixels are never decoded.
+    refresh() only reads the files that are new or changed (by mtime and size) since the last scan, so a catalogue
+    with tens of thousands of images can be refreshed cheaply. Lookups by name and iteration use the index and never
+    touch the directory, unless [max_age_seconds] is given: then the index is refreshed when it is older than that.
+    """
+
+    def __init__(self, directory: str, max_age_seconds: float = None):
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self.scanned_at = None
+        self._entries = {}      # name -> ImageEntry
+        self._skipped = {}      # name -> (mtime_ns, file size) of files that are not images
+        self._lock = threading.Lock()
+
+
+    def refresh(self) -> dict:
+        """Scans the directory and updates the index.
+
+        Returns:
+            dict: the number of images that were added, updated and removed.
+
+        Raises:
+            FileNotFoundError: If the directory does not exist.
+        """
+        with self._lock:
+            counts = {"added": 0, "updated": 0, "removed": 0}
+            seen = set()
+            with os.scandir(self.directory) as entries:
+                for dir_entry in entries:
+                    if not dir_entry.is_file():
+                        continue
+                    seen.add(dir_entry.name)
+                    stat = dir_entry.stat()
+                    signature = (stat.st_mtime_ns, stat.st_size)
+                    known = self._entries.get(dir_entry.name)
+                    if (known is not None and (known.mtime_ns, known.file_size) == signature) or self._skipped.get(dir_entry.name) == signature:
+                        continue
+
+                    image_entry = self._read_header(dir_entry.name, dir_entry.path, signature)
+                    if image_entry is None:
+                        self._skipped[dir_entry.name] = signature
+                        if self._entries.pop(dir_entry.name, None) is not None:
+                            counts["removed"] += 1
+                        continue
+                    self._skipped.pop(dir_entry.name, None)
+                    self._entries[dir_entry.name] = image_entry
+                    counts["updated" if known is not None else "added"] += 1
+
+            for name in set(self._entries) - seen:
+                del self._entries[name]
+                counts["removed"] += 1
+            for name in set(self._skipped) - seen:
+                del self._skipped[name]
+            self.scanned_at = time.monotonic()
+            return counts
+
+
+    def get(self, name: str):
+        """Returns the ImageEntry of the image file [name], or None when it isn't an image in the directory."""
+        self._refresh_if_stale()
+        return self._entries.get(name)
+
+
+    def first(self):
+        """Returns the entry of the first image by name, or None when the directory has no images."""
+        self._refresh_if_stale()
+        with self._lock:
+            return self._entries[min(self._entries)] if self._entries else None
+
+
+    def __iter__(self):
+        """Iterates over the entries in order of name."""
+        self._refresh_if_stale()
+        with self._lock:
+            entries = [self._entries[name] for name in sorted(self._entries)]
+        return iter(entries)
+
+
+    def __len__(self):
+        self._refresh_if_stale()
+        return len(self._entries)
+
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+
+    def _refresh_if_stale(self):
+        if self.scanned_at is None or (self.max_age_seconds is not None and time.monotonic() - self.scanned_at > self.max_age_seconds):
+            self.refresh()
+
+
+    @staticmethod
+    def _read_header(name, path, signature):
+        try:
+            # Image.open only reads the header, the pixels are decoded on the first access
+            with Image.open(path) as image:
+                return ImageEntry(name, path, image.format, image.size, signature[0], signature[1])
+        except (UnidentifiedImageError, OSError):
+            return None
+
+
 class ImageOpener:
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
     @staticmethod
     def open_image(path):
         """
         Find a file in [path] and if this file is an image, return this as a PIL.Image. Otherwise raise an exception.
-        If [path] is a directory, it will try to open the first file found in that directory.
+        If [path] is a directory, it will open the first image (by name) in that directory.
 
         Args:
             path (str): a path to an image file or a directory containing one.
@@ -19,14 +141,21 @@ class ImageOpener:
             Image: when a file is found, return this as a PIL Image.
 
         Raises:
-            FileNotFoundError: If the path does not exist, or if it's an empty directory.
+            FileNotFoundError: If the path does not exist, or if it's a directory without images.
             ValueError: If the file is not a valid or supported image format.
         """
         if os.path.isdir(path):
-            files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
-            if not files:
-                raise FileNotFoundError(f"No files found in directory: {path}")
-            path = os.path.join(path, files[0])
+            # the index is rescanned when it is older than Configuration.image_index_max_age_seconds, or on a miss:
+            # the first image may have been removed, or the directory had no images yet, since the last scan
+            index = ImageOpener.index(path)
+            scanned_at = index.scanned_at
+            entry = index.first()
+            if (entry is None or not os.path.isfile(entry.path)) and index.scanned_at == scanned_at:
+                index.refresh()
+                entry = index.first()
+            if entry is None:
+                raise FileNotFoundError(f"No image files found in directory: {path}")
+            path = entry.path
 
         if not os.path.isfile(path):
             raise FileNotFoundError(f"No file found at path: {path}")
@@ -35,3 +164,13 @@ class ImageOpener:
             return image
         except UnidentifiedImageError:
             raise ValueError(f"The file at {path} is not a valid image.")
+
+
+    @staticmethod
+    def index(directory: str) -> ImageIndex:
+        """Returns the ImageIndex of [directory], shared by all callers in the process so it is only built once."""
+        key = os.path.abspath(directory)
+        with ImageOpener._indexes_lock:
+            if key not in ImageOpener._indexes:
+                ImageOpener._indexes[key] = ImageIndex(key, Configuration.image_index_max_age_seconds)
+            return ImageOpener._indexes[key]
@@ -0,0 +1,230 @@
+import asyncio
+import time
+
+import google.genai as genai
+from google.genai import errors
+
+from src.config import Configuration
+from src.file_store import UploadedFileStore
+from src.image_preparation import ImagePreparer
+from src.image_utils import response_image, response_text
+from src.llm_client import create_genai_client
+from src.metrics import Metrics, request_bytes, request_event
+from src.rate_scheduler import INTERACTIVE, RateScheduler, estimate_tokens
+from src.resilience import ResilientCaller
+from src.transport import REPLAY, CassetteTransport
+from src.prompts import (
+    ASSET_DIMENSIONS_CONFIG, ASSET_DIMENSIONS_PROMPT, COMBINE_IMAGES_CONFIG, LOCATION_ORIENTATION_CONFIG, REMOVE_ASSET_CONFIG, ROOM_ANALYSIS_CONFIG,
+    combine_images_prompt, location_orientation_prompt, remove_asset_prompt, room_analysis_prompt,
+)
+from src.room_analysis import RoomAnalysis
+
+
+class AsyncLlmClient:
+    """Asyncio counterpart of LlmClient.
+
+    All requests go through the aio surface of one genai.Client, so they share one HTTP connection pool.
+    Pass the same [client] to multiple instances to share the pool between them as well.
+    The number of requests in flight is limited per model by [Configuration.llm_max_concurrent_requests].
+    Temporary errors are retried by the same ResilientCaller and the requests are scheduled by the same RateScheduler
+    as the sync client.
+    """
+
+    def __init__(self, config: Configuration, client: genai.Client = None, resilient_caller: ResilientCaller = None, metrics: Metrics = None,
+                 rate_scheduler: RateScheduler = None, lane: str = INTERACTIVE, transport: CassetteTransport = None):
+        self.config = config
+        self.transport = transport if transport is not None else CassetteTransport.from_config(self.config)
+        # a replay never calls the API, so it doesn't need an API key
+        if client is None and self.transport.mode != REPLAY:
+            client = create_genai_client(self.config)
+        self.client = client
+        self.metrics = metrics if metrics is not None else Metrics.from_config(self.config)
+        self.resilient_caller = resilient_caller if resilient_caller is not None else ResilientCaller.shared(self.config)
+        self.rate_scheduler = rate_scheduler if rate_scheduler is not None else RateScheduler.shared(self.config)
+        self.lane = lane
+        # with the Files API every distinct image is uploaded once and referenced by URI in all stages
+        file_store = UploadedFileStore(self.client.files, metrics=self.metrics) if self.config.llm_use_files_api and self.client is not None else None
+        self.image_preparer = ImagePreparer.from_config(self.config, file_store)
+        self._semaphores = {}
+
+
+    async def remove_asset_from_image(self, room, asset_name, model: str = None):
+        """Removes an asset from an image using an LLM, see LlmClient.remove_asset_from_image.
+
+        Args:
+            room (Image): A PIL Image object of the room.
+            asset_name (str): The name of the asset to be removed from the image.
+            model (str): The image model to use instead of the configured one (without fallback), e.g. for a preview.
+
+        Returns:
+            Image: A PIL Image object with the specified asset removed.
+
+        Raises:
+            RuntimeError: If the image cleanup process fails.
+            LlmUnavailableError: If the model (and its fallback) keeps failing after retrying.
+        """
+        response = await self._generate_content(
+            "remove_asset",
+            model=model or self.config.llm_model_name_image_processing,
+            contents=[remove_asset_prompt(asset_name), room],
+            config=REMOVE_ASSET_CONFIG,
+            fallback_model=None if model else self.config.llm_model_name_image_processing_fallback
+        )
+
+        image = response_image(response)
+        if image is not None:
+            print(f"Removed the {asset_name} from the image!")
+            return image
+
+        raise RuntimeError("image cleanup failed")
+
+
+    async def combine_images(self, room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset,
+                             model: str = None, asset_name: str = "sofa"):
+        """Combines a room image with an asset image using a generative model, see LlmClient.combine_images.
+
+        Args:
+            room_image_with_missing_asset (Image): A PIL Image of the room where the asset will be placed.
+            asset_image (Image): A PIL Image of the asset to place in the room.
+            room_dimensions (str): A string describing the dimensions of existing assets in the room.
+            asset_dimensions (str): A string describing the dimensions of the new asset.
+            location_orientation_asset (str): A string describing the desired location and orientation of the new asset.
+            model (str): The image model to use instead of the configured one (without fallback), e.g. for a preview.
+            asset_name (str): the type of asset to place (e.g. sofa, bed).
+
+        Returns:
+            Image: A new PIL Image object showing the room with the asset placed inside.
+
+        Raises:
+            LlmUnavailableError: If the model (and its fallback) keeps failing after retrying.
+        """
+        response = await self._generate_content(
+            "combine",
+            model=model or self.config.llm_model_name_image_processing,
+            contents=[combine_images_prompt(room_dimensions, asset_dimensions, location_orientation_asset, asset_name), room_image_with_missing_asset, asset_image],
+            config=COMBINE_IMAGES_CONFIG,
+            fallback_model=None if model else self.config.llm_model_name_image_processing_fallback
+        )
+
+        print("Afbeelding succesvol gegenereerd!")
+        return response_image(response)
+
+
+    async def get_asset_dimensions(self, room_image) -> str:
+        """Estimates the dimensions of assets within an image, see LlmClient.get_asset_dimensions.
+
+        Args:
+            room_image (Image): A PIL Image object of the room containing assets.
+
+        Returns:
+            str: A formatted string listing each asset and its estimated dimensions.
+        """
+        response = await self._generate_content(
+            "dimensions",
+            model=self.config.llm_model_name_dimensions,
+            contents=[ASSET_DIMENSIONS_PROMPT, room_image],
+            config=ASSET_DIMENSIONS_CONFIG
+        )
+
+        return response_text(response)
+
+
+    async def get_asset_location_orientation(self, room_image, asset_name) -> str:
+        """Determines the location and orientation of an asset in an image, see LlmClient.get_asset_location_orientation.
+
+        Args:
+            room_image (Image): A PIL Image object of the room containing the asset.
+            asset_name (str): The name of the asset for which to determine location and orientation.
+
+        Returns:
+            str: A formatted string describing the asset's location and orientation.
+        """
+        response = await self._generate_content(
+            "location_orientation",
+            model=self.config.llm_model_name_dimensions,
+            contents=[location_orientation_prompt(asset_name), room_image],
+            config=LOCATION_ORIENTATION_CONFIG
+        )
+
+        return response_text(response)
+
+
+    async def analyze_room(self, room_image, asset_name) -> RoomAnalysis:
+        """Estimates the dimensions of the assets and the placement of an asset in one request, see LlmClient.analyze_room.
+
+        Args:
+            room_image (Image): A PIL Image object of the room containing the asset.
+            asset_name (str): The name of the asset for which to determine location, orientation and bounding box.
+
+        Returns:
+            RoomAnalysis: the dimensions of all assets and the location, orientation and bounding box of [asset_name].
+        """
+        response = await self._generate_content(
+            "analysis",
+            model=self.config.llm_model_name_dimensions,
+            contents=[room_analysis_prompt(asset_name), room_image],
+            config=ROOM_ANALYSIS_CONFIG
+        )
+
+        return RoomAnalysis.from_json(response.text)
+
+
+    async def _generate_content(self, stage, model, contents, config, fallback_model=None):
+        attempts = []
+
+        async def send(current_model):
+            prepared = await prepare(current_model)
+            try:
+                return await send_prepared(current_model, prepared)
+            except errors.ClientError as error:
+                if not self.image_preparer.forget_missing_files(error, prepared):
+                    raise
+            # an uploaded image expired or was deleted by the server, upload it again and send the request once more
+            print(f"An uploaded image of the {stage} request was not found, uploading it again")
+            return await send_prepared(current_model, await prepare(current_model))
+
+        async def prepare(current_model):
+            # downsizing and encoding the images is CPU bound, keep it off the event loop
+            prepared = await asyncio.get_running_loop().run_in_executor(None, self.image_preparer.prepare_contents, current_model, contents)
+            if self.metrics.enabled:
+                attempts.append((current_model, request_bytes(prepared)))
+            return prepared
+
+        async def send_prepared(current_model, prepared):
+            tokens = await self._input_tokens(current_model, contents, prepared)
+            await self.rate_scheduler.acquire_async(current_model, tokens, self.lane)
+            async with self._get_semaphore(current_model):
+                response = await self.client.aio.models.generate_content(model=current_model, contents=prepared, config=config)
+            if tokens:
+                usage = response.usage_metadata
+                self.rate_scheduler.record_usage(current_model, tokens, usage.prompt_token_count if usage is not None else None)
+            return response
+
+        async def request(current_model):
+            return await self.transport.generate_content_async(current_model, contents, config, lambda: send(current_model))
+
+        if not self.metrics.enabled:
+            return await self.resilient_caller.call_async(model, request, fallback_model)
+
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.resilient_caller.call_async(model, request, fallback_model)
+            return response
+        finally:
+            self.metrics.record(request_event(stage, model, time.perf_counter() - start, attempts, response))
+
+
+    async def _input_tokens(self, model, contents, prepared) -> int:
+        if model not in self.rate_scheduler.limits:
+            return 0
+        if self.config.llm_rate_count_tokens:
+            return (await self.client.aio.models.count_tokens(model=model, contents=prepared)).total_tokens or 0
+        return estimate_tokens(contents, self.image_preparer.max_sizes.get(model, self.image_preparer.default_max_size))
+
+
+    def _get_semaphore(self, model) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            limit = self.config.llm_max_concurrent_requests.get(model, self.config.llm_max_concurrent_requests_default)
+            self._semaphores[model] = asyncio.Semaphore(limit)
+        return self._semaphores[model]
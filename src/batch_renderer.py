@@ -0,0 +1,280 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+
+from google.genai import types
+
+from src.config import Configuration
+from src.dimensions import combine_asset_dimensions
+from src.exceptions import BatchJobFailedError
+from src.image_loading import decode_max_size, load_image
+from src.image_preparation import ImagePreparer
+from src.image_utils import response_image
+from src.llm_client import create_genai_client
+from src.prompts import COMBINE_IMAGES_CONFIG, REMOVE_ASSET_CONFIG, ROOM_ANALYSIS_CONFIG, combine_images_prompt, remove_asset_prompt, room_analysis_prompt
+from src.room_analysis import RoomAnalysis
+
+_FINISHED_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+@dataclass
+class RenderJob:
+    """One combination of a room and an asset to render."""
+    room: str
+    asset: str
+    asset_dimensions: str
+    asset_name: str = "sofa"
+
+
+def load_manifest(path: str) -> list:
+    """Reads the render jobs from a JSON file.
+
+    The file contains a list of objects with the keys room, asset, asset_dimensions and optionally asset_name.
+    Room and asset are file names, relative to the room and asset folder of the configuration.
+
+    Args:
+        path (str): path to the manifest file.
+
+    Returns:
+        list: a list of RenderJob objects.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [RenderJob(**entry) for entry in json.load(f)]
+
+
+class BatchRenderer:
+    """Renders many room/asset combinations with batchGenerateContent instead of one generate_content call per stage.
+
+    The pipeline is submitted in two stages:
+        1. the analysis of every distinct room and asset type (dimensions, location & orientation) on the dimensions model
+           and the removal of the asset from every distinct room on the image model, as two batch jobs running side by side.
+        2. the combination of every cleaned room with its new asset, as one batch job on the image model.
+
+    Jobs with a failed request in stage 1 are skipped in stage 2 and reported as failed, like the jobs with a request
+    in a batch job that failed or expired as a whole.
+
+    The requests and their images are sent inline, and the inline requests of one batch job are limited to about 20 MB.
+    The requests of a stage are therefore split over as many batch jobs as needed to stay below
+    Configuration.batch_max_inline_bytes each, so thousands of combinations can be rendered.
+    """
+
+    def __init__(self, config: Configuration, batches=None):
+        """
+        Args:
+            config (Configuration): the configuration with the models and the output path.
+            batches: the batches API to use, defaults to genai.Client.batches. Can be replaced by a stub in tests.
+        """
+        self.config = config
+        if batches is None:
+            # keep the client alive, its HTTP connection is closed when it is garbage collected
+            self._client = create_genai_client(config)
+            batches = self._client.batches
+        self.batches = batches
+        self.image_preparer = ImagePreparer.from_config(config)
+
+
+    def render(self, jobs: list) -> list:
+        """Renders all jobs and writes the resulting images and a batch-results.json to the output path.
+
+        The requests of a batch job are built (and the rooms and assets decoded) just before it is submitted, so only
+        the requests of one batch job are held in memory. When a batch job as a whole doesn't succeed, only the jobs
+        with a request in that batch job are reported as failed.
+
+        Args:
+            jobs (list): the RenderJob objects to render.
+
+        Returns:
+            list: one result dict per job with the keys job, status, output and error.
+        """
+        max_size = decode_max_size(self.config)
+        analysis_keys = sorted({(job.room, job.asset_name) for job in jobs})
+        room_errors = {}        # room file name -> error when it couldn't be loaded
+
+        # stage 1: analysis on the dimensions model and asset removal on the image model, submitted at the same time
+        analysis_keys_sent, removal_keys_sent = [], []
+        analysis_jobs = self._submit(self.config.llm_model_name_dimensions, "analysis", self._room_requests(
+            self.config.llm_model_name_dimensions, room_analysis_prompt, ROOM_ANALYSIS_CONFIG, analysis_keys, analysis_keys_sent, room_errors, max_size))
+        removal_jobs = self._submit(self.config.llm_model_name_image_processing, "removal", self._room_requests(
+            self.config.llm_model_name_image_processing, remove_asset_prompt, REMOVE_ASSET_CONFIG, analysis_keys, removal_keys_sent, room_errors, max_size))
+        analysis = dict(zip(analysis_keys_sent, self._collect(analysis_jobs)))
+        removal = dict(zip(removal_keys_sent, self._collect(removal_jobs)))
+
+        # stage 2: combine the cleaned rooms with the new assets
+        results = []
+        combined = []       # (index, result) of every combine request, in the order of the requests
+        combine_jobs = self._submit(self.config.llm_model_name_image_processing, "combine",
+                                    self._combine_requests(jobs, analysis, removal, room_errors, results, combined, max_size))
+        for (index, result), response in zip(combined, self._collect(combine_jobs)):
+            self._save(index, result, response)
+
+        self._write_results(results)
+        return results
+
+
+    def _room_requests(self, model, prompt, config, keys, sent, room_errors, max_size):
+        """Yields the request of every (room, asset name) of [keys], the keys whose request was built are added to [sent].
+
+        [keys] are sorted by room, so every room is decoded once. A room that can't be loaded is added to [room_errors].
+        """
+        room_file_name, room = None, None
+        for key in keys:
+            if key[0] in room_errors:
+                continue
+            if key[0] != room_file_name:
+                room_file_name, room = key[0], None
+                try:
+                    room = load_image(self.config.get_room_image_path(key[0]), "Room", max_size)
+                except (OSError, ValueError) as e:
+                    room_errors[key[0]] = e
+                    continue
+            sent.append(key)
+            yield self._request(model, [prompt(key[1]), room], config)
+
+
+    def _combine_requests(self, jobs, analysis, removal, room_errors, results, combined, max_size):
+        """Yields the combine request of every job whose stage 1 succeeded, adds the result dict of every job to [results]."""
+        for index, job in enumerate(jobs):
+            result = {"job": asdict(job), "status": "failed", "output": None, "error": None}
+            results.append(result)
+            if job.room in room_errors:
+                result["error"] = f"stage 1 failed: {room_errors[job.room]}"
+                continue
+            try:
+                room_analysis = RoomAnalysis.from_json(self._stage_response(analysis, (job.room, job.asset_name)).text)
+                room_without_asset = response_image(self._stage_response(removal, (job.room, job.asset_name)))
+                if room_without_asset is None:
+                    raise ValueError(f"no image returned when removing the {job.asset_name}")
+                asset_image = load_image(self.config.get_asset_image_path(job.asset), "Asset", max_size)
+            except (AttributeError, BatchJobFailedError, KeyError, OSError, TypeError, ValueError) as e:
+                result["error"] = f"stage 1 failed: {e}"
+                continue
+
+            asset_dimensions = combine_asset_dimensions(self.config, job.asset_dimensions, room_analysis, job.asset_name, room_without_asset.size)
+            prompt = combine_images_prompt(room_analysis.dimensions_text(), asset_dimensions, room_analysis.location_orientation_text(), job.asset_name)
+            combined.append((index, result))
+            yield self._request(self.config.llm_model_name_image_processing, [prompt, room_without_asset, asset_image], COMBINE_IMAGES_CONFIG)
+
+
+    @staticmethod
+    def _stage_response(responses, key):
+        """Returns the stage 1 response of [key], raises the BatchJobFailedError when its batch job didn't succeed."""
+        response = responses[key]
+        if isinstance(response, BatchJobFailedError):
+            raise response
+        return response
+
+
+    def _request(self, model, contents, config) -> types.InlinedRequest:
+        parts = [types.Part.from_text(text=content) if isinstance(content, str) else self.image_preparer.prepare(content, model) for content in contents]
+        return types.InlinedRequest(model=model, contents=[types.Content(role="user", parts=parts)], config=config)
+
+
+    def _submit(self, model, stage, requests) -> list:
+        """Submits [requests] in batch jobs below Configuration.batch_max_inline_bytes, returns (batch job, number of requests) per job.
+
+        [requests] is consumed lazily: every batch job is submitted as soon as its requests are built.
+        """
+        jobs = []
+        for number, chunk in enumerate(self._chunks(requests), start=1):
+            display_name = f"home-design-{stage}" if number == 1 else f"home-design-{stage}-{number}"
+            print(f"Submitting {stage} batch {number} with {len(chunk)} requests to {model}")
+            jobs.append((self.batches.create(model=model, src=chunk, config=types.CreateBatchJobConfig(display_name=display_name)), len(chunk)))
+        return jobs
+
+
+    def _chunks(self, requests):
+        """Yields [requests] in order in lists whose inline size stays below Configuration.batch_max_inline_bytes."""
+        chunk = []
+        size = 0
+        for request in requests:
+            request_size = self._inline_bytes(request)
+            if chunk and size + request_size > self.config.batch_max_inline_bytes:
+                yield chunk
+                chunk = []
+                size = 0
+            # a request that is larger than the limit on its own still gets a batch job
+            chunk.append(request)
+            size += request_size
+        if chunk:
+            yield chunk
+
+
+    @staticmethod
+    def _inline_bytes(request: types.InlinedRequest) -> int:
+        total = 0
+        for content in request.contents:
+            for part in content.parts:
+                if part.text is not None:
+                    total += len(part.text.encode("utf-8"))
+                elif part.inline_data is not None:
+                    # the images are sent base64 encoded, 4 bytes for every 3 bytes of image data
+                    total += (len(part.inline_data.data) + 2) // 3 * 4
+        return total
+
+
+    def _collect(self, jobs):
+        """Waits for the batch jobs of _submit and yields their responses in the order of the requests.
+
+        The response of a request that failed is None. For every request of a batch job that didn't succeed as a whole,
+        the BatchJobFailedError is yielded instead, so the other batch jobs are still collected.
+        """
+        for batch_job, count in jobs:
+            try:
+                responses = self._responses(self._wait(batch_job), count)
+            except BatchJobFailedError as e:
+                print(e)
+                responses = [e] * count
+            yield from responses
+
+
+    def _wait(self, batch_job):
+        """Polls the batch job until it is finished and returns it. Raises BatchJobFailedError if it didn't succeed."""
+        deadline = time.monotonic() + self.config.batch_timeout_seconds
+        while self._state(batch_job) not in _FINISHED_STATES:
+            if time.monotonic() > deadline:
+                raise BatchJobFailedError(f"Batch job {batch_job.name} did not finish within {self.config.batch_timeout_seconds} seconds")
+            time.sleep(self.config.batch_poll_interval_seconds)
+            batch_job = self.batches.get(name=batch_job.name)
+
+        if self._state(batch_job) != "JOB_STATE_SUCCEEDED":
+            raise BatchJobFailedError(f"Batch job {batch_job.name} ended with state {self._state(batch_job)}: {batch_job.error}")
+        print(f"Batch job {batch_job.name} succeeded")
+        return batch_job
+
+
+    @staticmethod
+    def _state(batch_job) -> str:
+        return getattr(batch_job.state, "name", batch_job.state)
+
+
+    @staticmethod
+    def _responses(batch_job, count) -> list:
+        """Returns the responses of the batch job in the order of the requests, None for requests that failed."""
+        inlined_responses = batch_job.dest.inlined_responses if batch_job.dest is not None else None
+        if not inlined_responses or len(inlined_responses) != count:
+            raise BatchJobFailedError(f"Batch job {batch_job.name} returned {len(inlined_responses or [])} responses for {count} requests")
+        return [inlined.response if inlined.error is None else None for inlined in inlined_responses]
+
+
+    def _save(self, index, result, response):
+        if isinstance(response, BatchJobFailedError):
+            result["error"] = f"stage 2 failed: {response}"
+            return
+        image = response_image(response) if response is not None else None
+        if image is None:
+            result["error"] = "stage 2 failed: no image returned"
+            return
+
+        job = result["job"]
+        file_name = f"{index:05d}-{os.path.splitext(job['room'])[0]}-{os.path.splitext(job['asset'])[0]}.png"
+        os.makedirs(self.config.output_path, exist_ok=True)
+        image.save(os.path.join(self.config.output_path, file_name))
+        result["status"] = "succeeded"
+        result["output"] = file_name
+
+
+    def _write_results(self, results):
+        os.makedirs(self.config.output_path, exist_ok=True)
+        with open(os.path.join(self.config.output_path, "batch-results.json"), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
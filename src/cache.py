@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from src.config import Configuration
+from src.image_utils import image_digest
+from src.llm_client import LlmClient
+from src.metrics import MetricEvent, Metrics
+from src.prompts import (
+    ASSET_DIMENSIONS_CONFIG, ASSET_DIMENSIONS_PROMPT, LOCATION_ORIENTATION_CONFIG, REMOVE_ASSET_CONFIG, ROOM_ANALYSIS_CONFIG,
+    location_orientation_prompt, remove_asset_prompt, room_analysis_prompt,
+)
+from src.room_analysis import RoomAnalysis
+
+
+class DiskCache:
+    """A size bounded cache on disk for text results and PIL images.
+
+    Every entry is one file in [directory]: text is stored as .txt, images as .png. When the total size exceeds
+    [max_bytes], the least recently used entries are removed. The file modification time is updated on every hit,
+    so the LRU order survives a restart of the process.
+    """
+
+    _EXTENSIONS = (".txt", ".png")
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()     # file name -> size in bytes, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_entries()
+
+
+    @classmethod
+    def shared(cls, config: Configuration) -> "DiskCache":
+        """Returns the cache of Configuration.cache_path shared by the clients in the process, so its size is counted once."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(config.cache_path, config.cache_max_bytes)
+            return cls._shared
+
+
+    def get(self, key: str):
+        """Returns the cached text or image for [key], or None when it is not in the cache."""
+        with self._lock:
+            file_name = self._find(key)
+            if file_name is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(file_name)
+
+        path = os.path.join(self.directory, file_name)
+        try:
+            os.utime(path)
+            if file_name.endswith(".txt"):
+                with open(path, encoding="utf-8") as f:
+                    return f.read()
+            with Image.open(path) as image:
+                image.load()
+                return image
+        except OSError:
+            # removed by another process, treat as a miss
+            with self._lock:
+                self._forget(file_name)
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+
+    def put(self, key: str, value):
+        """Stores [value] (str or PIL Image) under [key] and evicts the least recently used entries when needed."""
+        if isinstance(value, str):
+            file_name = key + ".txt"
+            data = value.encode("utf-8")
+        elif isinstance(value, Image.Image):
+            file_name = key + ".png"
+            data = None
+        else:
+            raise TypeError(f"Can only cache text and images, not {type(value).__name__}")
+
+        path = os.path.join(self.directory, file_name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        if data is not None:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        else:
+            value.save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._forget(file_name)
+            self._entries[file_name] = os.path.getsize(path)
+            self._size += self._entries[file_name]
+            self._evict()
+
+
+    def stats(self) -> dict:
+        """Returns the hit/miss statistics and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+            }
+
+
+    def _load_entries(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self._EXTENSIONS):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(files):
+            self._entries[file_name] = size
+            self._size += size
+        self._evict()
+
+
+    def _find(self, key):
+        for extension in self._EXTENSIONS:
+            if key + extension in self._entries:
+                return key + extension
+        return None
+
+
+    def _forget(self, file_name):
+        size = self._entries.pop(file_name, None)
+        if size is not None:
+            self._size -= size
+
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            file_name, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except FileNotFoundError:
+                pass
+
+
+def with_cache(llm_client: LlmClient):
+    """Returns [llm_client] behind the shared DiskCache of the configuration, or [llm_client] itself when
+    Configuration.cache_enabled is off."""
+    if not llm_client.config.cache_enabled:
+        return llm_client
+    return CachedLlmClient(llm_client, DiskCache.shared(llm_client.config))
+
+
+class CachedLlmClient:
+    """Puts a DiskCache in front of the room analysis methods of an LlmClient.
+
+    The results of analyze_room, get_asset_dimensions, get_asset_location_orientation and remove_asset_from_image only
+    depend on the room image, so they are cached by image content hash, prompt, model name and generation config.
+    combine_images is never cached, a repeated render of the same room only costs that single call.
+    """
+
+    def __init__(self, llm_client: LlmClient, cache: DiskCache, metrics: Metrics = None):
+        self.llm_client = llm_client
+        self.config = llm_client.config
+        self.cache = cache
+        # every lookup is reported as a "cache" event with outcome "hit" or "miss", by default to the metrics of the client
+        self.metrics = metrics if metrics is not None else llm_client.metrics
+
+
+    def with_lane(self, lane: str) -> "CachedLlmClient":
+        """Returns a client with the same cache in front of self.llm_client.with_lane([lane])."""
+        return CachedLlmClient(self.llm_client.with_lane(lane), self.cache, self.metrics)
+
+
+    def remove_asset_from_image(self, room, asset_name, model: str = None):
+        key = self.cache_key(room, remove_asset_prompt(asset_name), model or self.config.llm_model_name_image_processing, REMOVE_ASSET_CONFIG)
+        return self._cached("remove_asset", key, lambda: self.llm_client.remove_asset_from_image(room, asset_name, model=model))
+
+
+    def get_asset_dimensions(self, room_image) -> str:
+        key = self.cache_key(room_image, ASSET_DIMENSIONS_PROMPT, self.config.llm_model_name_dimensions, ASSET_DIMENSIONS_CONFIG)
+        return self._cached("dimensions", key, lambda: self.llm_client.get_asset_dimensions(room_image))
+
+
+    def get_asset_location_orientation(self, room_image, asset_name) -> str:
+        key = self.cache_key(room_image, location_orientation_prompt(asset_name), self.config.llm_model_name_dimensions, LOCATION_ORIENTATION_CONFIG)
+        return self._cached("location_orientation", key, lambda: self.llm_client.get_asset_location_orientation(room_image, asset_name))
+
+
+    def analyze_room(self, room_image, asset_name) -> RoomAnalysis:
+        key = self.cache_key(room_image, room_analysis_prompt(asset_name), self.config.llm_model_name_dimensions, ROOM_ANALYSIS_CONFIG)
+        return RoomAnalysis.from_json(self._cached("analysis", key, lambda: self.llm_client.analyze_room(room_image, asset_name).to_json()))
+
+
+    def combine_images(self, room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset,
+                       model: str = None, asset_name: str = "sofa"):
+        return self.llm_client.combine_images(room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset,
+                                              model=model, asset_name=asset_name)
+
+
+    def remove_asset_candidates(self, room, asset_name, candidate_count: int = 1, temperature: float = None, seed: int = None) -> list:
+        # candidates are sampled to differ, they are never cached
+        return self.llm_client.remove_asset_candidates(room, asset_name, candidate_count, temperature, seed)
+
+
+    def combine_image_candidates(self, room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset,
+                                 candidate_count: int = 1, temperature: float = None, seed: int = None, asset_name: str = "sofa") -> list:
+        return self.llm_client.combine_image_candidates(room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions,
+                                                        location_orientation_asset, candidate_count, temperature, seed, asset_name)
+
+
+    @staticmethod
+    def cache_key(image: Image, prompt: str, model: str, generation_config) -> str:
+        """Returns the cache key for a request on [image] with [prompt], [model] and [generation_config]."""
+        config_json = generation_config.model_dump_json(exclude_none=True) if generation_config is not None else None
+        request = json.dumps([image_digest(image), prompt, model, config_json])
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+    def _cached(self, stage, key, call):
+        result = self.cache.get(key)
+        if self.metrics.enabled:
+            self.metrics.record(MetricEvent("cache", stage, outcome="miss" if result is None else "hit"))
+        if result is None:
+            result = call()
+            self.cache.put(key, result)
+        return result
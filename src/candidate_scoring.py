@@ -0,0 +1,185 @@
+"""
+Local quality scores of the images generated by the image model, used to keep the best of N candidates.
+
+Every score is between 0 and 1 (higher is better) and computed with NumPy on downsized copies of the images:
+- background: pixel similarity to the reference room outside the region of the asset, the rest of the room shouldn't change.
+- size: how well the width, height and area of the changed region match the bounding box of the old asset, so an asset
+  that is placed too large or too small scores low. The aspect ratio of the asset image is a secondary term, a
+  distorted asset scores low as well.
+- colour: colour histogram intersection of the changed region and the asset image.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from src.region_compositing import region_box
+
+SCORE_SIZE = 512            # the images are downsized to this maximum width/height before scoring
+CHANGED_THRESHOLD = 48      # sum of the absolute RGB differences from which a pixel counts as changed
+COLOUR_LEVELS = 8           # levels per channel of the colour histograms
+SIZE_WINDOW_PADDING = 0.5   # changes are searched in the bounding box padded by at least this fraction, to see an asset that is too large
+SIZE_ASPECT_WEIGHT = 0.2    # weight of the aspect ratio in the size score, the extent and the area share the rest
+
+
+@dataclass
+class CandidateScore:
+    """The scores of one candidate, [total] is the weighted mean of the scores that apply."""
+    total: float
+    background: float
+    size: float = None
+    colour: float = None
+
+
+def score_removal(room: Image.Image, candidate: Image.Image, bounding_box: list, padding: float) -> CandidateScore:
+    """Scores a candidate of the removal stage: the room outside the (padded) bounding box of the asset shouldn't change.
+
+    Args:
+        room (Image): the original room.
+        candidate (Image): the room without the asset, as generated by the model.
+        bounding_box (list): [ymin, xmin, ymax, xmax] of the asset normalized to 0-1000, empty when unknown.
+        padding (float): padding around the bounding box, as a fraction of its width and height.
+    """
+    reference = _to_array(room, _score_size(room.size))
+    outside = ~_box_mask(bounding_box, reference.shape, padding)
+    background = _similarity(reference, _to_array(candidate, reference.shape[1::-1]), outside)
+    return CandidateScore(total=background, background=background)
+
+
+def score_composite(room_without_asset: Image.Image, asset_image: Image.Image, candidate: Image.Image, bounding_box: list,
+                    padding: float, weights: dict) -> CandidateScore:
+    """Scores a candidate of the combine stage on the background, the size and the colours of the placed asset.
+
+    Args:
+        room_without_asset (Image): the room the asset was placed in.
+        asset_image (Image): the image of the new asset.
+        candidate (Image): the room with the new asset, as generated by the model.
+        bounding_box (list): [ymin, xmin, ymax, xmax] of the old asset normalized to 0-1000, empty when unknown.
+            Without it the size and colour scores are left out and the total is the background score.
+        padding (float): padding around the bounding box, as a fraction of its width and height.
+        weights (dict): the weight of the "background", "size" and "colour" scores in the total.
+    """
+    reference = _to_array(room_without_asset, _score_size(room_without_asset.size))
+    generated = _to_array(candidate, reference.shape[1::-1])
+    inside = _box_mask(bounding_box, reference.shape, padding)
+    if not inside.any():
+        # without a bounding box the asset can be anywhere: only the background applies, compared over the whole room
+        background = _similarity(reference, generated, np.ones_like(inside))
+        return CandidateScore(total=background, background=background)
+    outside = ~inside if not inside.all() else np.ones_like(inside)
+
+    window = _box_mask(bounding_box, reference.shape, max(padding, SIZE_WINDOW_PADDING))
+    changed = (np.abs(generated - reference).sum(axis=2) > CHANGED_THRESHOLD) & window
+    asset = _to_array(asset_image, _score_size(asset_image.size))
+    asset_foreground = _foreground(asset_image, asset.shape)
+    expected_box = region_box(bounding_box, (reference.shape[1], reference.shape[0]), 0)
+
+    scores = {
+        "background": _similarity(reference, generated, outside),
+        "size": _size_match(changed, expected_box, asset_foreground),
+        "colour": _histogram_intersection(generated[changed], asset[asset_foreground]),
+    }
+    total = sum(weights[name] * score for name, score in scores.items()) / sum(weights[name] for name in scores)
+    return CandidateScore(total=total, **scores)
+
+
+def _score_size(size):
+    width, height = size
+    scale = min(1.0, SCORE_SIZE / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_array(image, size) -> np.ndarray:
+    """Returns [image] as a (height, width, 3) float32 array of [size]."""
+    image = image.convert("RGB")
+    if image.size != tuple(size):
+        image = image.resize(tuple(size), Image.BILINEAR)
+    return np.asarray(image, dtype=np.float32)
+
+
+def _box_mask(bounding_box, shape, padding) -> np.ndarray:
+    """Returns a (height, width) mask that is True inside the padded bounding box, all False without a box."""
+    mask = np.zeros(shape[:2], dtype=bool)
+    box = region_box(bounding_box, (shape[1], shape[0]), padding)
+    if box is not None:
+        left, upper, right, lower = box
+        mask[upper:lower, left:right] = True
+    return mask
+
+
+def _similarity(reference, generated, mask) -> float:
+    """Returns 1 minus the mean absolute difference (scaled to 0-1) of the pixels in [mask], 0 when the mask is empty."""
+    if not mask.any():
+        return 0.0
+    return float(1.0 - np.abs(generated[mask] - reference[mask]).mean() / 255.0)
+
+
+def _foreground(asset_image, shape) -> np.ndarray:
+    """Returns the mask of the asset in its image: the opaque pixels, or the pixels that aren't (near) white."""
+    if "A" in asset_image.getbands():
+        alpha = asset_image.getchannel("A").resize((shape[1], shape[0]), Image.NEAREST)
+        mask = np.asarray(alpha) > 0
+    else:
+        mask = _to_array(asset_image, (shape[1], shape[0])).min(axis=2) < 240
+    return mask if mask.any() else np.ones(shape[:2], dtype=bool)
+
+
+def _size_match(changed, expected_box, asset_foreground) -> float:
+    """Returns how well the changed region matches [expected_box] (left, upper, right, lower), 0 when nothing changed.
+
+    The width and height of the changed region are compared with the box, and the changed area with the part of the box
+    that the asset covers (as much as it covers of its own extent in the asset image). The aspect ratio of the asset is
+    a secondary term.
+    """
+    extent = _extent(changed)
+    if extent is None:
+        return 0.0
+    left, upper, right, lower = expected_box
+    expected_width, expected_height = right - left, lower - upper
+    asset_width, asset_height = _extent(asset_foreground)
+    expected_area = expected_width * expected_height * asset_foreground.sum() / (asset_width * asset_height)
+
+    extent_match = _ratio(extent[0], expected_width) * _ratio(extent[1], expected_height)
+    area_match = _ratio(changed.sum(), expected_area)
+    return float((1 - SIZE_ASPECT_WEIGHT) * (extent_match + area_match) / 2 + SIZE_ASPECT_WEIGHT * _aspect_match(changed, asset_foreground))
+
+
+def _ratio(value, other) -> float:
+    """Returns the smallest of both values divided by the largest, 0 when one of them is 0."""
+    return float(min(value, other) / max(value, other)) if min(value, other) > 0 else 0.0
+
+
+def _aspect_match(changed, asset_foreground) -> float:
+    """Returns the ratio of the aspect ratios of the bounding boxes of both masks (smallest / largest), 0 when nothing changed."""
+    changed_ratio, asset_ratio = _aspect_ratio(changed), _aspect_ratio(asset_foreground)
+    if changed_ratio is None or asset_ratio is None:
+        return 0.0
+    return float(min(changed_ratio, asset_ratio) / max(changed_ratio, asset_ratio))
+
+
+def _aspect_ratio(mask):
+    extent = _extent(mask)
+    return extent[0] / extent[1] if extent is not None else None
+
+
+def _extent(mask):
+    """Returns the (width, height) of the bounding box of [mask], None when it is empty."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    columns = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        return None
+    return columns[-1] - columns[0] + 1, rows[-1] - rows[0] + 1
+
+
+def _histogram_intersection(pixels, other_pixels) -> float:
+    """Returns the intersection of the normalized colour histograms of two (n, 3) pixel arrays, 0 when one is empty."""
+    if len(pixels) == 0 or len(other_pixels) == 0:
+        return 0.0
+    return float(np.minimum(_colour_histogram(pixels), _colour_histogram(other_pixels)).sum())
+
+
+def _colour_histogram(pixels) -> np.ndarray:
+    levels = (pixels // (256 // COLOUR_LEVELS)).astype(np.int64)
+    bins = (levels[:, 0] * COLOUR_LEVELS + levels[:, 1]) * COLOUR_LEVELS + levels[:, 2]
+    histogram = np.bincount(bins, minlength=COLOUR_LEVELS ** 3).astype(np.float32)
+    return histogram / histogram.sum()
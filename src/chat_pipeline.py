@@ -0,0 +1,211 @@
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from src.config import Configuration
+from src.dimensions import combine_asset_dimensions
+from src.image_utils import response_image
+from src.llm_client import LlmClient
+from src.metrics import request_bytes, request_event
+from src.rate_scheduler import estimate_tokens
+from src.prompts import CHAT_SESSION_CONFIG, chat_combine_prompt, chat_tweak_prompt, remove_asset_prompt
+
+
+class ChatSession:
+    """One multi-turn chat with the image model, with the token usage of all its turns."""
+
+    def __init__(self, session_id: str, chat):
+        self.session_id = session_id
+        self.chat = chat
+        self.last_used = time.monotonic()
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.candidate_tokens = 0
+        self.turn_prompt_tokens = []       # the prompt tokens of every turn, they grow with the history of the chat
+        self.history_tokens = 0            # the tokens of the history that is sent with the next turn
+        self.lock = threading.Lock()       # the turns of a chat have to be sent one after another
+
+
+    def record_usage(self, response, estimated_tokens: int):
+        """Counts the turn, [estimated_tokens] is the estimate of its prompt, used when the response has no usage."""
+        self.turns += 1
+        usage = response.usage_metadata
+        if usage is None:
+            self.turn_prompt_tokens.append(0)
+            self.history_tokens = estimated_tokens
+            return
+        self.turn_prompt_tokens.append(usage.prompt_token_count or 0)
+        self.prompt_tokens += usage.prompt_token_count or 0
+        self.candidate_tokens += usage.candidates_token_count or 0
+        # the next turn sends this prompt and the answer to it again
+        self.history_tokens = (usage.prompt_token_count or 0) + (usage.candidates_token_count or 0)
+
+
+class ChatSessionPool:
+    """Keeps the open chat sessions, sessions that are idle for [idle_seconds] are evicted.
+
+    When there are [max_sessions] sessions, the least recently used one is evicted to make room for a new one.
+    """
+
+    def __init__(self, create_chat, idle_seconds: float, max_sessions: int):
+        """
+        Args:
+            create_chat: a function without arguments that creates a new chat.
+            idle_seconds (float): number of seconds after the last turn that a session is evicted.
+            max_sessions (int): maximum number of open sessions.
+        """
+        self.create_chat = create_chat
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.evictions = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+
+    def create(self) -> ChatSession:
+        with self._lock:
+            self._evict_idle()
+            while len(self._sessions) >= self.max_sessions:
+                oldest = min(self._sessions.values(), key=lambda session: session.last_used)
+                self._remove(oldest.session_id)
+            session = ChatSession(uuid.uuid4().hex, self.create_chat())
+            self._sessions[session.session_id] = session
+            return session
+
+
+    def get(self, session_id: str) -> ChatSession:
+        """Returns the session, raises KeyError when it doesn't exist (anymore)."""
+        with self._lock:
+            self._evict_idle()
+            if session_id not in self._sessions:
+                raise KeyError(f"Chat session {session_id} not found, it might have been idle for too long")
+            session = self._sessions[session_id]
+            session.last_used = time.monotonic()
+            return session
+
+
+    def close(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            if now - session.last_used > self.idle_seconds:
+                self._remove(session.session_id)
+
+
+    def _remove(self, session_id):
+        del self._sessions[session_id]
+        self.evictions += 1
+
+
+class ChatPipeline:
+    """Alternative pipeline that removes and inserts the asset, and applies follow-up tweaks, in one chat session.
+
+    The room analysis stays a separate structured request. The removal, the insertion and every tweak ("move it left",
+    "smaller") are turns in one chat with the image model, so the model gets the previous turns as context and a tweak
+    is a short instruction instead of a new combine prompt.
+
+    This doesn't reuse any context on the server and doesn't send less data: the Gemini API keeps no chat state, the
+    chat of the genai SDK sends its whole history with every turn, including the images the model generated (the
+    cleaned room and every render) as inline bytes. Every turn sends more than the one before and a tweak costs the
+    prompt tokens of all earlier turns, see usage and benchmarks/chat_vs_stateless.py. With the Files API enabled only
+    the room and asset images in the history are file references.
+
+    Every turn is scheduled by the rate scheduler of the client, in the lane of the client, with the tokens of the
+    history in its estimate, and reported as a "chat" event to the metrics of the client.
+    """
+
+    def __init__(self, config: Configuration, llm_client: LlmClient, pool: ChatSessionPool = None):
+        self.config = config
+        self.llm_client = llm_client
+        self.pool = pool if pool is not None else ChatSessionPool(self._create_chat, config.chat_session_idle_seconds, config.chat_max_sessions)
+
+
+    def start(self, room_image: Image, asset_image: Image, asset_dimensions: str, asset_name: str = "sofa"):
+        """Starts a chat session, removes the asset from the room and places the new asset in it.
+
+        Args:
+            room_image (Image): a PIL Image of the room.
+            asset_image (Image): a PIL Image of the new asset.
+            asset_dimensions (str): a string describing the dimensions of the new asset.
+            asset_name (str): the type of asset to replace (e.g. sofa, bed).
+
+        Returns:
+            tuple: the session id, to use for tweaks, and the room with the new asset as PIL Image.
+        """
+        analysis = self.llm_client.analyze_room(room_image, asset_name)
+        session = self.pool.create()
+        self._send(session, [remove_asset_prompt(asset_name), room_image])
+        # the session keeps its own generated room, its size is unknown here, so only the scale is added
+        prompt = chat_combine_prompt(analysis.dimensions_text(), combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name),
+                                     analysis.location_orientation_text(), asset_name)
+        return session.session_id, self._send(session, [prompt, asset_image])
+
+
+    def tweak(self, session_id: str, instruction: str) -> Image:
+        """Applies a follow-up change (e.g. "move it a bit to the left") to the last image of the session.
+
+        Raises:
+            KeyError: If the session doesn't exist or was evicted.
+        """
+        return self._send(self.pool.get(session_id), [chat_tweak_prompt(instruction)])
+
+
+    def close(self, session_id: str):
+        self.pool.close(session_id)
+
+
+    def usage(self, session_id: str) -> dict:
+        """Returns the number of turns and tokens used by the session so far, and the prompt tokens per turn."""
+        session = self.pool.get(session_id)
+        return {"turns": session.turns, "prompt_tokens": session.prompt_tokens, "candidate_tokens": session.candidate_tokens,
+                "turn_prompt_tokens": list(session.turn_prompt_tokens)}
+
+
+    def _create_chat(self):
+        if self.llm_client.client is None:
+            # the turns of a chat are sent by the chat of the genai SDK, not through the transport of the client
+            raise ValueError("Chat sessions can't be replayed, use the passthrough or record transport mode")
+        return self.llm_client.client.chats.create(model=self.config.llm_model_name_image_processing, config=CHAT_SESSION_CONFIG)
+
+
+    def _send(self, session, message) -> Image:
+        model = self.config.llm_model_name_image_processing
+        preparer = self.llm_client.image_preparer
+        scheduler = self.llm_client.rate_scheduler
+        prepared = preparer.prepare_contents(model, message)
+        attempts = []
+
+        def send_turn(current_model):
+            tokens = session.history_tokens + estimate_tokens(message, preparer.max_sizes.get(current_model, preparer.default_max_size))
+            scheduler.acquire(current_model, tokens, self.llm_client.lane)
+            attempts.append((current_model, request_bytes(prepared)))
+            response = session.chat.send_message(prepared)
+            usage = response.usage_metadata
+            scheduler.record_usage(current_model, tokens, usage.prompt_token_count if usage is not None else None)
+            session.record_usage(response, tokens)
+            return response
+
+        with session.lock:
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.llm_client.resilient_caller.call(model, send_turn)
+            finally:
+                if self.llm_client.metrics.enabled:
+                    self.llm_client.metrics.record(request_event("chat", model, time.perf_counter() - start, attempts, response))
+
+        image = response_image(response)
+        if image is None:
+            raise RuntimeError(f"chat turn {session.turns} of session {session.session_id} returned no image")
+        return image
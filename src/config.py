@@ -9,6 +9,9 @@ class Configuration:
     _asset_path: str
     _room_path: str
     output_path: str
+    cache_path: str
+    cassette_path: str
+    room_index_path: str
 
     # LLM configuration
     """
@@ -19,7 +22,107 @@ class Configuration:
     """
     llm_model_name_image_processing = "models/nano-banana-pro-preview"     # hardcoded for now
     llm_model_name_dimensions = "gemini-2.5-flash-image"          # hardcoded for now
+    llm_model_name_image_processing_fallback = "models/gemini-3-pro-image-preview"   # used when the image processing model is unavailable
+    llm_model_name_preview = "gemini-2.5-flash-image"       # fast image model for the preview of a progressive render
     llm_api_key = os.getenv("LLM_API_KEY")
+    llm_base_url = os.getenv("LLM_BASE_URL")     # endpoint of the Gemini API, None for the default. Set it to run against a local fake server
+    # passthrough: send the requests to the API, record: also save the responses as cassettes, replay: serve the cassettes offline
+    llm_transport_mode = os.getenv("LLM_TRANSPORT_MODE", "passthrough")
+    llm_transport_replay_latency_seconds = 0.0      # simulated latency of a replayed response
+    # maximum number of requests in flight per model for the async client, models not listed use the default
+    llm_max_concurrent_requests = {
+        llm_model_name_image_processing: 4,
+        llm_model_name_dimensions: 8,
+    }
+    llm_max_concurrent_requests_default = 4
+    # images are downsized to this maximum width/height (in pixels) per model and re-encoded before uploading
+    llm_upload_max_size = {
+        llm_model_name_image_processing: 2048,
+        llm_model_name_dimensions: 1024,
+    }
+    llm_upload_max_size_default = 1536
+    llm_upload_format = "JPEG"      # JPEG, WEBP or PNG
+    llm_upload_quality = 90
+    llm_use_files_api = True        # upload every distinct image once and reference it by URI instead of sending it inline
+
+    # Rate limits per model: requests per minute and input tokens per minute, check the quota of the project in AI Studio.
+    # Requests are scheduled to stay under [llm_rate_headroom] of the quota, models not listed are not limited.
+    llm_rate_limits = {
+        llm_model_name_image_processing: {"rpm": 20, "tpm": 100_000},
+        llm_model_name_image_processing_fallback: {"rpm": 20, "tpm": 100_000},
+        llm_model_name_dimensions: {"rpm": 500, "tpm": 500_000},
+    }
+    llm_rate_headroom = 0.9
+    llm_rate_count_tokens = False   # ask countTokens for the input tokens of every request instead of estimating them
+
+    # Retry configuration
+    llm_retry_max_attempts = 4                  # attempts per request and per model
+    llm_retry_base_delay_seconds = 1.0
+    llm_retry_max_delay_seconds = 30.0
+    llm_retry_budget_ratio = 0.2                # retries allowed per request, for the whole process
+    llm_retry_budget_min_tokens = 10
+    llm_retry_budget_max_tokens = 100
+    llm_circuit_breaker_failure_threshold = 5   # failures in a row before the circuit breaker of a model opens
+    llm_circuit_breaker_reset_seconds = 30.0
+
+    # Hedging: a request of these stages that takes longer than the percentile of the recent latency is sent again, to
+    # the fallback model (or the same model without a fallback), the first response wins
+    llm_hedge_enabled = False
+    llm_hedge_stages = ("remove_asset", "combine")
+    llm_hedge_percentile = 95
+    llm_hedge_window = 200                  # recent requests per stage and model of the percentile
+    llm_hedge_min_samples = 20              # no hedging until there are this many latencies
+    llm_hedge_min_delay_seconds = 5.0       # a request is never hedged sooner than this
+    llm_hedge_alternate_model = True        # False: hedge to the same model
+    llm_hedge_max_rate = 0.05               # hedges allowed per request, for the whole process
+    llm_hedge_budget_min_tokens = 1
+    llm_hedge_budget_max_tokens = 10
+
+    # Metrics configuration
+    metrics_jsonl_path = os.getenv("METRICS_JSONL_PATH")    # append a JSON line per LLM request and pipeline stage to this file, None disables the metrics
+
+    # Cache configuration
+    cache_enabled = True      # cache the room analysis and removal results of the renders on disk in cache_path, see cache
+    cache_max_bytes = 1024 * 1024 * 1024      # 1 GB of cached room analysis results and images
+
+    # Batch configuration
+    batch_poll_interval_seconds = 30
+    batch_timeout_seconds = 24 * 60 * 60       # batch jobs expire after 24 hours
+    batch_max_inline_bytes = 16 * 1024 * 1024     # inline requests of one batch job, the API accepts about 20 MB, larger stages are split over jobs
+
+    # Chat session configuration, a chat resends its whole history with every turn (there is no chat state on the server)
+    chat_session_idle_seconds = 15 * 60      # chat sessions without a turn for this long are evicted
+    chat_max_sessions = 100
+
+    # Render service configuration
+    service_workers = 4                 # number of renders the service runs at the same time
+    service_max_queue = 100             # number of jobs that can wait for a worker
+    service_queue_timeout_seconds = 0   # how long a submission waits for room in a full queue, 0 rejects immediately
+    service_max_finished_jobs = 1000    # finished jobs (and their images) that are kept for polling
+
+    # Pipeline configuration
+    pipeline_max_workers = 3        # number of room analysis stages that can run at the same time
+    pipeline_max_parallel_combines = 4      # number of assets that are placed in the same room at the same time
+    # region compositing: only the region around the asset is sent to the image model and pasted back into the room
+    pipeline_region_compositing = False
+    pipeline_region_padding = 0.3       # padding around the bounding box of the asset, as a fraction of its width/height
+    pipeline_region_min_size = 512      # minimum width/height of the region in pixels
+    pipeline_region_feather = 24        # width in pixels of the soft edge of the pasted region
+    # best-of-N: the removal and combine stages generate this many candidates and keep the best by local quality score
+    pipeline_candidates = 1
+    pipeline_candidate_mode = "parallel"        # parallel: one request per candidate, candidate_count: all candidates in one request
+    pipeline_candidate_temperature = 0.8        # the candidates only differ with a temperature above 0
+    pipeline_candidate_threshold = 0.6          # the stage is retried when every candidate scores below this (0-1)
+    pipeline_candidate_retries = 1
+    pipeline_candidate_weights = {"background": 0.5, "size": 0.2, "colour": 0.3}
+    pipeline_local_scale = True     # replace the asset dimensions in the combine prompt by compact dimensions and a computed scale
+
+    # Image index configuration
+    image_index_max_age_seconds = 60.0     # the index of an image directory (see ImageOpener) is rescanned when it is older than this
+
+    # Memory configuration
+    image_draft_decoding = True     # decode large rooms and assets at a reduced resolution, down to the largest upload size
+    image_memory_budget_bytes = 1024 * 1024 * 1024      # decoded rooms and assets of all renders in flight, renders wait above it
 
     def __init__(self, resources_test_path: str):
         # Get the directory where this script is located
@@ -36,6 +139,10 @@ class Configuration:
         self._room_path = os.path.join(full_resources_path, "input", "room")
 
         self.output_path = os.path.join(full_resources_path, "output")
+        self.cache_path = os.path.join(project_root, ".cache", "llm")
+        self.cassette_path = os.getenv("LLM_CASSETTE_PATH") or os.path.join(project_root, "tests", "cassettes")
+        # precomputed analysis and cleaned rooms of the room catalogue, see room_index
+        self.room_index_path = os.getenv("ROOM_INDEX_PATH") or os.path.join(project_root, ".cache", "room_index")
 
 
     def get_asset_image_path(self, name: str) -> str:
@@ -0,0 +1,107 @@
+"""
+Parses the dimensions of a new asset into an AssetDimensions record and computes its scale locally.
+
+The dimensions of an asset from the catalogue are free text, in Dutch or English, one key per line:
+"Hoogte=80 cm", "Maximale zitdiepte=90 cm", "width: 181.6 cm", "height backboard: 107.8 cm"
+
+With the dimensions of the old asset (from the room analysis) and its bounding box, the relative scale and the
+expected footprint of the new asset in the image are computed here, instead of leaving the arithmetic to the model.
+"""
+import re
+
+from src.config import Configuration
+from src.room_analysis import AssetDimensions, RoomAnalysis
+
+_KEY_VALUE = re.compile(r"(?P<key>[^\W\d_][\w ()\-]*?)\s*[=:]\s*(?P<value>\d+(?:[.,]\d+)?)\s*(?P<unit>cm2|mm|cm|m)?\b", re.IGNORECASE)
+_TO_CM = {"mm": 0.1, "cm": 1.0, "m": 100.0}
+
+# the keys of the overall size of an asset, in Dutch and English. A key matches when it contains one of the words, the
+# largest match wins, unless a key is exactly one of the words (e.g. "Hoogte" wins from "Rughoogte")
+_ASSET_KEYS = {
+    "width": ("breedte", "width", "lengte", "length"),
+    "depth": ("diepte", "depth"),
+    "height": ("hoogte", "height"),
+}
+# keys about a part of the asset that is never its overall size, e.g. "Breedte armleuning" or "Poot hoogte"
+_PART_WORDS = ("arm", "poot", "leg")
+
+
+def parse_asset_dimensions(text: str, name: str = "asset") -> AssetDimensions:
+    """Parses the Dutch or English dimensions of an asset, see _ASSET_KEYS. Dimensions that aren't found are None."""
+    sizes = {dimension: (None, None) for dimension in _ASSET_KEYS}     # dimension -> (exact value, largest value)
+    for match in _KEY_VALUE.finditer(text):
+        key = " ".join(match.group("key").casefold().split())
+        if match.group("unit") == "cm2" or any(part in key for part in _PART_WORDS):
+            continue
+        value = _value_in_cm(match)
+        for dimension, words in _ASSET_KEYS.items():
+            if any(word in key for word in words):
+                exact, largest = sizes[dimension]
+                sizes[dimension] = (value if key in words else exact, value if largest is None else max(largest, value))
+    width, depth, height = (exact if exact is not None else largest for exact, largest in (sizes[d] for d in ("width", "depth", "height")))
+    return AssetDimensions(name, width * depth if width and depth else None, depth, width, height)
+
+
+def dimensions_line(asset: AssetDimensions) -> str:
+    """Returns the compact "name: w x d x h cm" line of [asset], with ? for an unknown dimension."""
+    sizes = ("?" if size is None else f"{size:g}" for size in (asset.width, asset.depth, asset.height))
+    return f"{asset.name}: {'x'.join(sizes)} cm (w x d x h)"
+
+
+def scale_instruction(asset: AssetDimensions, analysis: RoomAnalysis, asset_name: str, image_size: tuple = None) -> str:
+    """Returns a short instruction with the scale of the new [asset] relative to the old asset in the room.
+
+    The old asset is the asset of the analysis whose name contains [asset_name] (the largest one). With the bounding
+    box of the analysis and [image_size] (width, height) the expected footprint of the new asset is added, as a
+    fraction of the image and in pixels. Returns an empty string when the scale can't be computed.
+    """
+    old = _old_asset(analysis.assets, asset_name)
+    if old is None:
+        return ""
+    ratios = {dimension: getattr(asset, dimension) / getattr(old, dimension)
+              for dimension in ("width", "depth", "height") if getattr(asset, dimension) and getattr(old, dimension)}
+    if not ratios:
+        return ""
+    adjectives = {"width": "wide", "depth": "deep", "height": "high"}
+    instruction = f"Scale: the new {asset_name} is " + ", ".join(f"{ratio:.2f}x as {adjectives[dimension]}" for dimension, ratio in ratios.items()) + \
+                  f" as the old {old.name}."
+
+    box = analysis.bounding_box
+    if image_size is None or len(box or ()) != 4 or box[2] <= box[0] or box[3] <= box[1]:
+        return instruction
+    # the width and height of the bounding box follow the width and height of the asset, use one for the other if missing
+    width_ratio = ratios.get("width", ratios.get("height"))
+    height_ratio = ratios.get("height", ratios.get("width"))
+    fraction_x = min(1.0, (box[3] - box[1]) / 1000 * width_ratio)
+    fraction_y = min(1.0, (box[2] - box[0]) / 1000 * height_ratio)
+    width, height = image_size
+    return instruction + (f" Footprint: about {fraction_x:.0%} of the image width and {fraction_y:.0%} of its height"
+                          f" ({round(fraction_x * width)}x{round(fraction_y * height)} px of {width}x{height}).")
+
+
+def asset_dimensions_prompt(asset_dimensions: str, analysis: RoomAnalysis, asset_name: str, image_size: tuple = None) -> str:
+    """Returns the compact dimensions of the new asset and its scale instruction for the combine prompt.
+
+    The text is returned unchanged when no dimensions can be parsed from it.
+    """
+    asset = parse_asset_dimensions(asset_dimensions, asset_name)
+    if asset.width is None and asset.depth is None and asset.height is None:
+        return asset_dimensions
+    return "\n".join(line for line in (dimensions_line(asset), scale_instruction(asset, analysis, asset_name, image_size)) if line)
+
+
+def combine_asset_dimensions(config: Configuration, asset_dimensions: str, analysis: RoomAnalysis, asset_name: str, image_size: tuple = None) -> str:
+    """Returns asset_dimensions_prompt, or [asset_dimensions] unchanged when Configuration.pipeline_local_scale is off."""
+    if not config.pipeline_local_scale:
+        return asset_dimensions
+    return asset_dimensions_prompt(asset_dimensions, analysis, asset_name, image_size)
+
+
+def _value_in_cm(match) -> float:
+    value = float(match.group("value").replace(",", "."))
+    return value * _TO_CM.get((match.group("unit") or "cm").casefold(), 1.0)
+
+
+def _old_asset(assets, asset_name):
+    candidates = [asset for asset in assets if asset_name.casefold() in asset.name.casefold()]
+    return max(candidates, key=lambda asset: asset.area or 0, default=None)
@@ -3,3 +3,31 @@ class LlmUnavailableError(Exception):
     pass
 
 
+class CircuitOpenError(LlmUnavailableError):
+    """Custom exception for when a request is refused because the circuit breaker of the model is open."""
+    pass
+
+
+class BatchJobFailedError(Exception):
+    """Custom exception for when a batch job doesn't succeed (failed, cancelled, expired or timed out)."""
+    pass
+
+
+class QueueFullError(Exception):
+    """Custom exception for when the render queue is full and no new jobs are accepted."""
+    pass
+
+
+class CassetteNotFoundError(Exception):
+    """Custom exception for when a request is replayed but no cassette was recorded for it."""
+    pass
+
+
+class HedgeCancelledError(Exception):
+    """Custom exception for when a hedged request is not sent, because the other request of the hedge already returned."""
+    pass
+
+
+class InvalidFileNameError(Exception):
+    """Custom exception for when a requested file name is not a plain file name inside its catalogue directory."""
+    pass
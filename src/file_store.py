@@ -0,0 +1,120 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from google.genai import errors, types
+
+from src.metrics import DISABLED, MetricEvent, Metrics
+
+# the status codes of a request that references a file that expired or was deleted by the server
+MISSING_FILE_STATUS_CODES = {403, 404}
+
+
+def is_missing_file_error(error: Exception) -> bool:
+    """Returns True when [error] can mean that a file referenced by the request doesn't exist anymore."""
+    return isinstance(error, errors.ClientError) and error.code in MISSING_FILE_STATUS_CODES
+
+
+class UploadedFileStore:
+    """Uploads images once through the Files API and hands out references to them.
+
+    Files are keyed by the hash of their content, so an image that is used by multiple requests (like the room image in
+    the analysis and removal stages) is sent only once. Uploaded files expire on the server (after 48 hours), a file is
+    uploaded again when it expires within [expiry_margin_seconds]. A file that the server deleted sooner is forgotten
+    with invalidate_parts when a request that references it fails, see is_missing_file_error.
+
+    At most [max_files] references are kept: expired references are dropped, then the least recently used ones.
+    """
+
+    DEFAULT_LIFETIME_SECONDS = 48 * 60 * 60
+    LOCK_STRIPES = 64
+
+    def __init__(self, files, expiry_margin_seconds: float = 300, metrics: Metrics = DISABLED, max_files: int = 10000):
+        """
+        Args:
+            files: the files API to upload with, genai.Client.files.
+            expiry_margin_seconds (float): upload again when the file expires within this number of seconds.
+            metrics (Metrics): receives an "upload" event per image, with outcome "uploaded" or "reused".
+            max_files (int): the maximum number of file references that are kept.
+        """
+        self.files = files
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.metrics = metrics
+        self.max_files = max_files
+        self.uploads = 0
+        self.reuses = 0
+        self._handles = OrderedDict()      # content hash -> (uri, mime type, expires at in epoch seconds), least recently used first
+        # one lock per stripe of content hashes, so two stages that need the same image don't both upload it
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._lock = threading.Lock()
+
+
+    def part_for(self, data: bytes, mime_type: str) -> types.Part:
+        """Returns a Part referencing the uploaded file with [data], uploads it when it isn't uploaded yet or expires."""
+        key = hashlib.sha256(data).hexdigest()
+        start = time.perf_counter()
+        with self._key_lock(key):
+            with self._lock:
+                handle = self._handles.get(key)
+                if handle is not None:
+                    self._handles.move_to_end(key)
+            if handle is None or handle[2] - self.expiry_margin_seconds <= time.time():
+                handle = self._upload(data, mime_type)
+                with self._lock:
+                    self._handles[key] = handle
+                    self._prune()
+                    self.uploads += 1
+                outcome, bytes_up = "uploaded", len(data)
+            else:
+                with self._lock:
+                    self.reuses += 1
+                outcome, bytes_up = "reused", 0
+        if self.metrics.enabled:
+            self.metrics.record(MetricEvent("upload", mime_type, seconds=time.perf_counter() - start, outcome=outcome, bytes_up=bytes_up))
+        return types.Part.from_uri(file_uri=handle[0], mime_type=handle[1])
+
+
+    def invalidate(self, uri: str):
+        """Forgets the file with [uri], for example when the server reports it doesn't exist anymore."""
+        with self._lock:
+            for key, handle in list(self._handles.items()):
+                if handle[0] == uri:
+                    del self._handles[key]
+
+
+    def invalidate_parts(self, parts) -> bool:
+        """Forgets the files referenced by [parts], so they are uploaded again. Returns False when no part is a file reference."""
+        uris = {part.file_data.file_uri for part in parts if getattr(part, "file_data", None) is not None}
+        for uri in uris:
+            self.invalidate(uri)
+        return bool(uris)
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._handles)
+
+
+    def _key_lock(self, key) -> threading.Lock:
+        return self._locks[int(key[:8], 16) % len(self._locks)]
+
+
+    def _prune(self):
+        now = time.time()
+        for key, handle in list(self._handles.items()):
+            if handle[2] <= now:
+                del self._handles[key]
+        while len(self._handles) > self.max_files:
+            self._handles.popitem(last=False)
+
+
+    def _upload(self, data, mime_type):
+        uploaded = self.files.upload(file=io.BytesIO(data), config=types.UploadFileConfig(mime_type=mime_type))
+        if uploaded.expiration_time is not None:
+            expires_at = uploaded.expiration_time.timestamp()
+        else:
+            expires_at = time.time() + self.DEFAULT_LIFETIME_SECONDS
+        print(f"Uploaded image to {uploaded.uri}")
+        return uploaded.uri, uploaded.mime_type or mime_type, expires_at
@@ -0,0 +1,202 @@
+"""
+Hedged requests, to cut the tail latency of the image processing stages.
+
+When a request hasn't returned within a percentile of the recent latency of its stage, a duplicate (the hedge) is sent
+to the alternate model, or to the same model when there is none. The first response wins. The other request is told
+to stop: a request that is still waiting for the rate scheduler or for a retry is never sent, a request that is already
+sent can't be aborted by the synchronous genai client, its response is discarded.
+
+The latency of a stage is measured on the requests that weren't hedged and on the primary requests that lost, so the
+percentile follows the latency of the model and not of the hedging. The hedges are limited by a budget like the retry
+budget of resilience: every request adds [max_rate] hedges, so at most that fraction of the requests is sent twice.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from src.config import Configuration
+from src.resilience import RetryBudget
+
+
+class LatencyWindow:
+    """The latency of the last [size] requests, to estimate a percentile of the recent latency."""
+
+    def __init__(self, size: int):
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+
+    def percentile(self, p: float, min_samples: int = 1):
+        """Returns the [p]th percentile (nearest rank), or None with less than [min_samples] latencies."""
+        with self._lock:
+            if len(self._latencies) < max(1, min_samples):
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+    def __len__(self):
+        return len(self._latencies)
+
+
+class Hedger:
+    """Sends hedged requests for the configured stages, see the module docstring.
+
+    The hedger is shared by the clients in the process, so the latency windows and the hedge budget are per process.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, stages, percentile: float = 95, window: int = 200, min_samples: int = 20, min_delay_seconds: float = 5.0,
+                 budget: RetryBudget = None, alternate_model: bool = True):
+        """
+        Args:
+            stages: the names of the stages (e.g. "combine") whose requests are hedged.
+            percentile (float): a request is hedged when it takes longer than this percentile of the recent latency.
+            window (int): the number of recent requests per stage and model of the percentile.
+            min_samples (int): no requests are hedged until there are this many latencies of the stage.
+            min_delay_seconds (float): a request is never hedged sooner than this.
+            budget (RetryBudget): the hedges that may be sent, defaults to 5% of the requests.
+            alternate_model (bool): send the hedge to the fallback model of the request, when it has one.
+        """
+        self.stages = frozenset(stages)
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.budget = budget if budget is not None else RetryBudget(0.05, 1, 10)
+        self.alternate_model = alternate_model
+        self.counters = {"requests": 0, "hedged": 0, "hedges_won": 0, "budget_exhausted": 0}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "Hedger":
+        return cls(config.llm_hedge_stages, config.llm_hedge_percentile, config.llm_hedge_window, config.llm_hedge_min_samples,
+                   config.llm_hedge_min_delay_seconds, RetryBudget(config.llm_hedge_max_rate, config.llm_hedge_budget_min_tokens, config.llm_hedge_budget_max_tokens),
+                   config.llm_hedge_alternate_model)
+
+
+    @classmethod
+    def shared(cls, config: Configuration):
+        """Returns the hedger shared by the clients in the process, or None when Configuration.llm_hedge_enabled is off."""
+        if not config.llm_hedge_enabled:
+            return None
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls.from_config(config)
+            return cls._shared
+
+
+    def delay(self, stage: str, model: str):
+        """Returns the seconds after which a request of [stage] to [model] is hedged, None when it isn't hedged."""
+        if stage not in self.stages:
+            return None
+        percentile = self._window(stage, model).percentile(self.percentile, self.min_samples)
+        if percentile is None:
+            return None
+        return max(self.min_delay_seconds, percentile)
+
+
+    def call(self, stage: str, model: str, fallback_model: str, request):
+        """Calls request(model, fallback_model, cancelled) and hedges it when it is slow.
+
+        [cancelled] is a threading.Event that is set when the other request won, the request should raise
+        HedgeCancelledError instead of sending it when it is set.
+
+        Returns:
+            the result of the request that finished first without an error.
+
+        Raises:
+            the error of the primary request, when the primary and the hedge both fail.
+        """
+        delay = self.delay(stage, model)
+        window = self._window(stage, model) if stage in self.stages else None
+        self._count("requests")
+        self.budget.deposit()
+        start = time.perf_counter()
+        if delay is None:
+            result = request(model, fallback_model, None)
+            if window is not None:
+                window.record(time.perf_counter() - start)
+            return result
+
+        primary_cancelled = threading.Event()
+        primary = self._start(request, model, fallback_model, primary_cancelled)
+
+        def record_primary(future):
+            # also when the hedge won, the primary request shows how slow the model is
+            if future.exception() is None:
+                window.record(time.perf_counter() - start)
+
+        primary.add_done_callback(record_primary)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self.budget.withdraw():
+            self._count("budget_exhausted")
+            return primary.result()
+
+        hedge_model = fallback_model if self.alternate_model and fallback_model else model
+        print(f"Hedging the {stage} request to {model} after {delay:.1f}s with a request to {hedge_model}")
+        self._count("hedged")
+        hedge_cancelled = threading.Event()
+        hedge = self._start(request, hedge_model, None, hedge_cancelled)
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is not None:
+                (hedge_cancelled if winner is primary else primary_cancelled).set()
+                if winner is hedge:
+                    self._count("hedges_won")
+                return winner.result()
+        # both failed, the error of the primary request is the one of the model that was asked for
+        return primary.result()
+
+
+    def stats(self) -> dict:
+        """Returns the counters and the current hedge delay per stage and model."""
+        with self._lock:
+            windows = dict(self._windows)
+            counters = dict(self.counters)
+        counters["delays"] = {f"{stage}:{model}": self.delay(stage, model) for stage, model in windows}
+        counters["budget_tokens"] = self.budget.tokens
+        return counters
+
+
+    def _window(self, stage, model) -> LatencyWindow:
+        with self._lock:
+            if (stage, model) not in self._windows:
+                self._windows[(stage, model)] = LatencyWindow(self.window)
+            return self._windows[(stage, model)]
+
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+
+    @staticmethod
+    def _start(request, *args) -> Future:
+        """Runs the request on its own thread, so a slow request never waits for a pool and can be abandoned."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                future.set_result(request(*args))
+            except BaseException as error:
+                future.set_exception(error)
+
+        threading.Thread(target=run, name="hedged-request", daemon=True).start()
+        return future
@@ -0,0 +1,176 @@
+"""
+Loads the room and asset images of the renders with a bounded amount of decoded image data in memory.
+
+- An image is decoded at the smallest resolution that is still at least [max_size] (the largest upload size of the
+  models): JPEG files are decoded at 1/2, 1/4 or 1/8 scale with Image.draft, other formats are reduced after decoding.
+- The file is closed as soon as the pixels are decoded.
+- The decoded images of the renders in flight are counted against a process-wide ImageMemoryBudget. A render waits
+  until its images fit in the budget, so many concurrent renders of large photos don't exhaust the memory of a worker.
+"""
+import math
+import os
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+from src.config import Configuration
+
+_REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "I", "F")
+
+
+def image_bytes(size: tuple, mode: str) -> int:
+    """Returns the size in bytes of the decoded pixels of an image of [size] (width, height) and [mode]."""
+    # Pillow stores a pixel of more than one band (RGB, CMYK, ...) in 4 bytes
+    return size[0] * size[1] * (1 if mode in ("1", "L", "P") else 4)
+
+
+def decode_max_size(config: Configuration):
+    """Returns the largest upload size of the models with Configuration.image_draft_decoding, None to decode at full resolution."""
+    if not config.image_draft_decoding:
+        return None
+    return max(list(config.llm_upload_max_size.values()) + [config.llm_upload_max_size_default])
+
+
+def load_image(path: str, kind: str = "Image", max_size: int = None) -> Image.Image:
+    """Decodes the image at [path], at a reduced resolution when it is larger than [max_size], and closes the file.
+
+    The result is never smaller than [max_size] (or the original size), so downsizing it to [max_size] afterwards
+    gives the same upload as the full image.
+
+    Raises:
+        FileNotFoundError: If the image does not exist.
+    """
+    print(f"{kind} image path: {path}")
+    with _open(path, kind) as image:
+        _draft(image, max_size)
+        image.load()
+        return _reduce(image, max_size)
+
+
+class ImageMemoryBudget:
+    """The decoded image data (in bytes) that the renders in the process may hold at the same time.
+
+    acquire blocks until the requested bytes fit in the budget. A request that is larger than the whole budget is
+    allowed when nothing else is in flight, so it is delayed but never blocked forever.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+
+    @classmethod
+    def shared(cls, config: Configuration):
+        """Returns the budget of Configuration.image_memory_budget_bytes shared by the process, None without a budget."""
+        if not config.image_memory_budget_bytes:
+            return None
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(config.image_memory_budget_bytes)
+            return cls._shared
+
+
+    def acquire(self, nbytes: int):
+        with self._condition:
+            if self.in_use and self.in_use + nbytes > self.max_bytes:
+                print(f"Waiting for {nbytes / 1024 / 1024:.0f} MB of the image memory budget, {self.in_use / 1024 / 1024:.0f} MB in use")
+                self._condition.wait_for(lambda: not self.in_use or self.in_use + nbytes <= self.max_bytes)
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+
+    def release(self, nbytes: int):
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+
+class ImageLoader:
+    """Loads the images of one render within the memory budget, see the module docstring."""
+
+    def __init__(self, max_size: int = None, budget: ImageMemoryBudget = None):
+        """
+        Args:
+            max_size (int): images are decoded at a reduced resolution down to this width/height, None for full resolution.
+            budget (ImageMemoryBudget): the budget of the decoded images, None for no limit.
+        """
+        self.max_size = max_size
+        self.budget = budget
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "ImageLoader":
+        """Returns a loader that decodes down to decode_max_size within the shared budget of the configuration."""
+        return cls(decode_max_size(config), ImageMemoryBudget.shared(config))
+
+
+    @contextmanager
+    def load(self, *images, full_resolution: bool = False):
+        """Loads the (path, kind) [images] and yields them as a list, closes them and releases the budget on exit.
+
+        The decoded size of all images is reserved at once (from the file headers), before any of them is decoded.
+        With [full_resolution] the images are decoded without reducing them, e.g. when the result is pasted into the room.
+
+        Raises:
+            FileNotFoundError: If one of the images does not exist.
+        """
+        max_size = None if full_resolution else self.max_size
+        nbytes = 0
+        for path, kind in images:
+            with _open(path, kind) as image:
+                _draft(image, max_size)
+                nbytes += image_bytes(_reduced_size(image, max_size), image.mode)
+
+        if self.budget is not None:
+            self.budget.acquire(nbytes)
+        loaded = []
+        try:
+            for path, kind in images:
+                loaded.append(load_image(path, kind, max_size))
+            yield loaded
+        finally:
+            for image in loaded:
+                image.close()
+            if self.budget is not None:
+                self.budget.release(nbytes)
+
+
+def _open(path, kind):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{kind} image not found: {path}")
+    return Image.open(path)
+
+
+def _draft(image, max_size):
+    """Lets a JPEG decoder skip the resolution above [max_size], a no-op for other formats."""
+    if max_size is None or max(image.size) <= max_size:
+        return
+    scale = max_size / max(image.size)
+    image.draft(image.mode, (math.ceil(image.size[0] * scale), math.ceil(image.size[1] * scale)))
+
+
+def _reduce_factor(image, max_size):
+    """Returns the integer factor to reduce [image] by, so it is still at least [max_size]. Palette images aren't reduced."""
+    if max_size is None or image.mode not in _REDUCIBLE_MODES:
+        return 1
+    return max(1, max(image.size) // max_size)
+
+
+def _reduced_size(image, max_size):
+    factor = _reduce_factor(image, max_size)
+    return math.ceil(image.size[0] / factor), math.ceil(image.size[1] / factor)
+
+
+def _reduce(image, max_size):
+    factor = _reduce_factor(image, max_size)
+    if factor == 1:
+        return image
+    reduced = image.reduce(factor)
+    image.close()
+    return reduced
@@ -0,0 +1,114 @@
+import io
+import threading
+from collections import OrderedDict
+
+from google.genai import types
+from PIL import Image, ImageOps
+
+from src.config import Configuration
+from src.file_store import UploadedFileStore, is_missing_file_error
+from src.image_utils import image_digest
+
+
+class ImagePreparer:
+    """Prepares images before they are uploaded to a model.
+
+    Every image is downsized to the maximum resolution of the model and re-encoded to a compact format, so large
+    photos aren't serialized in full on every request. The encoded bytes are memoized by content hash, shared by all
+    preparers in the process, so an image that is used by multiple stages is only encoded once.
+    """
+
+    _MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+    _memo = OrderedDict()       # (digest, max size, format, quality) -> encoded bytes, least recently used first
+    _memo_lock = threading.Lock()
+    memo_max_entries = 64
+
+    def __init__(self, max_sizes: dict, default_max_size: int, image_format: str = "JPEG", quality: int = 90, file_store: UploadedFileStore = None):
+        """
+        Args:
+            max_sizes (dict): maximum width/height in pixels per model name.
+            default_max_size (int): maximum width/height for models that are not in [max_sizes].
+            image_format (str): the format to encode to: JPEG, WEBP or PNG.
+            quality (int): the JPEG/WEBP quality.
+            file_store (UploadedFileStore): when given, images are uploaded once and referenced by URI instead of
+                being sent inline with every request.
+        """
+        if image_format not in self._MIME_TYPES:
+            raise ValueError(f"Unsupported upload format: {image_format}")
+        self.max_sizes = max_sizes
+        self.default_max_size = default_max_size
+        self.image_format = image_format
+        self.quality = quality
+        self.file_store = file_store
+
+
+    @classmethod
+    def from_config(cls, config: Configuration, file_store: UploadedFileStore = None) -> "ImagePreparer":
+        return cls(config.llm_upload_max_size, config.llm_upload_max_size_default, config.llm_upload_format, config.llm_upload_quality, file_store)
+
+
+    def prepare_contents(self, model: str, contents: list) -> list:
+        """Replaces every PIL image in [contents] by a prepared Part for [model], other contents are left as they are."""
+        return [self.prepare(content, model) if isinstance(content, Image.Image) else content for content in contents]
+
+
+    def forget_missing_files(self, error: Exception, prepared: list) -> bool:
+        """Forgets the uploaded files in [prepared] when [error] says a file doesn't exist anymore (expired or deleted).
+
+        Returns:
+            bool: True when the request can be prepared and sent again, the images are then uploaded again.
+        """
+        return self.file_store is not None and is_missing_file_error(error) and self.file_store.invalidate_parts(prepared)
+
+
+    def prepare(self, image: Image, model: str) -> types.Part:
+        """Returns the image downsized and encoded for [model] as an inline Part, or a file reference with a file store."""
+        data = self.encode(image, model)
+        if self.file_store is not None:
+            return self.file_store.part_for(data, self.mime_type)
+        return types.Part.from_bytes(data=data, mime_type=self.mime_type)
+
+
+    def encode(self, image: Image, model: str) -> bytes:
+        """Returns the image downsized and encoded for [model], from the memo when it was encoded before."""
+        max_size = self.max_sizes.get(model, self.default_max_size)
+        key = (image_digest(image), max_size, self.image_format, self.quality)
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+
+        data = self._encode(image, max_size)
+        with self._memo_lock:
+            self._memo[key] = data
+            while len(self._memo) > self.memo_max_entries:
+                self._memo.popitem(last=False)
+        return data
+
+
+    @property
+    def mime_type(self) -> str:
+        return self._MIME_TYPES[self.image_format]
+
+
+    def _encode(self, image, max_size):
+        if max(image.size) > max_size:
+            # resizes into a new image, without a full resolution copy of [image]
+            image = ImageOps.contain(image, (max_size, max_size), Image.LANCZOS)
+
+        if self.image_format == "JPEG" and image.mode != "RGB":
+            if "A" in image.getbands() or image.mode == "P":
+                # JPEG has no transparency, put the image on a white background
+                rgba = image.convert("RGBA")
+                background = Image.new("RGB", rgba.size, "white")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+
+        buffer = io.BytesIO()
+        if self.image_format == "PNG":
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.save(buffer, format=self.image_format, quality=self.quality)
+        return buffer.getvalue()
@@ -1,44 +1,546 @@
-import os
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, as_completed, wait
+from dataclasses import dataclass
 
 from PIL import Image
 
+from src.async_llm_client import AsyncLlmClient
+from src.candidate_scoring import score_composite, score_removal
 from src.llm_client import LlmClient
+from src.metrics import DISABLED, MetricEvent, Metrics
 from src.config import Configuration
+from src.dimensions import combine_asset_dimensions
+from src.image_loading import ImageLoader, decode_max_size, load_image
+from src.pipeline_events import AnalysisReady, CleanedRoomReady, CompositeReady
+from src.progressive_render import FINAL, PREVIEW, ProgressiveRender
+from src.region_compositing import paste_region, region_box
+from src.room_index import RoomIndex
+
+
+def _room_and_asset_paths(config: Configuration, room_file_name: str, asset_file_name: str):
+    return (config.get_room_image_path(room_file_name), "Room"), (config.get_asset_image_path(asset_file_name), "Asset")
+
+
+def _load_room_and_asset(config: Configuration, room_file_name: str, asset_file_name: str):
+    """Decodes the room and the asset down to the upload size, outside of the memory budget (see image_loading)."""
+    max_size = decode_max_size(config)
+    return tuple(load_image(path, kind, max_size) for path, kind in _room_and_asset_paths(config, room_file_name, asset_file_name))
+
+
+@dataclass
+class CandidateResult:
+    """The result of one asset of ImageProcessor.insert_assets_into_room: the image, or the error when it failed."""
+    asset_file_name: str
+    image: Image.Image = None
+    error: Exception = None
+    seconds: float = 0.0
 
 
 class ImageProcessor:
 
 
-    def __init__(self, config: Configuration, llm_client: LlmClient):
+    def __init__(self, config: Configuration, llm_client: LlmClient, metrics: Metrics = None, room_index: RoomIndex = None):
         self.llm_client = llm_client
         self.config = config
+        # catalogue rooms that are in the index skip the analysis and removal stages
+        self.room_index = room_index
+        # every stage is reported as a "stage" event, by default to the metrics of the client
+        self.metrics = metrics if metrics is not None else getattr(llm_client, "metrics", DISABLED)
+        self.last_stage_timings = {}
+        self.last_candidate_scores = {}
+        # decodes the rooms and assets at the upload size, within the memory budget of the process
+        self.image_loader = ImageLoader.from_config(config)
+        # the thread pool of the concurrent stages, shared by all renders of this processor
+        self.max_workers = config.pipeline_max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
 
-    def insert_asset_into_room(self, asset_file_name: str, room_file_name: str, asset_dimensions: str) -> Image:
-        room_img_path = self.config.get_room_image_path(room_file_name)
-        print(f"Room image path: {room_img_path}")
-        asset_img_path = self.config.get_asset_image_path(asset_file_name)
-        print(f"Asset image path: {asset_img_path}")
+    def insert_asset_into_room(self, asset_file_name: str, room_file_name: str, asset_dimensions: str, asset_name: str = "sofa",
+                               concurrent: bool = False, region: bool = None, candidates: int = None, timings: dict = None) -> Image:
+        """Replaces the asset in the room image by the new asset.
 
-        if not os.path.exists(room_img_path):
-            raise FileNotFoundError(f"Room image not found: {room_img_path}")
-        if not os.path.exists(asset_img_path):
-            raise FileNotFoundError(f"Asset image not found: {asset_img_path}")
+        Step 1 (analysis of the dimensions and placement) and step 2 (removal of the old asset) only need the room image,
+        so with [concurrent] they are fanned out over a thread pool. Step 3 waits for both results.
 
-        room_image = Image.open(room_img_path)
-        asset_image = Image.open(asset_img_path)
+        With [region] only the padded bounding box of the asset is sent to the image model in step 2 and 3, and the
+        result is blended back into the full resolution room (see region_compositing). Step 2 then needs the bounding
+        box from step 1, so the steps run one after another.
 
-        # step 1: determine dimensions in room
-        room_dimensions = self.llm_client.get_asset_dimensions(room_image)
+        When the room is in the room index, step 1 and 2 are read from the index instead (not with [region] or [candidates]).
 
-        # step 2: get the location and orientation of the asset
-        asset_location_orientation = self.llm_client.get_asset_location_orientation(room_image)
+        With more than one of [candidates] (and without [region]) step 2 and 3 generate that many candidates and keep
+        the best by local quality score (see candidate_scoring). When every candidate scores below
+        Configuration.pipeline_candidate_threshold the step is retried. The scores of the kept candidates are stored in
+        [last_candidate_scores].
 
-        # step 3: remove asset from room
-        room_without_asset_image = self.llm_client.remove_asset_from_image(room_image)
+        Args:
+            asset_file_name (str): file name of the new asset image.
+            room_file_name (str): file name of the room image.
+            asset_dimensions (str): a string describing the dimensions of the new asset.
+            asset_name (str): the type of asset to replace (e.g. sofa, bed).
+            concurrent (bool): run steps 1 and 2 at the same time instead of one after another.
+            region (bool): only regenerate the region around the asset, defaults to Configuration.pipeline_region_compositing.
+            candidates (int): the number of candidates of step 2 and 3, defaults to Configuration.pipeline_candidates.
+            timings (dict): receives the time spent per stage, pass one per render when renders run in parallel on
+                this processor.
 
-        # step 4: combine new asset piece with room where old asset piece is remove into one image
-        resulting_image = self.llm_client.combine_images(room_without_asset_image, asset_image, room_dimensions, asset_dimensions, asset_location_orientation)
+        Returns:
+            Image: the room with the new asset. The time spent per stage is also stored in [last_stage_timings].
+
+        Raises:
+            FileNotFoundError: If the room or asset image does not exist.
+        """
+        region = region if region is not None else self.config.pipeline_region_compositing
+        timings = timings if timings is not None else {}
+        start = time.perf_counter()
+
+        # the regenerated region is pasted into the room at full resolution
+        with self.image_loader.load(*_room_and_asset_paths(self.config, room_file_name, asset_file_name), full_resolution=region) as (room_image, asset_image):
+            if region:
+                resulting_image = self._insert_asset_into_region(room_image, asset_image, asset_dimensions, asset_name, timings)
+            elif (candidates or self.config.pipeline_candidates) > 1:
+                resulting_image = self._insert_best_candidate(room_image, asset_image, asset_dimensions, asset_name, concurrent,
+                                                              candidates or self.config.pipeline_candidates, timings)
+            else:
+                # step 1: determine dimensions in room and the location and orientation of the asset
+                # step 2: remove asset from room
+                analysis, room_without_asset_image = (self._indexed_room(room_file_name, asset_name, timings)
+                                                      or self._prepare_room(room_image, asset_name, concurrent, timings))
+                # the combine step doesn't need the room, free it before the slowest step
+                room_image.close()
+
+                # step 3: combine new asset piece with room where old asset piece is remove into one image
+                resulting_image = self._timed("combine", lambda: self.llm_client.combine_images(
+                    room_without_asset_image, asset_image, analysis.dimensions_text(),
+                    combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, room_without_asset_image.size), analysis.location_orientation_text(), asset_name=asset_name), timings)
+
+        timings["total"] = time.perf_counter() - start
+        self.last_stage_timings = timings
+        self._record("total", timings["total"], "ok")
+        print("Stage timings: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items()))
 
         return resulting_image
 
+
+    def insert_assets_into_room(self, room_file_name: str, assets: list, asset_name: str = "sofa", max_parallel: int = None):
+        """Places every asset of [assets] in the room, so a customer can compare them.
+
+        The room is analysed and cleaned only once (or read from the room index), then the combine step runs for all assets at the same time, limited
+        to [max_parallel] requests. The results are yielded as soon as they are ready, so in order of completion.
+
+        Args:
+            room_file_name (str): file name of the room image.
+            assets (list): (asset file name, asset dimensions) tuples of the assets to compare.
+            asset_name (str): the type of asset to replace (e.g. sofa, bed).
+            max_parallel (int): maximum number of combine requests at the same time, defaults to
+                Configuration.pipeline_max_parallel_combines.
+
+        Yields:
+            CandidateResult: the room with one of the assets, or the error when placing that asset failed.
+
+        Raises:
+            FileNotFoundError: If the room image or one of the asset images does not exist.
+        """
+        images = [(self.config.get_room_image_path(room_file_name), "Room")] + \
+                 [(self.config.get_asset_image_path(asset_file_name), "Asset") for asset_file_name, _ in assets]
+        with self.image_loader.load(*images) as (room_image, *asset_images):
+            timings = {}
+            analysis, room_without_asset_image = self._indexed_room(room_file_name, asset_name, timings) or self._prepare_room(room_image, asset_name, True, timings)
+            self.last_stage_timings = timings
+            room_image.close()
+
+            def combine(asset_image, asset_dimensions):
+                timings = {}
+                image = self._timed("combine", lambda: self.llm_client.combine_images(
+                    room_without_asset_image, asset_image, analysis.dimensions_text(),
+                    combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, room_without_asset_image.size), analysis.location_orientation_text(), asset_name=asset_name), timings)
+                return image, timings["combine"]
+
+            with ThreadPoolExecutor(max_workers=max_parallel or self.config.pipeline_max_parallel_combines, thread_name_prefix="combine") as executor:
+                futures = {executor.submit(combine, asset_image, asset_dimensions): asset_file_name
+                           for (asset_file_name, asset_dimensions), asset_image in zip(assets, asset_images)}
+                try:
+                    for future in as_completed(futures):
+                        try:
+                            image, seconds = future.result()
+                            yield CandidateResult(futures[future], image=image, seconds=seconds)
+                        except Exception as error:
+                            yield CandidateResult(futures[future], error=error)
+                finally:
+                    # the caller stopped early, don't start the combine requests that are still waiting
+                    for future in futures:
+                        future.cancel()
+
+
+    def stream_insert_asset_into_room(self, asset_file_name: str, room_file_name: str, asset_dimensions: str, asset_name: str = "sofa"):
+        """Streaming variant of insert_asset_into_room, yields an event as soon as a stage is done.
+
+        The analysis and removal stages run concurrently and are yielded in order of completion, so a frontend can show
+        the cleaned room while the new asset is being placed. If a stage fails, the other one is cancelled when it
+        didn't start yet and the error is raised.
+
+        Args:
+            asset_file_name (str): file name of the new asset image.
+            room_file_name (str): file name of the room image.
+            asset_dimensions (str): a string describing the dimensions of the new asset.
+            asset_name (str): the type of asset to replace (e.g. sofa, bed).
+
+        Yields:
+            PipelineEvent: AnalysisReady and CleanedRoomReady (in order of completion), then CompositeReady.
+
+        Raises:
+            FileNotFoundError: If the room or asset image does not exist.
+        """
+        start = time.perf_counter()
+        with self.image_loader.load(*_room_and_asset_paths(self.config, room_file_name, asset_file_name)) as (room_image, asset_image):
+            executor = self._get_executor()
+            futures = {
+                executor.submit(self.llm_client.analyze_room, room_image, asset_name): "analysis",
+                executor.submit(self.llm_client.remove_asset_from_image, room_image, asset_name): "remove_asset",
+            }
+            results = {}
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    if futures[future] == "analysis":
+                        yield AnalysisReady(time.perf_counter() - start, results["analysis"])
+                    else:
+                        yield CleanedRoomReady(time.perf_counter() - start, results["remove_asset"])
+            finally:
+                for future in futures:
+                    future.cancel()
+
+            analysis = results["analysis"]
+            image = self.llm_client.combine_images(results["remove_asset"], asset_image, analysis.dimensions_text(),
+                                                   combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, results["remove_asset"].size),
+                                                   analysis.location_orientation_text(), asset_name=asset_name)
+        yield CompositeReady(time.perf_counter() - start, image)
+
+
+    def progressive_insert_asset_into_room(self, asset_file_name: str, room_file_name: str, asset_dimensions: str,
+                                           asset_name: str = "sofa") -> ProgressiveRender:
+        """Progressive variant of insert_asset_into_room, returns a handle to a quick preview and the final render.
+
+        The preview is rendered by the fast model of Configuration.llm_model_name_preview and the final image by the
+        image processing (pro) model. Both run on the thread pool at the same time and share the analysis of the room,
+        so the preview is ready long before the final image. Show render.preview() first and replace it by
+        render.result(), or poll render.current(). Call render.cancel() when the preview is abandoned, the pro requests
+        that didn't start yet are then never sent.
+
+        Args:
+            asset_file_name (str): file name of the new asset image.
+            room_file_name (str): file name of the room image.
+            asset_dimensions (str): a string describing the dimensions of the new asset.
+            asset_name (str): the type of asset to replace (e.g. sofa, bed).
+
+        Returns:
+            ProgressiveRender: the running render. The time per stage is in render.timings, the time to preview and the
+                time to final in render.seconds.
+
+        Raises:
+            FileNotFoundError: If the room or asset image does not exist.
+        """
+        # the images live as long as the render runs in the background, so they aren't counted in the memory budget
+        room_image, asset_image = _load_room_and_asset(self.config, room_file_name, asset_file_name)
+
+        render = ProgressiveRender(self._get_executor(), self._record)
+        timings = render.timings
+
+        def tier(prefix, model):
+            def remove():
+                return self._timed(prefix + "remove_asset", lambda: self.llm_client.remove_asset_from_image(room_image, asset_name, model=model), timings)
+
+            def combine(analysis, room_without_asset_image):
+                return self._timed(prefix + "combine", lambda: self.llm_client.combine_images(
+                    room_without_asset_image, asset_image, analysis.dimensions_text(),
+                    combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, room_without_asset_image.size),
+                    analysis.location_orientation_text(), model=model, asset_name=asset_name), timings)
+            return remove, combine
+
+        return render.start(
+            lambda: self._timed("analysis", lambda: self.llm_client.analyze_room(room_image, asset_name), timings),
+            # model None: the image processing model with its fallback
+            {PREVIEW: tier("preview_", self.config.llm_model_name_preview), FINAL: tier("", None)},
+        )
+
+
+    def _insert_asset_into_region(self, room_image, asset_image, asset_dimensions, asset_name, timings):
+        """Runs the removal and combine stages on the region around the asset only and pastes the result into the room.
+
+        Falls back to the whole room when the analysis has no usable bounding box.
+        """
+        analysis = self._timed("analysis", lambda: self.llm_client.analyze_room(room_image, asset_name), timings)
+        box = region_box(analysis.bounding_box, room_image.size, self.config.pipeline_region_padding, self.config.pipeline_region_min_size)
+        if box is None:
+            print(f"No bounding box for the {asset_name}, regenerating the whole room")
+            region_image = room_image
+        else:
+            print(f"Regenerating region {box} of the room")
+            region_image = room_image.crop(box)
+
+        room_without_asset_image = self._timed("remove_asset", lambda: self.llm_client.remove_asset_from_image(region_image, asset_name), timings)
+        # the model gets the crop, the footprint in the full room doesn't apply to it
+        resulting_image = self._timed("combine", lambda: self.llm_client.combine_images(
+            room_without_asset_image, asset_image, analysis.dimensions_text(),
+            combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name), analysis.location_orientation_text(), asset_name=asset_name), timings)
+        if box is None or resulting_image is None:
+            return resulting_image
+        return self._timed("paste", lambda: paste_region(room_image, resulting_image, box, self.config.pipeline_region_feather), timings)
+
+
+    def _insert_best_candidate(self, room_image, asset_image, asset_dimensions, asset_name, concurrent, count, timings):
+        """Runs the pipeline with [count] candidates for the removal and combine stages and returns the best composite."""
+        self.last_candidate_scores = {}
+        padding = self.config.pipeline_region_padding
+
+        def remove_candidates(attempt):
+            return self._generate_candidates(self.llm_client.remove_asset_candidates, count, attempt, room_image, asset_name)
+
+        analysis, removed = self._prepare_room(room_image, asset_name, concurrent, timings, remove=lambda: remove_candidates(0))
+        room_without_asset_image = self._best_candidate(
+            "remove_asset", remove_candidates, lambda candidate: score_removal(room_image, candidate, analysis.bounding_box, padding), timings, removed)
+        # the room was only needed to generate and score the removal candidates
+        room_image.close()
+
+        def combine_candidates(attempt):
+            return self._generate_candidates(self.llm_client.combine_image_candidates, count, attempt, room_without_asset_image, asset_image,
+                                             analysis.dimensions_text(),
+                                             combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, room_without_asset_image.size),
+                                             analysis.location_orientation_text(), asset_name=asset_name)
+
+        return self._best_candidate("combine", combine_candidates, lambda candidate: score_composite(
+            room_without_asset_image, asset_image, candidate, analysis.bounding_box, padding, self.config.pipeline_candidate_weights), timings)
+
+
+    def _generate_candidates(self, generate, count, attempt, *args, **kwargs) -> list:
+        """Returns [count] candidates of generate(*args, **kwargs), from one request or from [count] requests at the same time.
+
+        Every attempt uses other seeds, so a retry gets new candidates. A failing request in parallel mode only loses
+        its candidate, the error is raised when all of them fail.
+        """
+        seeds = [attempt * count + index for index in range(count)]
+        if self.config.pipeline_candidate_mode == "candidate_count":
+            return generate(*args, candidate_count=count, seed=seeds[0], **kwargs)
+
+        candidates, errors = [], []
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="candidate") as executor:
+            for future in [executor.submit(generate, *args, seed=seed, **kwargs) for seed in seeds]:
+                try:
+                    candidates.extend(future.result())
+                except Exception as error:
+                    print(f"Candidate request failed: {error}")
+                    errors.append(error)
+        if not candidates and errors:
+            raise errors[0]
+        return candidates
+
+
+    def _best_candidate(self, name, generate, score, timings, candidates=None):
+        """Returns the candidate with the highest score, retrying generate(attempt) while every candidate is below the threshold.
+
+        [candidates] are the candidates of the first attempt when they were generated already.
+
+        Raises:
+            RuntimeError: If the model returned no images at all.
+        """
+        threshold = self.config.pipeline_candidate_threshold
+        best = None
+        for attempt in range(self.config.pipeline_candidate_retries + 1):
+            if candidates is None or attempt > 0:
+                candidates = self._timed(name, lambda: generate(attempt), timings)
+            scored = [(score(candidate), candidate) for candidate in candidates]
+            print(f"Scores of the {name} candidates: " + ", ".join(f"{candidate_score.total:.3f}" for candidate_score, _ in scored))
+            for candidate_score, candidate in scored:
+                if best is None or candidate_score.total > best[0].total:
+                    best = candidate_score, candidate
+            if best is not None and best[0].total >= threshold:
+                break
+            print(f"Every {name} candidate scored below {threshold}")
+
+        if best is None:
+            raise RuntimeError(f"The {name} stage returned no images")
+        self.last_candidate_scores[name] = best[0]
+        return best[1]
+
+
+    def _indexed_room(self, room_file_name, asset_name, timings):
+        """Returns the analysis and the room without the asset from the room index, or None when the room isn't indexed."""
+        if self.room_index is None:
+            return None
+        start = time.perf_counter()
+        indexed = self.room_index.lookup(self.config.get_room_image_path(room_file_name), asset_name)
+        result = (indexed.analysis, indexed.room_without_asset()) if indexed is not None else None
+        timings["index"] = time.perf_counter() - start
+        self._record("index", timings["index"], "hit" if result is not None else "miss")
+        return result
+
+
+    def _prepare_room(self, room_image, asset_name, concurrent, timings, remove=None):
+        """Runs the analysis and removal stages on the room, returns the analysis and the room without the asset.
+
+        [remove] replaces the removal stage, e.g. to generate candidates.
+        """
+        stages = {
+            "analysis": lambda: self.llm_client.analyze_room(room_image, asset_name),
+            "remove_asset": remove or (lambda: self.llm_client.remove_asset_from_image(room_image, asset_name)),
+        }
+        if concurrent:
+            # PIL loads images lazily, make sure the shared room image isn't decoded by multiple threads at once
+            room_image.load()
+            results = self._run_stages_concurrently(stages, timings)
+        else:
+            results = {name: self._timed(name, stage, timings) for name, stage in stages.items()}
+        return results["analysis"], results["remove_asset"]
+
+
+    def _run_stages_concurrently(self, stages, timings) -> dict:
+        """Runs the stages on the thread pool and waits until all of them are done.
+
+        If one of the stages fails, the stages that did not start yet are cancelled and the first error is raised.
+        Stages that are already running can't be interrupted; their results are discarded.
+        """
+        executor = self._get_executor()
+        futures = {executor.submit(self._timed, name, stage, timings): name for name, stage in stages.items()}
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+        failed = [future for future in done if future.exception() is not None]
+        if failed:
+            for future in not_done:
+                future.cancel()
+            print(f"Stage '{futures[failed[0]]}' failed, cancelled the remaining stages")
+            raise failed[0].exception()
+
+        return {name: future.result() for future, name in futures.items()}
+
+
+    def reserve_workers(self, max_workers: int):
+        """Grows the thread pool of the concurrent stages to at least [max_workers], for callers that run renders in parallel."""
+        with self._executor_lock:
+            if max_workers <= self.max_workers:
+                return
+            self.max_workers = max_workers
+            if self._executor is not None:
+                # the stages that were already submitted still run, new stages go to the larger pool
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-processor")
+            return self._executor
+
+
+    def _timed(self, name, stage, timings):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = stage()
+            outcome = "ok"
+            return result
+        finally:
+            timings[name] = time.perf_counter() - start
+            self._record(name, timings[name], outcome)
+
+
+    def _record(self, name, seconds, outcome):
+        if self.metrics.enabled:
+            self.metrics.record(MetricEvent("stage", name, seconds=seconds, outcome=outcome))
+
+
+class AsyncImageProcessor:
+    """Asyncio counterpart of ImageProcessor, so one process can serve many renders at the same time.
+
+    The analysis stages of a render run concurrently, the number of requests in flight is limited by the AsyncLlmClient.
+    """
+
+    def __init__(self, config: Configuration, llm_client: AsyncLlmClient):
+        self.llm_client = llm_client
+        self.config = config
+
+
+    async def insert_asset_into_room(self, asset_file_name: str, room_file_name: str, asset_dimensions: str, asset_name: str = "sofa") -> Image:
+        """Replaces the asset in the room image by the new asset, see ImageProcessor.insert_asset_into_room.
+
+        Args:
+            asset_file_name (str): file name of the new asset image.
+            room_file_name (str): file name of the room image.
+            asset_dimensions (str): a string describing the dimensions of the new asset.
+            asset_name (str): the type of asset to replace (e.g. sofa, bed).
+
+        Returns:
+            Image: the room with the new asset.
+
+        Raises:
+            FileNotFoundError: If the room or asset image does not exist.
+        """
+        loop = asyncio.get_running_loop()
+        room_image, asset_image = await loop.run_in_executor(None, self._load_images, room_file_name, asset_file_name)
+
+        # step 1 and 2: the analysis and removal of the asset only need the room image
+        analysis, room_without_asset_image = await self._gather_stages(
+            self.llm_client.analyze_room(room_image, asset_name),
+            self.llm_client.remove_asset_from_image(room_image, asset_name),
+        )
+
+        # step 3: combine new asset piece with room where old asset piece is remove into one image
+        return await self.llm_client.combine_images(room_without_asset_image, asset_image, analysis.dimensions_text(),
+                                                    combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, room_without_asset_image.size),
+                                                    analysis.location_orientation_text(), asset_name=asset_name)
+
+
+    async def stream_insert_asset_into_room(self, asset_file_name: str, room_file_name: str, asset_dimensions: str, asset_name: str = "sofa"):
+        """Async iterator variant of insert_asset_into_room, see ImageProcessor.stream_insert_asset_into_room.
+
+        Yields:
+            PipelineEvent: AnalysisReady and CleanedRoomReady (in order of completion), then CompositeReady.
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        room_image, asset_image = await loop.run_in_executor(None, self._load_images, room_file_name, asset_file_name)
+
+        analysis_task = asyncio.ensure_future(self.llm_client.analyze_room(room_image, asset_name))
+        removal_task = asyncio.ensure_future(self.llm_client.remove_asset_from_image(room_image, asset_name))
+        pending = {analysis_task, removal_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is analysis_task:
+                        yield AnalysisReady(time.perf_counter() - start, task.result())
+                    else:
+                        yield CleanedRoomReady(time.perf_counter() - start, task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        analysis = analysis_task.result()
+        image = await self.llm_client.combine_images(removal_task.result(), asset_image, analysis.dimensions_text(),
+                                                     combine_asset_dimensions(self.config, asset_dimensions, analysis, asset_name, removal_task.result().size),
+                                                     analysis.location_orientation_text(), asset_name=asset_name)
+        yield CompositeReady(time.perf_counter() - start, image)
+
+
+    def _load_images(self, room_file_name, asset_file_name):
+        # waiting for the memory budget would block the event loop, the concurrency of the client limits the renders instead
+        return _load_room_and_asset(self.config, room_file_name, asset_file_name)
+
+
+    @staticmethod
+    async def _gather_stages(*stages) -> list:
+        """Runs the stages concurrently, on the first failure the other stages are cancelled and the error is raised."""
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+            return [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
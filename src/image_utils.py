@@ -0,0 +1,66 @@
+import hashlib
+import io
+
+from PIL import Image
+
+_DIGEST_ROWS = 256     # rows of pixels per strip of image_digest
+
+
+def image_digest(image: Image) -> str:
+    """Returns a hash of the content of the image.
+
+    The hash is based on the decoded pixels (plus mode and size), so the same image stored in a different file or format
+    gets the same digest.
+
+    Args:
+        image (Image): a PIL Image.
+
+    Returns:
+        str: the sha256 hex digest of the image content.
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    # hash the pixels in strips of rows, instead of copying all of them into one bytes object
+    width, height = image.size
+    for top in range(0, height, _DIGEST_ROWS):
+        digest.update(image.crop((0, top, width, min(top + _DIGEST_ROWS, height))).tobytes())
+    return digest.hexdigest()
+
+
+def response_image(response) -> Image:
+    """Returns the first image in a generate_content response as a PIL Image, or None if there is no image.
+
+    Args:
+        response (GenerateContentResponse): the response of the model.
+
+    Returns:
+        Image: the generated image, decoded by PIL.
+    """
+    return _first_image(response.parts)
+
+
+def response_images(response) -> list:
+    """Returns the first image of every candidate in a generate_content response, candidates without an image are skipped.
+
+    Args:
+        response (GenerateContentResponse): the response of the model, with one or more candidates.
+
+    Returns:
+        list: the generated images, decoded by PIL.
+    """
+    images = (_first_image(candidate.content.parts if candidate.content is not None else None) for candidate in response.candidates or ())
+    return [image for image in images if image is not None]
+
+
+def _first_image(parts) -> Image:
+    for part in parts or ():
+        if part.inline_data is not None and part.inline_data.data and (part.inline_data.mime_type or "").startswith("image/"):
+            image = Image.open(io.BytesIO(part.inline_data.data))
+            image.load()
+            return image
+    return None
+
+
+def response_text(response) -> str:
+    """Returns all the text parts of a generate_content response joined together."""
+    return "".join(part.text for part in response.parts or () if part.text is not None)
+
@@ -0,0 +1,285 @@
+"""
+Runs many room/asset render jobs on a pool of worker threads or processes, and resumes an interrupted run.
+
+The jobs come from a manifest (see batch_renderer.load_manifest) or from a directory tree (see discover_jobs). Every
+job is rendered with ImageProcessor.insert_asset_into_room, and the image and a JSON file with the metadata of the job
+(duration and stage timings) are written to the output path. Every finished job is appended to the journal
+(journal.jsonl in the output path) right away, so a new run with the same output path skips the jobs that succeeded
+and only redoes the failed jobs and the jobs that were in flight when the run was interrupted.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import asdict
+
+from src.batch_renderer import RenderJob, load_manifest
+from src.config import Configuration
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+SUMMARY_FILE_NAME = "run-summary.json"
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# the ImageProcessor of a worker process, made by _init_process
+_process_processor = None
+
+
+def job_id(job: RenderJob) -> str:
+    """Returns a stable id of [job]: the same room, asset, dimensions and asset name give the same id in every run."""
+    return hashlib.sha256(json.dumps(asdict(job), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def discover_jobs(directory: str, asset_name: str = "sofa") -> list:
+    """Finds the render jobs in a directory tree.
+
+    Every directory (at any depth) with a room image named room.* and an asset image named asset.* is one job. The
+    dimensions of the asset are read from dimensions.txt in the same directory, if there is one.
+
+    Returns:
+        list: the RenderJob objects with absolute paths to the images, ordered by directory.
+    """
+    jobs = []
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        images = {os.path.splitext(name)[0].lower(): name for name in sorted(files) if name.lower().endswith(_IMAGE_EXTENSIONS)}
+        if "room" not in images or "asset" not in images:
+            continue
+        asset_dimensions = ""
+        if "dimensions.txt" in files:
+            with open(os.path.join(root, "dimensions.txt"), encoding="utf-8") as f:
+                asset_dimensions = f.read().strip()
+        root = os.path.abspath(root)
+        jobs.append(RenderJob(os.path.join(root, images["room"]), os.path.join(root, images["asset"]), asset_dimensions, asset_name))
+    return jobs
+
+
+def load_jobs(path: str, asset_name: str = "sofa") -> list:
+    """Returns the jobs of the directory tree (see discover_jobs) or the manifest file (see load_manifest) at [path]."""
+    if os.path.isdir(path):
+        return discover_jobs(path, asset_name)
+    return load_manifest(path)
+
+
+class RenderJournal:
+    """The journal of a run: one line of JSON per finished job, appended and flushed to disk as soon as the job ends.
+
+    A line that was cut off because the process was killed while writing it is ignored when the journal is read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._repaired = False
+
+
+    def entries(self) -> dict:
+        """Returns the last entry per job id."""
+        entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entries[entry["job_id"]] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+
+    def succeeded(self, output_path: str) -> set:
+        """Returns the ids of the jobs that succeeded and whose image is still in [output_path]."""
+        return {job_id for job_id, entry in self.entries().items()
+                if entry["status"] == "succeeded" and os.path.exists(os.path.join(output_path, entry["output"]))}
+
+
+    def append(self, entry: dict):
+        if not self._repaired:
+            self._end_with_newline()
+            self._repaired = True
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def _end_with_newline(self):
+        # a line that was cut off must not be glued to the first entry of this run
+        try:
+            with open(self.path, "rb+") as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        except FileNotFoundError:
+            pass
+
+
+def run_jobs(jobs: list, output_path: str, processor_factory, workers: int = 4, processes: bool = False) -> dict:
+    """Renders [jobs] that didn't succeed in an earlier run with the same [output_path], [workers] at the same time.
+
+    Args:
+        jobs (list): the RenderJob objects to render.
+        output_path (str): the directory of the images, the metadata, the journal and the summary.
+        processor_factory: a callable without arguments that returns an ImageProcessor. It is called once per worker
+            thread, or once per worker process with [processes], then it must be picklable.
+        workers (int): the number of jobs that are rendered at the same time.
+        processes (bool): render in worker processes instead of threads.
+
+    Returns:
+        dict: the summary of the run, see summarize. It is also written to run-summary.json in [output_path].
+    """
+    os.makedirs(output_path, exist_ok=True)
+    journal = RenderJournal(os.path.join(output_path, JOURNAL_FILE_NAME))
+    done = journal.succeeded(output_path)
+    todo = [job for job in jobs if job_id(job) not in done]
+    skipped = len(jobs) - len(todo)
+    print(f"{len(jobs)} jobs, {skipped} already succeeded, rendering {len(todo)} with {workers} worker {'processes' if processes else 'threads'}")
+
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_process, initargs=(processor_factory,))
+        render = _render_in_process
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render-job")
+        local = threading.local()
+
+        def render(job, output_path):
+            if not hasattr(local, "processor"):
+                local.processor = processor_factory()
+            return _render(local.processor, job, output_path)
+
+    entries = []
+    interrupted = False
+    started = time.monotonic()
+
+    def finish(future, job):
+        try:
+            entry = future.result()
+        except Exception as error:
+            # the worker itself failed, e.g. a worker process that died
+            entry = _entry(job, "failed", 0.0, error=f"{type(error).__name__}: {error}")
+        journal.append(entry)
+        entries.append(entry)
+        print(f"[{skipped + len(entries)}/{len(jobs)}] {entry['status']} {entry['job']['room']} + {entry['job']['asset']} in {entry['seconds']:.1f}s"
+              + (f": {entry['error']}" if entry["error"] else ""))
+
+    # only a few jobs per worker are submitted ahead, so the queue stays small for runs of thousands of jobs
+    pending = iter(todo)
+    running = {}
+    try:
+        while True:
+            for job in pending:
+                running[executor.submit(render, job, output_path)] = job
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                finish(future, running.pop(future))
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Interrupted, waiting for the jobs that are running. The remaining jobs are rendered when the run is resumed")
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future, job in running.items():
+            if not future.cancelled():
+                finish(future, job)
+    finally:
+        executor.shutdown(wait=True)
+
+    summary = summarize(entries, skipped, time.monotonic() - started)
+    summary["interrupted"] = interrupted
+    with open(os.path.join(output_path, SUMMARY_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def summarize(entries: list, skipped: int, wall_seconds: float) -> dict:
+    """Returns the counts, the throughput and the latency percentiles of the jobs that were rendered in this run."""
+    seconds = sorted(entry["seconds"] for entry in entries)
+    succeeded = sum(entry["status"] == "succeeded" for entry in entries)
+    summary = {
+        "rendered": len(entries),
+        "succeeded": succeeded,
+        "failed": len(entries) - succeeded,
+        "skipped": skipped,
+        "wall_seconds": wall_seconds,
+        "jobs_per_minute": len(entries) / wall_seconds * 60 if wall_seconds > 0 else 0.0,
+    }
+    if seconds:
+        summary["latency_seconds"] = {
+            "mean": sum(seconds) / len(seconds),
+            **{f"p{p}": seconds[min(len(seconds) - 1, int(len(seconds) * p / 100))] for p in (50, 90, 99)},
+            "max": seconds[-1],
+        }
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    text = (f"Rendered {summary['rendered']} jobs ({summary['succeeded']} succeeded, {summary['failed']} failed, "
+            f"{summary['skipped']} skipped) in {summary['wall_seconds']:.1f}s: {summary['jobs_per_minute']:.1f} jobs/minute")
+    latency = summary.get("latency_seconds")
+    if latency:
+        text += "\nLatency: " + ", ".join(f"{name}={value:.1f}s" for name, value in latency.items())
+    if summary.get("interrupted"):
+        text += "\nThe run was interrupted, run it again to render the remaining jobs"
+    return text
+
+
+def create_processor(resources: str, processes: int = 1):
+    """Returns an ImageProcessor on the bulk lane for the Configuration of [resources], with the metrics, cache and room index.
+
+    The rate limits of the models are shared by [processes] worker processes, every process gets an equal share.
+    """
+    from src.cache import with_cache
+    from src.image_processor import ImageProcessor
+    from src.llm_client import LlmClient
+    from src.rate_scheduler import BULK
+    from src.room_index import RoomIndex
+
+    config = Configuration(resources)
+    config.llm_rate_headroom = config.llm_rate_headroom / processes
+    # batch runs must never delay customer-facing renders
+    client = with_cache(LlmClient(config).with_lane(BULK))
+    # the stages are reported to the metrics of the client, a second sink on the same file would interleave the lines
+    return ImageProcessor(config, client, client.metrics, RoomIndex.from_config(config))
+
+
+def _init_process(processor_factory):
+    global _process_processor
+    _process_processor = processor_factory()
+
+
+def _render_in_process(job, output_path):
+    return _render(_process_processor, job, output_path)
+
+
+def _render(processor, job: RenderJob, output_path: str) -> dict:
+    """Renders one job and writes its image and metadata, the errors of the job are returned in the entry."""
+    started = time.monotonic()
+    try:
+        image = processor.insert_asset_into_room(job.asset, job.room, job.asset_dimensions, job.asset_name)
+    except Exception as error:
+        return _entry(job, "failed", time.monotonic() - started, error=f"{type(error).__name__}: {error}")
+    seconds = time.monotonic() - started
+
+    name = f"{_stem(job.room)}-{_stem(job.asset)}-{job_id(job)}"
+    image.save(os.path.join(output_path, name + ".png"))
+    entry = _entry(job, "succeeded", seconds, output=name + ".png", stage_timings=dict(processor.last_stage_timings))
+    with open(os.path.join(output_path, name + ".json"), "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=2)
+    return entry
+
+
+def _entry(job, status, seconds, output=None, stage_timings=None, error=None) -> dict:
+    return {"job_id": job_id(job), "job": asdict(job), "status": status, "output": output, "seconds": seconds,
+            "stage_timings": stage_timings or {}, "error": error, "finished_at": time.time()}
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
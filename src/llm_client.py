@@ -1,20 +1,63 @@
+import copy
+import time
+
 import google.genai as genai
-from google.genai import types
+from google.genai import errors, types
 
 from PIL import Image
-from google.api_core import exceptions
 
 from src.config import Configuration
-from src.exceptions import LlmUnavailableError
+from src.exceptions import HedgeCancelledError
+from src.file_store import UploadedFileStore
+from src.hedging import Hedger
+from src.image_preparation import ImagePreparer
+from src.image_utils import response_image, response_images
+from src.metrics import Metrics, request_bytes, request_event
+from src.rate_scheduler import INTERACTIVE, RateScheduler, estimate_tokens
+from src.resilience import ResilientCaller
+from src.transport import REPLAY, CassetteTransport
+from src.prompts import (
+    ASSET_DIMENSIONS_CONFIG, ASSET_DIMENSIONS_PROMPT, COMBINE_IMAGES_CONFIG, LOCATION_ORIENTATION_CONFIG, REMOVE_ASSET_CONFIG, ROOM_ANALYSIS_CONFIG,
+    combine_images_prompt, location_orientation_prompt, remove_asset_prompt, room_analysis_prompt,
+)
+from src.room_analysis import RoomAnalysis
+
+
+def create_genai_client(config: Configuration) -> genai.Client:
+    """Returns a genai.Client for the API key and the (optional) base url of [config]."""
+    return genai.Client(api_key=config.llm_api_key, http_options=types.HttpOptions(base_url=config.llm_base_url))
 
 
 class LlmClient:
-    def __init__(self, config: Configuration):
+    def __init__(self, config: Configuration, resilient_caller: ResilientCaller = None, metrics: Metrics = None,
+                 rate_scheduler: RateScheduler = None, lane: str = INTERACTIVE, transport: CassetteTransport = None, hedger: Hedger = None):
         self.config = config
-        self.client = genai.Client(api_key=self.config.llm_api_key)
-
-
-    def remove_asset_from_image(self, room, asset_name):
+        # sends the requests, or records and replays them from cassettes (Configuration.llm_transport_mode)
+        self.transport = transport if transport is not None else CassetteTransport.from_config(self.config)
+        # a replay never calls the API, so it doesn't need an API key
+        self.client = create_genai_client(self.config) if self.transport.mode != REPLAY else None
+        # timings, token usage and payload sizes of every request, disabled unless configured or given explicitly
+        self.metrics = metrics if metrics is not None else Metrics.from_config(self.config)
+        # with the Files API every distinct image is uploaded once and referenced by URI in all stages
+        file_store = UploadedFileStore(self.client.files, metrics=self.metrics) if self.config.llm_use_files_api and self.client is not None else None
+        self.image_preparer = ImagePreparer.from_config(self.config, file_store)
+        # retries, retry budget and circuit breakers are shared by all clients in the process, unless given explicitly
+        self.resilient_caller = resilient_caller if resilient_caller is not None else ResilientCaller.shared(self.config)
+        # the rate limits of the models are shared as well, [lane] is the priority of the requests of this client
+        self.rate_scheduler = rate_scheduler if rate_scheduler is not None else RateScheduler.shared(self.config)
+        self.lane = lane
+        # slow image processing requests are sent twice when hedging is enabled, shared by all clients in the process
+        self.hedger = hedger if hedger is not None else Hedger.shared(self.config)
+
+
+    def with_lane(self, lane: str) -> "LlmClient":
+        """Returns a client that shares everything with this one, but sends its requests in [lane] (interactive or bulk)."""
+        client = copy.copy(self)
+        client.lane = lane
+        return client
+
+
+    def remove_asset_from_image(self, room, asset_name, model: str = None):
         """Removes an asset from an image using an LLM.
 
         This method sends an image of a room to a generative AI model
@@ -25,55 +68,38 @@ class LlmClient:
         Args:
             room (Image): A PIL Image object of the room.
             asset_name (str): The name of the asset to be removed from the image.
+            model (str): The image model to use instead of the configured one (without fallback), e.g. for a preview.
 
         Returns:
             Image: A PIL Image object with the specified asset removed.
 
         Raises:
             RuntimeError: If the image cleanup process fails.
+            LlmUnavailableError: If the model (and its fallback) keeps failing after retrying.
         """
 
-        prompt = f"""
-        The goal is to remove the {asset_name} from the room image.
-        
-        Step 1: Identify the {asset_name}
-            Identify the {asset_name} in the image and understand its surroundings. 
-        
-        Step 2: Remove the {asset_name}
-            Remove the {asset_name} from the room. If there are any assets are attached to the {asset_name} also remove those.
-            
-        Step 3: Fill the gap
-             Fill the gap that is left after you removed the {asset_name} in a way that the image looks natural and realistic, as if the {asset_name} was never there.
-             Use the surroundings of the {asset_name} to fill the gap, so the style, lighting and texture of the original image is maintained as much as possible.
-
-        Step 4: Verify
-            Verify that the {asset_name} is completely removed and the image looks natural and realistic, as if the {asset_name} was never there. 
-            Make sure you didn't change anything else in the image except removing the {asset_name} and filling the gap that is left after you removed the {asset_name}.
-        
-        Rules:
-            - Make no changes to the other assets in the room
-        """
+        prompt = remove_asset_prompt(asset_name)
 
         print(f"Cleanup the image with prompt:\n{prompt}")
 
-        response = self.client.models.generate_content(
-            model=self.config.llm_model_name_image_processing,
+        response = self._generate_content(
+            "remove_asset",
+            model=model or self.config.llm_model_name_image_processing,
             contents=[prompt, room],
-            config=types.GenerateContentConfig(
-                system_instruction="you are an expert in image composition, creating clean, sharp, highres image with soft ambient lighting without changing the original image too much",
-                candidate_count=1,
-                temperature=0
-            )
+            config=REMOVE_ASSET_CONFIG,
+            fallback_model=None if model else self.config.llm_model_name_image_processing_fallback
         )
 
-        if response.parts is not None:
-            print("Removed the {asset_name} from the image!")
-            return response.parts[0].as_image()
+        image = response_image(response)
+        if image is not None:
+            print(f"Removed the {asset_name} from the image!")
+            return image
 
         raise RuntimeError("image cleanup failed")
 
 
-    def combine_images(self, room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset):
+    def combine_images(self, room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset,
+                       model: str = None, asset_name: str = "sofa"):
         """
         Combines a room image with an asset image using a generative model.
 
@@ -87,61 +113,71 @@ class LlmClient:
             room_dimensions (str): A string describing the dimensions of existing assets in the room.
             asset_dimensions (str): A string describing the dimensions of the new asset.
             location_orientation_asset (str): A string describing the desired location and orientation of the new asset.
+            model (str): The image model to use instead of the configured one (without fallback), e.g. for a preview.
+            asset_name (str): the type of asset to place (e.g. sofa, bed).
 
         Returns:
             Image: A new PIL Image object showing the room with the asset placed inside.
 
         Raises:
-            LlmUnavailableError: If the call to the generative AI model fails.
+            LlmUnavailableError: If the model (and its fallback) keeps failing after retrying.
         """
 
-        prompt = f"""
-        The goal is to place a sofa (=image 2) in the living room (=image 1).
-        
-        Step 1: This is the information about the location and orientation of the new sofa:
-            {location_orientation_asset}
-            This information helps you place the sofa on the correct place in the living room.
-        
-        Step 2: These are the dimensions of various assets in the living room: 
-            {room_dimensions}
-            These dimensions help you determine the scale of the room and all other assets. 
-        
-        Step 3: These are the dimensions of the sofa:
-            {asset_dimensions} 
-            These dimensions of the sofa combined with the dimension of the assets in the living room help you determine the scale of the sofa.
-             
-        Step 4: Place the new sofa
-            Generate an image where the sofa is placed in the living room:
-            - on the location and orientation determined in step 1.
-            - scaled properly using the dimensions provided in step 2 and step 3.
-        
-        Step 5: Verify
-            Verify that the sofa in the new generated room looks exactly like the original provided sofa image.
-            
-        Step 6: Realism
-            Add realistic shadows underneath the new sofa and highlights on the sofa are consistent with the sunlight in the scene. 
-            
-        Rules:
-            - You are allowed to scale the sofa
-            - MAKE NO OTHER CHANGES TO THE SOFA
-            - Make no changes to the other assets in the room
-        """
-        # add a try - raise 503 unavailable error if the LLM call fails, so we can retry in the image processor
-        try:
-            response = self.client.models.generate_content(
-                model=self.config.llm_model_name_image_processing,
-                contents=[prompt, room_image_with_missing_asset, asset_image],
-                config=types.GenerateContentConfig(
-                    system_instruction="je bent een expert in image composition",
-                    candidate_count=1,
-                    temperature=0
-                )
-            )
-        except exceptions.GoogleAPICallError:
-            raise LlmUnavailableError("LLM API call failed")
+        prompt = combine_images_prompt(room_dimensions, asset_dimensions, location_orientation_asset, asset_name)
+        response = self._generate_content(
+            "combine",
+            model=model or self.config.llm_model_name_image_processing,
+            contents=[prompt, room_image_with_missing_asset, asset_image],
+            config=COMBINE_IMAGES_CONFIG,
+            fallback_model=None if model else self.config.llm_model_name_image_processing_fallback
+        )
 
         print("Afbeelding succesvol gegenereerd!")
-        return response.parts[0].as_image()
+        return response_image(response)
+
+
+    def remove_asset_candidates(self, room, asset_name, candidate_count: int = 1, temperature: float = None, seed: int = None) -> list:
+        """Variant of remove_asset_from_image that returns [candidate_count] candidate images from one request.
+
+        Args:
+            room (Image): A PIL Image object of the room.
+            asset_name (str): The name of the asset to be removed from the image.
+            candidate_count (int): The number of candidates the model generates.
+            temperature (float): The sampling temperature, defaults to Configuration.pipeline_candidate_temperature.
+            seed (int): The sampling seed, give every request another seed to get other candidates.
+
+        Returns:
+            list: The candidate PIL Images, a candidate without an image is left out.
+
+        Raises:
+            LlmUnavailableError: If the model (and its fallback) keeps failing after retrying.
+        """
+        return self._image_candidates("remove_asset", [remove_asset_prompt(asset_name), room], REMOVE_ASSET_CONFIG, candidate_count, temperature, seed)
+
+
+    def combine_image_candidates(self, room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, location_orientation_asset,
+                                 candidate_count: int = 1, temperature: float = None, seed: int = None, asset_name: str = "sofa") -> list:
+        """Variant of combine_images that returns [candidate_count] candidate images from one request.
+
+        Args:
+            room_image_with_missing_asset (Image): A PIL Image of the room where the asset will be placed.
+            asset_image (Image): A PIL Image of the asset to place in the room.
+            room_dimensions (str): A string describing the dimensions of existing assets in the room.
+            asset_dimensions (str): A string describing the dimensions of the new asset.
+            location_orientation_asset (str): A string describing the desired location and orientation of the new asset.
+            candidate_count (int): The number of candidates the model generates.
+            temperature (float): The sampling temperature, defaults to Configuration.pipeline_candidate_temperature.
+            seed (int): The sampling seed, give every request another seed to get other candidates.
+            asset_name (str): the type of asset to place (e.g. sofa, bed).
+
+        Returns:
+            list: The candidate PIL Images, a candidate without an image is left out.
+
+        Raises:
+            LlmUnavailableError: If the model (and its fallback) keeps failing after retrying.
+        """
+        prompt = combine_images_prompt(room_dimensions, asset_dimensions, location_orientation_asset, asset_name)
+        return self._image_candidates("combine", [prompt, room_image_with_missing_asset, asset_image], COMBINE_IMAGES_CONFIG, candidate_count, temperature, seed)
 
 
     def get_asset_dimensions(self, room_image) -> str:
@@ -160,24 +196,13 @@ class LlmClient:
 
             [asset-name-1]: area=[area], depth=[depth], width=[width], height=[height]
         """
-        prompt = """
-        Estimate the size of ALL the assets you see in the image.
-        Most important size is the area that each asset takes up so this can be used in a later request to LLM to replace an asset in the image.
-        reply depth, width and height in cms and area in cm2 and use this format:
-        
-        [asset-name-1]: area=[area], depth=[depth], width=[width], height=[height]
-        [asset-name-2]: area=[area], depth=[depth], width=[width], height=[height]
-        ...
-        
-        don't use any leading sentence, just deliver the dimensions in the format described.
-        """
+        prompt = ASSET_DIMENSIONS_PROMPT
 
-        response = self.client.models.generate_content(
+        response = self._generate_content(
+            "dimensions",
             model=self.config.llm_model_name_dimensions,
             contents=[prompt, room_image],
-            # config=types.GenerateContentConfig(
-            #     system_instruction="you are an expert in image recognition and you are the best in estimating the size of assets in a picture based on your experience",
-            # )
+            config=ASSET_DIMENSIONS_CONFIG
         )
 
         dimensions = ""
@@ -205,26 +230,13 @@ class LlmClient:
 
             orientation: [orientation]
         """
-        prompt = f"""
-        Describe the location and the orientation of the {asset_name} in the room.  
-        Use this format:
-            location: [location]
-            orientation: [orientation]
-
-        Rules:
-            - location: Don't describe the form or design of the {asset_name}, just the place where the main part of the {asset_name} is located in relation to other assets. 
-            - orientation: Don't describe the form or design of the {asset_name}, just where the sofa is oriented to, in relation to the viewer.
-            - don't use any leading sentence, deliver the information in the format described.
-        """
+        prompt = location_orientation_prompt(asset_name)
 
-        response = self.client.models.generate_content(
+        response = self._generate_content(
+            "location_orientation",
             model=self.config.llm_model_name_dimensions,
             contents=[prompt, room_image],
-            config=types.GenerateContentConfig(
-                system_instruction="je bent een expert in image recognition",
-                candidate_count=1,
-                temperature=0
-            )
+            config=LOCATION_ORIENTATION_CONFIG
         )
 
         result = ""
@@ -233,3 +245,116 @@ class LlmClient:
                 result = result + part.text
 
         return result
+
+
+    def analyze_room(self, room_image, asset_name) -> RoomAnalysis:
+        """Estimates the dimensions of the assets and the placement of an asset in one request.
+
+        This combines get_asset_dimensions and get_asset_location_orientation: the model returns JSON following
+        prompts.ROOM_ANALYSIS_SCHEMA, which is parsed into typed records.
+
+        Args:
+            room_image (Image): A PIL Image object of the room containing the asset.
+            asset_name (str): The name of the asset for which to determine location, orientation and bounding box.
+
+        Returns:
+            RoomAnalysis: the dimensions of all assets and the location, orientation and bounding box of [asset_name].
+        """
+        response = self._generate_content(
+            "analysis",
+            model=self.config.llm_model_name_dimensions,
+            contents=[room_analysis_prompt(asset_name), room_image],
+            config=ROOM_ANALYSIS_CONFIG
+        )
+
+        return RoomAnalysis.from_json(response.text)
+
+
+    def _image_candidates(self, stage, contents, config, candidate_count, temperature, seed) -> list:
+        """Sends an image processing request for [candidate_count] candidates and returns their images."""
+        config = config.model_copy(update={
+            "candidate_count": candidate_count,
+            "temperature": temperature if temperature is not None else self.config.pipeline_candidate_temperature,
+            "seed": seed,
+        })
+        response = self._generate_content(
+            stage,
+            model=self.config.llm_model_name_image_processing,
+            contents=contents,
+            config=config,
+            fallback_model=self.config.llm_model_name_image_processing_fallback
+        )
+        return response_images(response)
+
+
+    def _generate_content(self, stage, model, contents, config, fallback_model=None):
+        """Sends the request to the model, retrying temporary errors and falling back to [fallback_model] if given.
+
+        The images in [contents] are downsized and re-encoded for the model first, unless the response is replayed by
+        the transport. When the metrics are enabled, the request is reported as an "llm" event named [stage].
+        With a hedger, a slow request of a hedged stage is sent a second time (see hedging).
+        """
+        if self.hedger is None or stage not in self.hedger.stages:
+            return self._request(stage, model, contents, config, fallback_model)
+        return self.hedger.call(stage, model, fallback_model, lambda current_model, current_fallback, cancelled: self._request(
+            stage, current_model, contents, config, current_fallback, cancelled))
+
+
+    def _request(self, stage, model, contents, config, fallback_model=None, cancelled=None):
+        """Sends one request, see _generate_content. Raises HedgeCancelledError instead of sending it once [cancelled] is set."""
+        attempts = [] if self.metrics.enabled else None
+
+        def send(current_model):
+            if cancelled is not None and cancelled.is_set():
+                raise HedgeCancelledError(f"The other request of the hedged {stage} request to {current_model} returned first")
+            prepared = self.image_preparer.prepare_contents(current_model, contents)
+            if attempts is not None:
+                attempts.append((current_model, request_bytes(prepared)))
+            try:
+                return self._send(current_model, contents, prepared, config, cancelled)
+            except errors.ClientError as error:
+                if not self.image_preparer.forget_missing_files(error, prepared):
+                    raise
+            # an uploaded image expired or was deleted by the server, upload it again and send the request once more
+            print(f"An uploaded image of the {stage} request was not found, uploading it again")
+            prepared = self.image_preparer.prepare_contents(current_model, contents)
+            if attempts is not None:
+                attempts.append((current_model, request_bytes(prepared)))
+            return self._send(current_model, contents, prepared, config, cancelled)
+
+        def request(current_model):
+            return self.transport.generate_content(current_model, contents, config, lambda: send(current_model))
+
+        if attempts is None:
+            return self.resilient_caller.call(model, request, fallback_model)
+
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.resilient_caller.call(model, request, fallback_model)
+            return response
+        finally:
+            self.metrics.record(request_event(stage, model, time.perf_counter() - start, attempts, response))
+
+
+    def _send(self, model, contents, prepared, config, cancelled=None):
+        """Sends one request as soon as the rate scheduler lets it through, then corrects the token estimate."""
+        tokens = self._input_tokens(model, contents, prepared)
+        self.rate_scheduler.acquire(model, tokens, self.lane)
+        if cancelled is not None and cancelled.is_set():
+            # the other request of the hedge returned while this one waited for the quota, give the quota back
+            self.rate_scheduler.release(model, tokens)
+            raise HedgeCancelledError(f"The other request of the hedged request to {model} returned first")
+        response = self.client.models.generate_content(model=model, contents=prepared, config=config)
+        if tokens:
+            usage = response.usage_metadata
+            self.rate_scheduler.record_usage(model, tokens, usage.prompt_token_count if usage is not None else None)
+        return response
+
+
+    def _input_tokens(self, model, contents, prepared) -> int:
+        if model not in self.rate_scheduler.limits:
+            return 0
+        if self.config.llm_rate_count_tokens:
+            return self.client.models.count_tokens(model=model, contents=prepared).total_tokens or 0
+        return estimate_tokens(contents, self.image_preparer.max_sizes.get(model, self.image_preparer.default_max_size))
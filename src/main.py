@@ -1,9 +1,40 @@
-from src.config import Configuration, RESOURCE_FOLDER
+"""
+Renders a directory tree or a manifest of room/asset jobs, see job_runner. An interrupted run is resumed by running the
+same command again.
+
+Usage: python -m src.main <directory or manifest.json> [--workers 4] [--processes] [--asset-name sofa] [--resources test-sofa]
+"""
+import argparse
+import functools
+
+from src.config import Configuration
 from src.image_processor import ImageProcessor
-from src.llm_client import LlmClient
+from src.job_runner import create_processor, format_summary, load_jobs, run_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("jobs", help="directory tree with a room.* and asset.* image per job, or a JSON manifest of jobs")
+    parser.add_argument("--workers", type=int, default=4, help="number of jobs that are rendered at the same time")
+    parser.add_argument("--processes", action="store_true", help="render in worker processes instead of threads")
+    parser.add_argument("--asset-name", default="sofa", help="the type of asset that is replaced in the rooms of a directory tree")
+    parser.add_argument("--resources", default="test-sofa", help="resources folder of the Configuration, the output is written to its output path")
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.jobs, args.asset_name)
+    if args.processes:
+        # every process makes its own client, with its share of the rate limits
+        processor_factory = functools.partial(create_processor, args.resources, args.workers)
+        output_path = Configuration(args.resources).output_path
+    else:
+        # the worker threads share the client, and so its uploaded files and rate limits
+        processor = create_processor(args.resources)
+        processor_factory = functools.partial(ImageProcessor, processor.config, processor.llm_client, processor.metrics, processor.room_index)
+        output_path = processor.config.output_path
+
+    summary = run_jobs(jobs, output_path, processor_factory, args.workers, args.processes)
+    print(format_summary(summary))
+
 
 if __name__ == "__main__":
-    config = Configuration(RESOURCE_FOLDER + "\\test-1")
-    client = LlmClient(config)
-    processor = ImageProcessor(config, client)
-    image_with_new_asset = processor.insert_asset_into_room("asset.png", "room.jpg", "")
+    main()
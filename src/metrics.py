@@ -0,0 +1,188 @@
+import bisect
+import json
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+from src.config import Configuration
+
+# upper bounds (in seconds) of the latency buckets of HistogramSink, the last bucket catches everything above
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+@dataclass
+class MetricEvent:
+    """One measurement: an LLM request, a pipeline stage, an upload or a cache lookup.
+
+    [kind] is one of "llm", "stage", "upload" or "cache", [name] the stage (e.g. "analysis", "combine").
+    [outcome] is "ok", "error" or "fallback" for requests and stages, "uploaded"/"reused" or "hit"/"miss" otherwise.
+    """
+    kind: str
+    name: str
+    seconds: float = 0.0
+    model: str = None
+    outcome: str = "ok"
+    prompt_tokens: int = 0
+    candidate_tokens: int = 0
+    image_tokens: int = 0
+    bytes_up: int = 0
+    bytes_down: int = 0
+    retries: int = 0
+    timestamp: float = field(default_factory=time.time)
+
+
+class HistogramSink:
+    """Keeps counts, totals and a latency histogram in memory, per kind, name and model."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, event: MetricEvent):
+        key = (event.kind, event.name, event.model)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "count": 0, "seconds": 0.0, "outcomes": Counter(), "histogram": [0] * (len(self.buckets) + 1),
+                    "prompt_tokens": 0, "candidate_tokens": 0, "image_tokens": 0, "bytes_up": 0, "bytes_down": 0, "retries": 0,
+                }
+            series["count"] += 1
+            series["seconds"] += event.seconds
+            series["outcomes"][event.outcome] += 1
+            series["histogram"][bisect.bisect_left(self.buckets, event.seconds)] += 1
+            for name in ("prompt_tokens", "candidate_tokens", "image_tokens", "bytes_up", "bytes_down", "retries"):
+                series[name] += getattr(event, name)
+
+
+    def summary(self) -> list:
+        """Returns one dict per kind, name and model with the totals and the estimated p50/p95/p99 latency."""
+        with self._lock:
+            result = []
+            for (kind, name, model), series in sorted(self._series.items(), key=lambda item: tuple(str(part) for part in item[0])):
+                entry = {"kind": kind, "name": name, "model": model}
+                entry.update({key: value for key, value in series.items() if key != "histogram"})
+                entry["outcomes"] = dict(series["outcomes"])
+                entry["mean_seconds"] = series["seconds"] / series["count"]
+                for p in (50, 95, 99):
+                    entry[f"p{p}"] = self._percentile(series["histogram"], series["count"], p)
+                result.append(entry)
+            return result
+
+
+    def _percentile(self, histogram, count, p):
+        """Returns the upper bound of the bucket with the [p]th percentile, None when it is in the overflow bucket."""
+        rank = count * p / 100
+        seen = 0
+        for index, bucket_count in enumerate(histogram):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else None
+        return None
+
+
+class JsonLinesSink:
+    """Appends every event as one line of JSON to [path], for analysis afterwards."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+
+    def record(self, event: MetricEvent):
+        line = json.dumps(asdict(event))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Metrics:
+    """Sends the metric events of the LLM clients and the pipeline to the sinks.
+
+    Without sinks the metrics are disabled: [enabled] is False and record does nothing. Callers check [enabled] before
+    measuring (like counting bytes), so disabled metrics cost one attribute lookup per request.
+    """
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "Metrics":
+        """Returns metrics with a JsonLinesSink when [Configuration.metrics_jsonl_path] is set, disabled metrics otherwise."""
+        if config.metrics_jsonl_path:
+            return cls([JsonLinesSink(config.metrics_jsonl_path)])
+        return DISABLED
+
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+
+    def record(self, event: MetricEvent):
+        for sink in self.sinks:
+            sink.record(event)
+
+
+DISABLED = Metrics()
+
+
+def request_bytes(contents) -> int:
+    """Returns the number of bytes of text and inline images sent in [contents], files uploaded before are not counted."""
+    total = 0
+    for content in contents:
+        if isinstance(content, str):
+            total += len(content.encode("utf-8"))
+        elif getattr(content, "inline_data", None) is not None and content.inline_data.data is not None:
+            total += len(content.inline_data.data)
+        elif getattr(content, "text", None) is not None:
+            total += len(content.text.encode("utf-8"))
+    return total
+
+
+def response_bytes(response) -> int:
+    """Returns the number of bytes of text and images in the first candidate of [response]."""
+    candidates = getattr(response, "candidates", None)
+    if not candidates or candidates[0].content is None:
+        return 0
+    return request_bytes(candidates[0].content.parts or [])
+
+
+def usage_event(kind: str, name: str, model: str, seconds: float, response) -> MetricEvent:
+    """Returns an event with the token counts of the usage_metadata of [response]."""
+    event = MetricEvent(kind, name, seconds=seconds, model=model)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        event.prompt_tokens = usage.prompt_token_count or 0
+        event.candidate_tokens = usage.candidates_token_count or 0
+        for details in (usage.prompt_tokens_details or [], usage.candidates_tokens_details or []):
+            event.image_tokens += sum(detail.token_count or 0 for detail in details if getattr(detail.modality, "name", detail.modality) == "IMAGE")
+    return event
+
+
+def request_event(name: str, model: str, seconds: float, attempts: list, response=None) -> MetricEvent:
+    """Returns the "llm" event of a request that was sent [attempts] times, a list of (model, bytes sent) tuples.
+
+    Without [response] the request failed. When the last attempt went to another model than [model], the outcome is
+    "fallback".
+    """
+    used_model = attempts[-1][0] if attempts else model
+    if response is None:
+        event = MetricEvent("llm", name, seconds=seconds, model=used_model, outcome="error")
+    else:
+        event = usage_event("llm", name, used_model, seconds, response)
+        event.outcome = "ok" if used_model == model else "fallback"
+        event.bytes_down = response_bytes(response)
+    event.retries = max(0, len(attempts) - 1)
+    event.bytes_up = sum(sent for _, sent in attempts)
+    return event
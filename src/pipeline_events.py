@@ -0,0 +1,32 @@
+"""
+Events yielded by the streaming pipeline (ImageProcessor.stream_insert_asset_into_room), one per finished stage.
+"""
+from dataclasses import dataclass
+
+from PIL import Image
+
+from src.room_analysis import RoomAnalysis
+
+
+@dataclass
+class PipelineEvent:
+    """Base class of the events, [elapsed] is the number of seconds since the start of the render."""
+    elapsed: float
+
+
+@dataclass
+class AnalysisReady(PipelineEvent):
+    """The dimensions of the assets and the placement of the asset are known."""
+    analysis: RoomAnalysis
+
+
+@dataclass
+class CleanedRoomReady(PipelineEvent):
+    """The asset is removed from the room, the image can be shown while the new asset is placed."""
+    image: Image.Image
+
+
+@dataclass
+class CompositeReady(PipelineEvent):
+    """The final image: the room with the new asset."""
+    image: Image.Image
@@ -0,0 +1,170 @@
+"""
+Progressive rendering: a quick preview from the fast image model is shown first and replaced by the render of the pro
+model when that is done.
+"""
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+PREVIEW = "preview"
+FINAL = "final"
+
+
+class ProgressiveRender:
+    """Handle of a render that has a preview image first and the final image later.
+
+    Both tiers start at the same time and share the analysis of the room, the removal and combine stages run per tier.
+    Every stage is submitted to the executor as soon as its inputs are ready, so no worker thread waits for another
+    stage. cancel() stops the stages that didn't start yet: when the customer abandons the preview, the pro model
+    requests that weren't sent yet are never sent. A request that is already in flight can't be interrupted, its result
+    is discarded.
+
+    The time from the start until the preview and the final image are ready is kept in [seconds] and reported as
+    "time_to_preview" and "time_to_final".
+    """
+
+    def __init__(self, executor, record=None):
+        """
+        Args:
+            executor (Executor): runs the stages.
+            record: called with (name, seconds, outcome) when a tier is ready, failed or was cancelled.
+        """
+        self.started_at = time.perf_counter()
+        self.seconds = {}       # tier -> seconds from the start until the tier was ready
+        self.timings = {}       # stage -> seconds the stage took
+        self._executor = executor
+        self._record = record
+        self._results = {PREVIEW: Future(), FINAL: Future()}
+        self._stages = []
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+
+    def start(self, analyze, tiers: dict) -> "ProgressiveRender":
+        """Starts the stages of all tiers.
+
+        Args:
+            analyze: returns the analysis of the room, shared by all tiers.
+            tiers (dict): (remove, combine) per tier. remove() returns the room without the asset and
+                combine(analysis, room without asset) the image of the tier.
+        """
+        analysis = self._submit(analyze)
+        for tier, (remove, combine) in tiers.items():
+            self._when_done(tier, [analysis, self._submit(remove)], combine)
+        return self
+
+
+    def preview(self, timeout: float = None):
+        """Waits for the preview image and returns it.
+
+        Raises:
+            CancelledError: If the render was cancelled before the preview was ready.
+            TimeoutError: If the preview isn't ready within [timeout] seconds.
+        """
+        return self._results[PREVIEW].result(timeout)
+
+
+    def result(self, timeout: float = None):
+        """Waits for the final image and returns it.
+
+        Raises:
+            CancelledError: If the render was cancelled before the final image was ready.
+            TimeoutError: If the final image isn't ready within [timeout] seconds.
+        """
+        return self._results[FINAL].result(timeout)
+
+
+    def current(self):
+        """Returns the best image that is ready without waiting: the final image, else the preview, else None."""
+        for tier in (FINAL, PREVIEW):
+            future = self._results[tier]
+            if future.done() and not future.cancelled() and future.exception() is None:
+                return future.result()
+        return None
+
+
+    def done(self) -> bool:
+        """Returns True when the final image is ready, failed or was cancelled."""
+        return self._results[FINAL].done()
+
+
+    def cancelled(self) -> bool:
+        return self._results[FINAL].cancelled()
+
+
+    def cancel(self) -> bool:
+        """Stops the render, the stages that didn't start yet are never run.
+
+        Returns:
+            bool: False when the final image was already done, so there was nothing left to cancel.
+        """
+        with self._lock:
+            self._cancelled = True
+            stages = list(self._stages)
+        for stage in stages:
+            stage.cancel()
+        for tier in self._results:
+            self._resolve(tier, error=CancelledError())
+        return self._results[FINAL].cancelled()
+
+
+    def _submit(self, stage, *args) -> Future:
+        with self._lock:
+            if self._cancelled:
+                future = Future()
+                future.cancel()
+                return future
+            future = self._executor.submit(stage, *args)
+            self._stages.append(future)
+            return future
+
+
+    def _when_done(self, tier, inputs, stage):
+        """Submits stage(*results of inputs) when all inputs are done and resolves [tier] with its result.
+
+        When one of the inputs failed or was cancelled, [tier] fails the same way and [stage] is never run.
+        """
+        remaining = [len(inputs)]
+
+        def input_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            failed = next((future for future in inputs if future.cancelled() or future.exception() is not None), None)
+            if failed is not None:
+                self._resolve_from(tier, failed)
+                return
+            self._submit(stage, *[future.result() for future in inputs]).add_done_callback(lambda future: self._resolve_from(tier, future))
+
+        for future in inputs:
+            future.add_done_callback(input_done)
+
+
+    def _resolve_from(self, tier, future):
+        if future.cancelled():
+            self._resolve(tier, error=CancelledError())
+        elif future.exception() is not None:
+            self._resolve(tier, error=future.exception())
+        else:
+            self._resolve(tier, result=future.result())
+
+
+    def _resolve(self, tier, result=None, error=None):
+        with self._lock:
+            if tier in self.seconds:
+                return
+            self.seconds[tier] = time.perf_counter() - self.started_at
+        outcome = "cancelled" if isinstance(error, CancelledError) else "error" if error is not None else "ok"
+        print(f"Progressive render: {tier} {outcome} after {self.seconds[tier]:.2f}s")
+        if self._record is not None:
+            self._record(f"time_to_{tier}", self.seconds[tier], outcome)
+
+        # the tier is resolved after it was reported, so a caller waiting for it sees the metrics
+        future = self._results[tier]
+        if outcome == "cancelled":
+            future.cancel()
+        elif outcome == "error":
+            future.set_exception(error)
+        else:
+            future.set_result(result)
@@ -0,0 +1,190 @@
+"""
+Prompts and generation configs for the LLM requests, shared by the sync and async LLM clients.
+"""
+from google.genai import types
+
+
+REMOVE_ASSET_CONFIG = types.GenerateContentConfig(
+    system_instruction="you are an expert in image composition, creating clean, sharp, highres image with soft ambient lighting without changing the original image too much",
+    candidate_count=1,
+    temperature=0
+)
+
+COMBINE_IMAGES_CONFIG = types.GenerateContentConfig(
+    system_instruction="je bent een expert in image composition",
+    candidate_count=1,
+    temperature=0
+)
+
+# config=types.GenerateContentConfig(
+#     system_instruction="you are an expert in image recognition and you are the best in estimating the size of assets in a picture based on your experience",
+# )
+ASSET_DIMENSIONS_CONFIG = None
+
+LOCATION_ORIENTATION_CONFIG = types.GenerateContentConfig(
+    system_instruction="je bent een expert in image recognition",
+    candidate_count=1,
+    temperature=0
+)
+
+
+def remove_asset_prompt(asset_name: str) -> str:
+    return f"""
+        The goal is to remove the {asset_name} from the room image.
+        
+        Step 1: Identify the {asset_name}
+            Identify the {asset_name} in the image and understand its surroundings. 
+        
+        Step 2: Remove the {asset_name}
+            Remove the {asset_name} from the room. If there are any assets are attached to the {asset_name} also remove those.
+            
+        Step 3: Fill the gap
+             Fill the gap that is left after you removed the {asset_name} in a way that the image looks natural and realistic, as if the {asset_name} was never there.
+             Use the surroundings of the {asset_name} to fill the gap, so the style, lighting and texture of the original image is maintained as much as possible.
+
+        Step 4: Verify
+            Verify that the {asset_name} is completely removed and the image looks natural and realistic, as if the {asset_name} was never there. 
+            Make sure you didn't change anything else in the image except removing the {asset_name} and filling the gap that is left after you removed the {asset_name}.
+        
+        Rules:
+            - Make no changes to the other assets in the room
+        """
+
+
+def combine_images_prompt(room_dimensions: str, asset_dimensions: str, location_orientation_asset: str, asset_name: str = "sofa") -> str:
+    return f"""
+        Place the {asset_name} (=image 2) in the room (=image 1).
+
+        Location and orientation of the {asset_name}:
+            {location_orientation_asset}
+        Dimensions of the assets in the room, to determine the scale:
+            {room_dimensions}
+        Dimensions of the {asset_name}:
+            {asset_dimensions}
+
+        Add realistic shadows and highlights that match the light in the room.
+
+        Rules:
+            - You are allowed to scale the {asset_name}
+            - MAKE NO OTHER CHANGES TO THE {asset_name.upper()}
+            - Make no changes to the other assets in the room
+        """
+
+
+ASSET_DIMENSIONS_PROMPT = """
+        Estimate the size of ALL the assets you see in the image.
+        Most important size is the area that each asset takes up so this can be used in a later request to LLM to replace an asset in the image.
+        reply depth, width and height in cms and area in cm2 and use this format:
+        
+        [asset-name-1]: area=[area], depth=[depth], width=[width], height=[height]
+        [asset-name-2]: area=[area], depth=[depth], width=[width], height=[height]
+        ...
+        
+        don't use any leading sentence, just deliver the dimensions in the format described.
+        """
+
+
+def location_orientation_prompt(asset_name: str) -> str:
+    return f"""
+        Describe the location and the orientation of the {asset_name} in the room.  
+        Use this format:
+            location: [location]
+            orientation: [orientation]
+
+        Rules:
+            - location: Don't describe the form or design of the {asset_name}, just the place where the main part of the {asset_name} is located in relation to other assets. 
+            - orientation: Don't describe the form or design of the {asset_name}, just where the sofa is oriented to, in relation to the viewer.
+            - don't use any leading sentence, deliver the information in the format described.
+        """
+
+
+ROOM_ANALYSIS_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "assets": types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "name": types.Schema(type=types.Type.STRING),
+                    "area": types.Schema(type=types.Type.NUMBER, description="area in cm2"),
+                    "depth": types.Schema(type=types.Type.NUMBER, description="depth in cm"),
+                    "width": types.Schema(type=types.Type.NUMBER, description="width in cm"),
+                    "height": types.Schema(type=types.Type.NUMBER, description="height in cm"),
+                },
+                required=["name", "area", "depth", "width", "height"],
+            ),
+        ),
+        "target": types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "location": types.Schema(type=types.Type.STRING),
+                "orientation": types.Schema(type=types.Type.STRING),
+                "bounding_box": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.INTEGER),
+                    description="[ymin, xmin, ymax, xmax] normalized to 0-1000",
+                ),
+            },
+            required=["location", "orientation", "bounding_box"],
+        ),
+    },
+    required=["assets", "target"],
+)
+
+ROOM_ANALYSIS_CONFIG = types.GenerateContentConfig(
+    system_instruction="you are an expert in image recognition and you are the best in estimating the size of assets in a picture based on your experience",
+    candidate_count=1,
+    temperature=0,
+    response_mime_type="application/json",
+    response_schema=ROOM_ANALYSIS_SCHEMA
+)
+
+
+def room_analysis_prompt(asset_name: str) -> str:
+    return f"""
+        Analyse the room image.
+
+        assets: Estimate the size of ALL the assets you see in the image, including the {asset_name}.
+            Give depth, width and height in cm and the area the asset takes up in cm2.
+
+        target: Describe the {asset_name}.
+            - location: Don't describe the form or design of the {asset_name}, just the place where the main part of the {asset_name} is located in relation to other assets.
+            - orientation: Don't describe the form or design of the {asset_name}, just where the {asset_name} is oriented to, in relation to the viewer.
+            - bounding_box: the box around the {asset_name} as [ymin, xmin, ymax, xmax], normalized to 0-1000.
+        """
+
+
+CHAT_SESSION_CONFIG = types.GenerateContentConfig(
+    system_instruction="you are an expert in image composition, creating clean, sharp, highres image with soft ambient lighting without changing the original image too much",
+    candidate_count=1,
+    temperature=0
+)
+
+
+def chat_combine_prompt(room_dimensions: str, asset_dimensions: str, location_orientation_asset: str, asset_name: str = "sofa") -> str:
+    return f"""
+        Now place the {asset_name} (=this image) in the room you just generated, where the original {asset_name} was.
+
+        Location and orientation of the original {asset_name}:
+            {location_orientation_asset}
+
+        Dimensions of the assets in the room:
+            {room_dimensions}
+
+        Dimensions of the new {asset_name}:
+            {asset_dimensions}
+
+        Rules:
+            - Scale the {asset_name} using the dimensions above
+            - MAKE NO OTHER CHANGES TO THE {asset_name.upper()}
+            - Make no changes to the other assets in the room
+            - Add realistic shadows and highlights, consistent with the light in the scene
+        """
+
+
+def chat_tweak_prompt(instruction: str) -> str:
+    return f"""
+        Change the last image you generated: {instruction}
+        Make no other changes to the sofa or the room.
+        """
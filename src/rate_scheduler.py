@@ -0,0 +1,239 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+from PIL import Image
+
+from src.config import Configuration
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# Gemini counts 258 tokens for an image up to 384x384, larger images are cut into tiles of 768x768 of 258 tokens each
+_IMAGE_TILE_TOKENS = 258
+_IMAGE_TILE_SIZE = 768
+_SMALL_IMAGE_SIZE = 384
+
+
+def estimate_tokens(contents: list, max_image_size: int = None) -> int:
+    """Estimates the input tokens of [contents] (text and PIL images) without calling countTokens.
+
+    Args:
+        contents (list): the prompt texts and images of the request.
+        max_image_size (int): the size the images are downsized to before uploading, see ImagePreparer.
+    """
+    tokens = 0
+    for content in contents:
+        if isinstance(content, str):
+            tokens += math.ceil(len(content) / 4)
+        elif isinstance(content, Image.Image):
+            width, height = content.size
+            if max_image_size and max(width, height) > max_image_size:
+                scale = max_image_size / max(width, height)
+                width, height = width * scale, height * scale
+            if width <= _SMALL_IMAGE_SIZE and height <= _SMALL_IMAGE_SIZE:
+                tokens += _IMAGE_TILE_TOKENS
+            else:
+                tokens += _IMAGE_TILE_TOKENS * math.ceil(width / _IMAGE_TILE_SIZE) * math.ceil(height / _IMAGE_TILE_SIZE)
+    return tokens
+
+
+class TokenBucket:
+    """A bucket of [capacity] tokens that refills at [capacity] per minute.
+
+    The level can go below zero when more was used than reserved, the next requests then wait until it is paid back.
+    """
+
+    def __init__(self, capacity: float, clock=time.monotonic):
+        self.capacity = capacity
+        self.clock = clock
+        self.level = capacity
+        self.updated_at = clock()
+
+
+    def wait_seconds(self, amount: float) -> float:
+        """Returns how long to wait until [amount] tokens are available, 0 when they are available now."""
+        self._refill()
+        # a request larger than the bucket can never fit, let it through when the bucket is full
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed * 60 / self.capacity)
+
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+    def give_back(self, amount: float):
+        """Returns [amount] tokens that were taken for a request that wasn't sent, up to the capacity."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+
+class RateScheduler:
+    """Keeps the requests per model just under the requests per minute (RPM) and input tokens per minute (TPM) quota.
+
+    Every request waits in the interactive or the bulk lane of its model. Only the first request of the interactive
+    lane may be dispatched, or the first of the bulk lane when no interactive request is waiting, so bulk catalogue
+    jobs never delay customer-facing renders. A request is dispatched when the RPM and TPM buckets of the model have
+    room for it. The tokens are estimated before the request and corrected with the actual usage afterwards.
+
+    Models without limits in [limits] are not scheduled.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+    max_wait_seconds = 1.0      # a waiting request checks the buckets at least this often
+
+    def __init__(self, limits: dict, headroom: float = 0.9, clock=time.monotonic):
+        """
+        Args:
+            limits (dict): {"rpm": ..., "tpm": ...} per model name, a missing or None limit is not enforced.
+            headroom (float): the fraction of the quota to use, to stay just under it.
+            clock: the monotonic clock, can be replaced in tests.
+        """
+        self.limits = limits
+        self.headroom = headroom
+        self.clock = clock
+        self.buckets = {}
+        self.counters = {lane: {"dispatched": 0, "waited_seconds": 0.0} for lane in LANES}
+        self._queues = {}
+        self._condition = threading.Condition()
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "RateScheduler":
+        return cls(config.llm_rate_limits, config.llm_rate_headroom)
+
+
+    @classmethod
+    def shared(cls, config: Configuration) -> "RateScheduler":
+        """Returns the scheduler shared by all LLM clients in the process, so they share the quota of every model."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls.from_config(config)
+            return cls._shared
+
+
+    def acquire(self, model: str, tokens: int, lane: str = INTERACTIVE):
+        """Blocks until a request of [tokens] input tokens to [model] can be sent within the quota."""
+        if model not in self.limits:
+            return
+        ticket = object()
+        start = self.clock()
+        with self._condition:
+            queue = self._queue(model, lane)
+            queue.append(ticket)
+            try:
+                while True:
+                    delay = self._try_dispatch(model, lane, ticket, tokens)
+                    if delay == 0:
+                        break
+                    # woken up early when a request ahead of this one is dispatched
+                    self._condition.wait(timeout=min(delay, self.max_wait_seconds) if delay is not None else self.max_wait_seconds)
+            finally:
+                queue.remove(ticket)
+                self._condition.notify_all()
+        self._count(lane, start)
+
+
+    async def acquire_async(self, model: str, tokens: int, lane: str = INTERACTIVE, poll_seconds: float = 0.05):
+        """Async variant of acquire, waits with asyncio.sleep instead of blocking the event loop.
+
+        A request that waits behind other requests checks again every [poll_seconds].
+        """
+        if model not in self.limits:
+            return
+        ticket = object()
+        start = self.clock()
+        with self._condition:
+            queue = self._queue(model, lane)
+            queue.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_dispatch(model, lane, ticket, tokens)
+                if delay == 0:
+                    break
+                await asyncio.sleep(min(delay, self.max_wait_seconds) if delay is not None else poll_seconds)
+        finally:
+            with self._condition:
+                queue.remove(ticket)
+                self._condition.notify_all()
+        self._count(lane, start)
+
+
+    def record_usage(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """Corrects the TPM bucket of [model] with the actual number of input tokens of a request."""
+        if model not in self.limits or actual_tokens is None:
+            return
+        with self._condition:
+            buckets = self._buckets(model)
+            if buckets[1] is not None:
+                buckets[1].take(actual_tokens - estimated_tokens)
+
+
+    def release(self, model: str, tokens: int):
+        """Gives back the request and the [tokens] taken by acquire for a request to [model] that wasn't sent after all."""
+        if model not in self.limits:
+            return
+        with self._condition:
+            rpm, tpm = self._buckets(model)
+            if rpm is not None:
+                rpm.give_back(1)
+            if tpm is not None:
+                tpm.give_back(tokens)
+            self._condition.notify_all()
+
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "lanes": {lane: dict(counters) for lane, counters in self.counters.items()},
+                "waiting": {model: {lane: len(queue) for lane, queue in lanes.items()} for model, lanes in self._queues.items()},
+            }
+
+
+    def _queue(self, model, lane) -> deque:
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane}, use one of {LANES}")
+        return self._queues.setdefault(model, {lane_name: deque() for lane_name in LANES})[lane]
+
+
+    def _try_dispatch(self, model, lane, ticket, tokens):
+        """Takes the tokens and returns 0 when the request can go, otherwise the seconds to wait (None: until notified)."""
+        queues = self._queues[model]
+        if queues[lane][0] is not ticket or (lane == BULK and queues[INTERACTIVE]):
+            return None
+        rpm, tpm = self._buckets(model)
+        delay = max(rpm.wait_seconds(1) if rpm is not None else 0, tpm.wait_seconds(tokens) if tpm is not None else 0)
+        if delay == 0:
+            if rpm is not None:
+                rpm.take(1)
+            if tpm is not None:
+                tpm.take(tokens)
+        return delay
+
+
+    def _buckets(self, model):
+        if model not in self.buckets:
+            limits = self.limits[model] or {}
+            self.buckets[model] = tuple(
+                TokenBucket(limits[name] * self.headroom, self.clock) if limits.get(name) else None for name in ("rpm", "tpm")
+            )
+        return self.buckets[model]
+
+
+    def _count(self, lane, start):
+        with self._condition:
+            self.counters[lane]["dispatched"] += 1
+            self.counters[lane]["waited_seconds"] += self.clock() - start
@@ -0,0 +1,87 @@
+"""
+Region of interest compositing: only the region around the asset is sent to the image model.
+
+The bounding box of the asset (from RoomAnalysis, normalized to 0-1000) is padded and converted to a pixel box, the
+room is cropped to that box and the generated crop is blended back into the full resolution room with a feathered
+mask. Everything outside the box stays pixel-identical to the original room.
+"""
+import numpy as np
+from PIL import Image
+
+
+def region_box(bounding_box: list, image_size: tuple, padding: float, min_size: int = 0):
+    """Returns the padded pixel box (left, upper, right, lower) around [bounding_box], or None when it isn't usable.
+
+    Args:
+        bounding_box (list): [ymin, xmin, ymax, xmax] normalized to 0-1000.
+        image_size (tuple): (width, height) of the image in pixels.
+        padding (float): padding on every side, as a fraction of the width and height of the box.
+        min_size (int): minimum width and height of the box in pixels, as far as the image allows.
+    """
+    if not bounding_box or len(bounding_box) != 4:
+        return None
+    ymin, xmin, ymax, xmax = (min(max(float(value), 0.0), 1000.0) for value in bounding_box)
+    if ymax <= ymin or xmax <= xmin:
+        return None
+
+    width, height = image_size
+    left, right = _padded_span(xmin / 1000 * width, xmax / 1000 * width, padding, min_size, width)
+    upper, lower = _padded_span(ymin / 1000 * height, ymax / 1000 * height, padding, min_size, height)
+    return left, upper, right, lower
+
+
+def _padded_span(start, end, padding, min_size, limit):
+    """Pads [start, end) on both sides and grows it to [min_size] around its center, clamped to [0, limit)."""
+    margin = (end - start) * padding
+    start, end = start - margin, end + margin
+    if end - start < min_size:
+        center = (start + end) / 2
+        start, end = center - min_size / 2, center + min_size / 2
+    # shift the span back into the image before clamping, so it keeps its size when possible
+    if start < 0:
+        start, end = 0, end - start
+    if end > limit:
+        start, end = start - (end - limit), limit
+    return int(max(0, np.floor(start))), int(min(limit, np.ceil(end)))
+
+
+def feather_mask(width: int, height: int, feather: int, soft_edges=(True, True, True, True)) -> np.ndarray:
+    """Returns a (height, width) float32 mask that is 1 inside and falls off to 0 over [feather] pixels at the edges.
+
+    Args:
+        width (int): width of the mask.
+        height (int): height of the mask.
+        feather (int): width of the soft edge in pixels, 0 for a hard edge.
+        soft_edges (tuple): (left, upper, right, lower), the edges that fall off. Edges on the border of the image
+            should stay hard, there is no original image to blend with on the other side.
+    """
+    if feather <= 0:
+        return np.ones((height, width), dtype=np.float32)
+    left, upper, right, lower = soft_edges
+    x = np.arange(width, dtype=np.float32) + 0.5
+    y = np.arange(height, dtype=np.float32) + 0.5
+    ramp_x = np.minimum(x / feather if left else np.inf, (width - x) / feather if right else np.inf)
+    ramp_y = np.minimum(y / feather if upper else np.inf, (height - y) / feather if lower else np.inf)
+    return np.clip(np.minimum.outer(ramp_y, ramp_x), 0.0, 1.0).astype(np.float32)
+
+
+def paste_region(room: Image.Image, generated: Image.Image, box: tuple, feather: int) -> Image.Image:
+    """Blends the [generated] crop into [box] of [room] and returns the result as a new RGB image.
+
+    The generated crop is resized to the box when the model returned another size. Outside the box the result is
+    identical to [room].
+    """
+    left, upper, right, lower = box
+    width, height = right - left, lower - upper
+    result = room.convert("RGB") if room.mode != "RGB" else room.copy()
+    if generated.size != (width, height):
+        generated = generated.resize((width, height), Image.LANCZOS)
+
+    original = np.asarray(result.crop(box), dtype=np.float32)
+    new = np.asarray(generated.convert("RGB"), dtype=np.float32)
+    soft_edges = (left > 0, upper > 0, right < room.width, lower < room.height)
+    mask = feather_mask(width, height, feather, soft_edges)[..., np.newaxis]
+
+    blended = original + (new - original) * mask
+    result.paste(Image.fromarray(np.rint(blended).astype(np.uint8)), (left, upper))
+    return result
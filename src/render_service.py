@@ -0,0 +1,270 @@
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+from src.config import Configuration
+from src.exceptions import InvalidFileNameError, QueueFullError
+from src.image_processor import ImageProcessor
+
+
+@dataclass
+class RenderRequest:
+    """A request to render an asset from the asset catalogue in a room from the room catalogue."""
+    room_file_name: str
+    asset_file_name: str
+    asset_dimensions: str
+    asset_name: str = "sofa"
+
+
+@dataclass
+class ServiceJob:
+    job_id: str
+    request: RenderRequest
+    key: str
+    state: str = "queued"       # queued, running, succeeded or failed
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    error: str = None
+    image: Image.Image = None
+    duplicates: int = 0         # number of identical submissions that were collapsed into this job
+    stage_timings: dict = field(default_factory=dict)     # stage name -> seconds, of this render only
+
+
+    def status(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "duplicates": self.duplicates,
+            "stage_timings": dict(self.stage_timings),
+        }
+
+
+class RenderService:
+    """Runs renders on a pool of worker threads, fed by a bounded job queue.
+
+    Identical submissions (same room image, asset image, dimensions and asset name) that arrive while the first one is
+    queued or running are collapsed into that job. When the queue is full, a submission waits for
+    [Configuration.service_queue_timeout_seconds] and is then rejected with a QueueFullError.
+
+    The workers share the processor, its stage thread pool is grown so every worker can run its stages at the same time.
+    """
+
+    # the images are read in chunks of this size to compute the render key
+    HASH_CHUNK_BYTES = 1024 * 1024
+
+    def __init__(self, config: Configuration, processor: ImageProcessor):
+        self.config = config
+        self.processor = processor
+        processor.reserve_workers(config.service_workers * config.pipeline_max_workers)
+        self._queue = queue.Queue(maxsize=config.service_max_queue)
+        self._jobs = OrderedDict()       # job id -> ServiceJob, oldest first
+        self._in_flight = {}             # render key -> job id of the queued or running job
+        self._lock = threading.Lock()
+        self._workers = []
+        self._stopping = threading.Event()
+
+
+    def start(self):
+        for index in range(self.config.service_workers):
+            worker = threading.Thread(target=self._work, name=f"render-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+
+    def stop(self, timeout: float = None):
+        """Stops the workers after their current job, queued jobs are not started anymore."""
+        self._stopping.set()
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+
+    def submit(self, request: RenderRequest) -> str:
+        """Queues the render and returns its job id, or the id of an identical job that is queued or running.
+
+        Raises:
+            InvalidFileNameError: If the room or asset file name is not a plain file name in its catalogue directory.
+            FileNotFoundError: If the room or asset image does not exist.
+            QueueFullError: If the queue stays full for longer than the queue timeout.
+        """
+        key = self._render_key(request)
+        with self._lock:
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                self._jobs[job_id].duplicates += 1
+                return job_id
+            job = ServiceJob(uuid.uuid4().hex, request, key)
+            self._jobs[job.job_id] = job
+            self._in_flight[key] = job.job_id
+
+        try:
+            if self.config.service_queue_timeout_seconds:
+                self._queue.put(job, timeout=self.config.service_queue_timeout_seconds)
+            else:
+                self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.job_id]
+                del self._in_flight[key]
+            raise QueueFullError(f"The render queue is full ({self.config.service_max_queue} jobs), try again later")
+        return job.job_id
+
+
+    def status(self, job_id: str) -> dict:
+        """Returns the state and timestamps of the job. Raises KeyError for an unknown job."""
+        with self._lock:
+            return self._jobs[job_id].status()
+
+
+    def result(self, job_id: str) -> Image:
+        """Returns the rendered image, or None when the job isn't finished. Raises KeyError for an unknown job."""
+        with self._lock:
+            job = self._jobs[job_id]
+        if job.state == "failed":
+            raise RuntimeError(f"Render {job_id} failed: {job.error}")
+        return job.image
+
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+
+    def _render_key(self, request):
+        digest = hashlib.sha256()
+        for path in (_catalogue_path(self.config.get_room_image_path, request.room_file_name),
+                     _catalogue_path(self.config.get_asset_image_path, request.asset_file_name)):
+            file_digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.HASH_CHUNK_BYTES), b""):
+                    file_digest.update(chunk)
+            digest.update(file_digest.digest())
+        digest.update(f"{request.asset_dimensions}\0{request.asset_name}".encode("utf-8"))
+        return digest.hexdigest()
+
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self._queue.get()
+            if job is None or self._stopping.is_set():
+                break
+
+            job.state = "running"
+            job.started_at = time.time()
+            try:
+                request = job.request
+                job.image = self.processor.insert_asset_into_room(request.asset_file_name, request.room_file_name, request.asset_dimensions,
+                                                                  asset_name=request.asset_name, concurrent=True, timings=job.stage_timings)
+                job.state = "succeeded"
+            except Exception as error:
+                job.error = str(error)
+                job.state = "failed"
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._in_flight.pop(job.key, None)
+                    self._forget_old_jobs()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.config.service_max_finished_jobs)]:
+            del self._jobs[job_id]
+
+
+def _catalogue_path(get_path, name: str) -> str:
+    """Returns the path of [name] in the catalogue directory of [get_path], which must not lead out of that directory.
+
+    Raises:
+        InvalidFileNameError: If [name] is not a plain file name (a path, "..", empty) or a link out of the directory.
+    """
+    if not name or name in (".", "..") or os.path.basename(name) != name or (os.path.altsep and os.path.altsep in name):
+        raise InvalidFileNameError(f"Invalid file name: {name!r}")
+    path = get_path(name)
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(os.path.dirname(path)):
+        raise InvalidFileNameError(f"Invalid file name: {name!r}")
+    return path
+
+
+def create_app(service: RenderService):
+    """Creates the FastAPI app with the submit, poll and result endpoints of the render service.
+
+    POST /renders                   queue a render, returns 202 with the job id (400 for an invalid file name, 429 when the queue is full)
+    GET  /renders/{job_id}          the state of the job
+    GET  /renders/{job_id}/result   the image as PNG (409 while the job isn't finished)
+    """
+    from fastapi import FastAPI, HTTPException, Response
+    from pydantic import BaseModel
+
+    class RenderBody(BaseModel):
+        room_file_name: str
+        asset_file_name: str
+        asset_dimensions: str
+        asset_name: str = "sofa"
+
+    app = FastAPI(title="Home Design render service")
+
+    @app.post("/renders", status_code=202)
+    def submit(body: RenderBody):
+        try:
+            return {"job_id": service.submit(RenderRequest(**body.model_dump()))}
+        except InvalidFileNameError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        except FileNotFoundError as error:
+            raise HTTPException(status_code=404, detail=str(error))
+        except QueueFullError as error:
+            raise HTTPException(status_code=429, detail=str(error), headers={"Retry-After": "10"})
+
+    @app.get("/renders/{job_id}")
+    def status(job_id: str):
+        try:
+            return service.status(job_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown render {job_id}")
+
+    @app.get("/renders/{job_id}/result")
+    def result(job_id: str):
+        try:
+            image = service.result(job_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown render {job_id}")
+        except RuntimeError as error:
+            raise HTTPException(status_code=500, detail=str(error))
+        if image is None:
+            raise HTTPException(status_code=409, detail=f"Render {job_id} is not finished yet")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return Response(content=buffer.getvalue(), media_type="image/png")
+
+    return app
+
+
+if __name__ == "__main__":
+    import sys
+
+    import uvicorn
+
+    from src.cache import with_cache
+    from src.llm_client import LlmClient
+    from src.room_index import RoomIndex
+
+    config = Configuration(sys.argv[1] if len(sys.argv) > 1 else "test-sofa")
+    render_service = RenderService(config, ImageProcessor(config, with_cache(LlmClient(config)), room_index=RoomIndex.from_config(config)))
+    render_service.start()
+    uvicorn.run(create_app(render_service), host="0.0.0.0", port=8000)
@@ -0,0 +1,329 @@
+import asyncio
+import random
+import threading
+import time
+
+from google.api_core import exceptions
+from google.genai import errors
+
+from src.config import Configuration
+from src.exceptions import CircuitOpenError, LlmUnavailableError
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """Returns True when the error is temporary (rate limited, overloaded, timed out) and the request can be retried."""
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    if isinstance(error, exceptions.GoogleAPICallError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def retry_after_seconds(error: Exception):
+    """Returns the delay the server asked for, from the Retry-After header or the RetryInfo detail, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None and headers.get("retry-after"):
+        try:
+            return float(headers.get("retry-after"))
+        except ValueError:
+            pass
+
+    # {'error': {'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '30s'}]}}
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []):
+            if isinstance(detail, dict) and detail.get("@type", "").endswith("RetryInfo") and "retryDelay" in detail:
+                try:
+                    return float(str(detail["retryDelay"]).rstrip("s"))
+                except ValueError:
+                    pass
+    return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, the delay asked for by the server wins when it is longer."""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """Returns the number of seconds to wait before retry number [attempt] (starting at 1)."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+
+class RetryBudget:
+    """Limits the number of retries in the process to a fraction of the number of requests.
+
+    Every request adds [ratio] tokens to the budget and every retry takes one, so under a long outage the retries
+    can't multiply the load on the model. [min_tokens] allows some retries when there was no traffic yet.
+    """
+
+    def __init__(self, ratio: float, min_tokens: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+
+    def withdraw(self) -> bool:
+        """Takes one retry from the budget, returns False when the budget is exhausted."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class CircuitBreaker:
+    """Fails fast when a model keeps failing.
+
+    After [failure_threshold] failures in a row the breaker opens and requests are refused for [reset_seconds].
+    Then one trial request is let through (half open): when it succeeds the breaker closes, otherwise it opens again.
+    A trial that ends without saying anything about the health of the model (a bad request, a cancelled request) is
+    released with release_trial, so the next request becomes the trial.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return self.state != self.OPEN
+
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+    def release_trial(self):
+        """Ends the trial request without a success or a failure, the breaker stays in its state."""
+        with self._lock:
+            self._trial_running = False
+
+
+class ResilientCaller:
+    """Shared call wrapper for the LLM requests: retries, retry budget, circuit breaker per model and fallback model.
+
+    A request is retried with jittered exponential backoff on temporary errors, as long as the per-request attempts
+    and the process wide retry budget allow it. When the model still fails or its circuit breaker is open, the request
+    is sent to the fallback model, if one is given. The counters and breaker states are available through stats().
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, retry_policy: RetryPolicy, retry_budget: RetryBudget, failure_threshold: int, reset_seconds: float, sleep=time.sleep):
+        self.retry_policy = retry_policy
+        self.retry_budget = retry_budget
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.sleep = sleep
+        self.breakers = {}
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "fallbacks": 0, "budget_exhausted": 0, "rejected_by_breaker": 0}
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "ResilientCaller":
+        return cls(
+            RetryPolicy(config.llm_retry_max_attempts, config.llm_retry_base_delay_seconds, config.llm_retry_max_delay_seconds),
+            RetryBudget(config.llm_retry_budget_ratio, config.llm_retry_budget_min_tokens, config.llm_retry_budget_max_tokens),
+            config.llm_circuit_breaker_failure_threshold,
+            config.llm_circuit_breaker_reset_seconds,
+        )
+
+
+    @classmethod
+    def shared(cls, config: Configuration) -> "ResilientCaller":
+        """Returns the caller shared by all LLM clients in the process, so they use the same budget and breakers."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls.from_config(config)
+            return cls._shared
+
+
+    def call(self, model: str, request, fallback_model: str = None):
+        """Calls [request] with the model name and retries it according to the policy.
+
+        Args:
+            model (str): the model to send the request to.
+            request: a function that takes the model name and sends the request.
+            fallback_model (str): the model to use when [model] is unavailable, optional.
+
+        Returns:
+            the result of [request].
+
+        Raises:
+            CircuitOpenError: If the breakers of the model and the fallback model are open.
+            LlmUnavailableError: If the request keeps failing with temporary errors.
+        """
+        last_error = None
+        for current_model in self._models(model, fallback_model):
+            for attempt in range(1, self.retry_policy.max_attempts + 1):
+                delay, last_error = self._before_attempt(current_model, attempt, last_error)
+                if delay is None:
+                    break
+                if delay:
+                    self.sleep(delay)
+                try:
+                    result = request(current_model)
+                except Exception as error:
+                    last_error = self._on_failure(current_model, error)
+                    continue
+                except BaseException:
+                    self._on_interrupted(current_model)
+                    raise
+                self._on_success(current_model)
+                return result
+        raise self._unavailable(model, last_error)
+
+
+    async def call_async(self, model: str, request, fallback_model: str = None):
+        """Async variant of call, [request] takes the model name and returns an awaitable."""
+        last_error = None
+        for current_model in self._models(model, fallback_model):
+            for attempt in range(1, self.retry_policy.max_attempts + 1):
+                delay, last_error = self._before_attempt(current_model, attempt, last_error)
+                if delay is None:
+                    break
+                if delay:
+                    await asyncio.sleep(delay)
+                try:
+                    result = await request(current_model)
+                except Exception as error:
+                    last_error = self._on_failure(current_model, error)
+                    continue
+                except BaseException:
+                    # e.g. asyncio.CancelledError
+                    self._on_interrupted(current_model)
+                    raise
+                self._on_success(current_model)
+                return result
+        raise self._unavailable(model, last_error)
+
+
+    def stats(self) -> dict:
+        """Returns the retry counters, the remaining retry budget and the state of the circuit breaker per model."""
+        with self._lock:
+            return dict(self.counters,
+                        retry_budget_tokens=self.retry_budget.tokens,
+                        breakers={model: {"state": breaker.state, "failures": breaker.failures} for model, breaker in self.breakers.items()})
+
+
+    def _models(self, model, fallback_model):
+        if fallback_model and fallback_model != model:
+            return [model, fallback_model]
+        return [model]
+
+
+    def _breaker(self, model) -> CircuitBreaker:
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return self.breakers[model]
+
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+
+    def _before_attempt(self, model, attempt, last_error):
+        """Returns the delay before the attempt, or None when this model shouldn't be tried (anymore)."""
+        if attempt == 1:
+            if last_error is not None:
+                self._count("fallbacks")
+                print(f"Falling back to model {model}")
+            if not self._breaker(model).allow_request():
+                self._count("rejected_by_breaker")
+                return None, last_error or CircuitOpenError(f"Circuit breaker of {model} is open")
+            self._count("requests")
+            self.retry_budget.deposit()
+            return 0, last_error
+
+        if not self.retry_budget.withdraw():
+            self._count("budget_exhausted")
+            return None, last_error
+        if not self._breaker(model).allow_request():
+            self._count("rejected_by_breaker")
+            return None, last_error
+        self._count("retries")
+        delay = self.retry_policy.delay(attempt - 1, retry_after_seconds(last_error))
+        print(f"Retrying {model} in {delay:.1f}s (attempt {attempt}) after: {last_error}")
+        return delay, last_error
+
+
+    def _on_failure(self, model, error):
+        if not is_retryable(error):
+            # a bad request says nothing about the health of the model, don't retry it and don't open the breaker
+            self._breaker(model).release_trial()
+            raise error
+        self._count("failures")
+        self._breaker(model).record_failure()
+        return error
+
+
+    def _on_success(self, model):
+        self._breaker(model).record_success()
+
+
+    def _on_interrupted(self, model):
+        # the request was cancelled or interrupted, it counts as neither a success nor a failure of the model
+        self._breaker(model).release_trial()
+
+
+    @staticmethod
+    def _unavailable(model, last_error):
+        if isinstance(last_error, CircuitOpenError):
+            return last_error
+        error = LlmUnavailableError(f"LLM API call to {model} failed: {last_error}")
+        error.__cause__ = last_error
+        return error
@@ -0,0 +1,58 @@
+import json
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class AssetDimensions:
+    """The size of an asset in cm (area in cm2), None when it is unknown.
+
+    An analysis holds one record per asset of the room, so the record has __slots__ instead of an attribute dict.
+    """
+    __slots__ = ("name", "area", "depth", "width", "height")
+    name: str
+    area: float
+    depth: float
+    width: float
+    height: float
+
+
+@dataclass
+class RoomAnalysis:
+    """The result of LlmClient.analyze_room: the size of the assets in the room and the placement of the target asset.
+
+    The bounding box is [ymin, xmin, ymax, xmax] normalized to 0-1000, the convention of the Gemini models.
+    """
+    assets: list
+    location: str
+    orientation: str
+    bounding_box: list = field(default_factory=list)
+
+
+    @classmethod
+    def from_json(cls, text: str) -> "RoomAnalysis":
+        """Parses the JSON returned by the model (see prompts.ROOM_ANALYSIS_SCHEMA) or by to_json."""
+        data = json.loads(text)
+        target = data.get("target", data)
+        return cls(
+            assets=[AssetDimensions(**asset) for asset in data.get("assets", [])],
+            location=target.get("location", ""),
+            orientation=target.get("orientation", ""),
+            bounding_box=list(target.get("bounding_box") or []),
+        )
+
+
+    def to_json(self) -> str:
+        return json.dumps({"assets": [asdict(asset) for asset in self.assets],
+                           "target": {"location": self.location, "orientation": self.orientation, "bounding_box": self.bounding_box}})
+
+
+    def dimensions_text(self) -> str:
+        """Returns the dimensions as compact text for the combine prompt, one dimensions.dimensions_line per asset."""
+        # dimensions imports this module
+        from src.dimensions import dimensions_line
+        return "\n".join(dimensions_line(asset) for asset in self.assets)
+
+
+    def location_orientation_text(self) -> str:
+        """Returns the location and orientation in the format of LlmClient.get_asset_location_orientation."""
+        return f"location: {self.location}\norientation: {self.orientation}"
@@ -0,0 +1,278 @@
+"""
+A precomputed index of the analysis and removal stages of the rooms in a catalogue.
+
+The showroom and stock room photos are fixed and reused for thousands of renders. The indexing command runs the
+analysis and removal stages once per room and stores the result; ImageProcessor looks the room up in the index and
+goes straight to combine_images.
+
+The index is a directory with index.json (the version, and per entry the analysis and the source of the room) and the
+cleaned room of every entry as PNG. An entry is keyed by the sha256 of the room file and the asset name, so a changed
+room image is a different entry. An entry is stale when the models, prompts or generation configs of the stages
+changed since it was made (see model_signature). An index of another INDEX_VERSION is ignored completely.
+
+Usage: python -m src.room_index <catalogue directory> [--asset-name sofa] [--workers 4] [--resources test-sofa]
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from PIL import Image
+
+from src.ImageOpener import ImageIndex
+from src.config import Configuration
+from src.prompts import REMOVE_ASSET_CONFIG, ROOM_ANALYSIS_CONFIG, remove_asset_prompt, room_analysis_prompt
+from src.room_analysis import RoomAnalysis
+
+INDEX_VERSION = 1
+
+
+def model_signature(config: Configuration, asset_name: str) -> str:
+    """Returns a hash of everything that determines the output of the analysis and removal stages, besides the room."""
+    signature = json.dumps([
+        config.llm_model_name_dimensions, room_analysis_prompt(asset_name), ROOM_ANALYSIS_CONFIG.model_dump_json(exclude_none=True),
+        config.llm_model_name_image_processing, config.llm_model_name_image_processing_fallback,
+        remove_asset_prompt(asset_name), REMOVE_ASSET_CONFIG.model_dump_json(exclude_none=True),
+    ])
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class IndexedRoom:
+    """An entry of the RoomIndex: the analysis of the room and the path of the room without the asset."""
+    analysis: RoomAnalysis
+    cleaned_path: str
+    source: str
+
+    def room_without_asset(self) -> Image.Image:
+        with Image.open(self.cleaned_path) as image:
+            image.load()
+            return image
+
+
+class RoomIndex:
+    """The index of the rooms of a catalogue, see the module docstring.
+
+    Lookups reload index.json when it was changed by the indexing command. A room file is only hashed again when its
+    modification time or size changed.
+    """
+
+    def __init__(self, directory: str, config: Configuration):
+        self.directory = directory
+        self.config = config
+        self._entries = {}
+        self._loaded_mtime_ns = None
+        self._digests = {}      # path -> (mtime_ns, file size, sha256)
+        self._signatures = {}   # asset name -> model signature
+        self._lock = threading.Lock()
+        self._load()
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "RoomIndex":
+        return cls(config.room_index_path, config)
+
+
+    def lookup(self, path: str, asset_name: str):
+        """Returns the IndexedRoom of the room image at [path], or None when it isn't indexed or the entry is stale."""
+        self._reload_if_changed()
+        if not os.path.isfile(path):
+            return None
+        entry = self._entries.get(self._key(self._digest(path), asset_name))
+        if entry is None or entry["signature"] != self._signature(asset_name):
+            return None
+        cleaned_path = os.path.join(self.directory, entry["cleaned"])
+        if not os.path.isfile(cleaned_path):
+            return None
+        return IndexedRoom(RoomAnalysis.from_json(entry["analysis"]), cleaned_path, entry["source"])
+
+
+    def put(self, path: str, asset_name: str, analysis: RoomAnalysis, room_without_asset: Image.Image):
+        """Stores the analysis and the cleaned room of the room image at [path] and saves the index."""
+        digest = self._digest(path)
+        cleaned = f"{digest}-{asset_name}.png"
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_atomically(cleaned, lambda f: room_without_asset.save(f, format="PNG", optimize=True))
+        with self._lock:
+            self._entries[self._key(digest, asset_name)] = {
+                "source": os.path.abspath(path),
+                "asset_name": asset_name,
+                "signature": self._signature(asset_name),
+                "analysis": analysis.to_json(),
+                "cleaned": cleaned,
+                "created_at": time.time(),
+            }
+            self._save()
+
+
+    def prune(self, catalogue: str, paths: list, asset_name: str) -> int:
+        """Removes the entries of [asset_name] from [catalogue] whose room is not one of [paths] anymore.
+
+        A room image that changed is a new entry, so the entry of the old image is removed as well.
+
+        Returns:
+            int: the number of entries that were removed.
+        """
+        keep = {self._key(self._digest(path), asset_name) for path in paths if os.path.isfile(path)}
+        root = os.path.join(os.path.abspath(catalogue), "")
+        with self._lock:
+            removed = [key for key, entry in self._entries.items()
+                       if entry["asset_name"] == asset_name and entry["source"].startswith(root) and key not in keep]
+            for key in removed:
+                cleaned_path = os.path.join(self.directory, self._entries.pop(key)["cleaned"])
+                if os.path.exists(cleaned_path):
+                    os.remove(cleaned_path)
+            if removed:
+                self._save()
+        return len(removed)
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    @staticmethod
+    def _key(digest, asset_name):
+        return f"{digest}:{asset_name}"
+
+
+    def _signature(self, asset_name):
+        if asset_name not in self._signatures:
+            self._signatures[asset_name] = model_signature(self.config, asset_name)
+        return self._signatures[asset_name]
+
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        digest = file_digest(path)
+        self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+
+    def _load(self):
+        try:
+            mtime_ns = os.stat(self._index_path()).st_mtime_ns
+            with open(self._index_path(), encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        if data.get("version") != INDEX_VERSION:
+            print(f"Ignoring room index {self.directory} of version {data.get('version')}, expected {INDEX_VERSION}")
+            data = {}
+        with self._lock:
+            self._entries = data.get("entries", {})
+            self._loaded_mtime_ns = mtime_ns
+
+
+    def _reload_if_changed(self):
+        try:
+            mtime_ns = os.stat(self._index_path()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns != self._loaded_mtime_ns:
+            self._load()
+
+
+    def _save(self):
+        """Writes index.json, the caller holds the lock."""
+        data = json.dumps({"version": INDEX_VERSION, "entries": self._entries}).encode("utf-8")
+        self._write_atomically("index.json", lambda f: f.write(data))
+        self._loaded_mtime_ns = os.stat(self._index_path()).st_mtime_ns
+
+
+    def _write_atomically(self, name, write):
+        # write to a temporary file and rename it, so a reader never sees half a file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def build_index(catalogue: str, llm_client, room_index: RoomIndex, asset_name: str = "sofa", max_workers: int = 4) -> dict:
+    """Runs the analysis and removal stages for every room image in [catalogue] (recursively) that isn't indexed yet.
+
+    At most [max_workers] rooms are processed at the same time. Entries of rooms that are no longer in the catalogue
+    (or changed) are removed.
+
+    Returns:
+        dict: the number of rooms that were indexed, skipped (up to date), failed and removed.
+    """
+    paths = []
+    for directory, _, _ in os.walk(catalogue):
+        paths.extend(entry.path for entry in ImageIndex(directory))
+
+    counts = {"indexed": 0, "skipped": 0, "failed": 0, "removed": 0}
+    todo = []
+    for path in paths:
+        if room_index.lookup(path, asset_name) is not None:
+            counts["skipped"] += 1
+        else:
+            todo.append(path)
+
+    def index_room(path):
+        with Image.open(path) as room_image:
+            room_image.load()
+            analysis = llm_client.analyze_room(room_image, asset_name)
+            room_without_asset = llm_client.remove_asset_from_image(room_image, asset_name)
+        room_index.put(path, asset_name, analysis, room_without_asset)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="room-index") as executor:
+        futures = {executor.submit(index_room, path): path for path in todo}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                counts["indexed"] += 1
+                print(f"Indexed {futures[future]}")
+            except Exception as error:
+                counts["failed"] += 1
+                print(f"Indexing {futures[future]} failed: {error}")
+
+    counts["removed"] = room_index.prune(catalogue, paths, asset_name)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("catalogue", help="directory with the room images, searched recursively")
+    parser.add_argument("--asset-name", default="sofa", help="the type of asset that is replaced in the rooms")
+    parser.add_argument("--workers", type=int, default=4, help="number of rooms that are indexed at the same time")
+    parser.add_argument("--resources", default="test-sofa", help="resources folder of the Configuration")
+    parser.add_argument("--index", help="directory of the index, defaults to Configuration.room_index_path")
+    args = parser.parse_args()
+
+    from src.llm_client import LlmClient
+    from src.rate_scheduler import BULK
+
+    config = Configuration(args.resources)
+    room_index = RoomIndex(args.index or config.room_index_path, config)
+    # the indexing requests must never delay customer-facing renders
+    counts = build_index(args.catalogue, LlmClient(config).with_lane(BULK), room_index, args.asset_name, args.workers)
+    print(f"Room index {room_index.directory}: " + ", ".join(f"{name}={count}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
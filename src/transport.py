@@ -0,0 +1,134 @@
+"""
+The transport under the LLM clients: every generateContent request goes through it.
+
+In passthrough mode the request is sent to the Gemini API. In record mode the response is also saved as a cassette,
+in replay mode the response is read from the cassette and the API is never called, so the tests and benchmarks run
+offline, without an API key and in milliseconds.
+
+A cassette is one gzipped JSON file per request, named after the fingerprint of the request: the model, the prompts,
+the content hash of the images and the generation config. The images are hashed before they are prepared for
+uploading, so a replay doesn't depend on the upload settings or on the file URIs of the Files API. Cassettes are
+written to a temporary file and renamed, so parallel test workers can record and replay the same directory safely.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from google.genai import types
+from PIL import Image
+
+from src.config import Configuration
+from src.exceptions import CassetteNotFoundError
+from src.image_utils import image_digest
+
+PASSTHROUGH = "passthrough"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (PASSTHROUGH, RECORD, REPLAY)
+
+
+def request_fingerprint(model: str, contents: list, config) -> str:
+    """Returns the fingerprint of a request to [model] with [contents] (texts and PIL images) and generation [config]."""
+    parts = [image_digest(content) if isinstance(content, Image.Image) else str(content) for content in contents]
+    config_json = config.model_dump_json(exclude_none=True) if config is not None else None
+    request = json.dumps([model, parts, config_json])
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class CassetteTransport:
+    """Sends, records or replays the generateContent requests of an LLM client, see the module docstring."""
+
+    def __init__(self, mode: str = PASSTHROUGH, directory: str = None, replay_latency_seconds: float = 0.0):
+        """
+        Args:
+            mode (str): passthrough, record or replay.
+            directory (str): directory of the cassettes, required to record or replay.
+            replay_latency_seconds (float): simulated latency of a replayed response.
+
+        Raises:
+            ValueError: If the mode is unknown, or there is no directory to record or replay.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown transport mode {mode}, use one of {MODES}")
+        if mode != PASSTHROUGH and not directory:
+            raise ValueError(f"A cassette directory is required to {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.replay_latency_seconds = replay_latency_seconds
+        if mode == RECORD:
+            os.makedirs(directory, exist_ok=True)
+
+
+    @classmethod
+    def from_config(cls, config: Configuration) -> "CassetteTransport":
+        return cls(config.llm_transport_mode, config.cassette_path, config.llm_transport_replay_latency_seconds)
+
+
+    def generate_content(self, model: str, contents: list, config, send):
+        """Returns the response to the request, sent with send() unless it is replayed.
+
+        Args:
+            model (str): the model of the request.
+            contents (list): the prompts and PIL images of the request, before they are prepared for uploading.
+            config: the generation config of the request.
+            send: sends the request to the API and returns the GenerateContentResponse.
+
+        Raises:
+            CassetteNotFoundError: If the request is replayed but was never recorded.
+        """
+        if self.mode == PASSTHROUGH:
+            return send()
+        fingerprint = request_fingerprint(model, contents, config)
+        if self.mode == REPLAY:
+            response = self.load(fingerprint, model)
+            if self.replay_latency_seconds:
+                time.sleep(self.replay_latency_seconds)
+            return response
+        response = send()
+        self.save(fingerprint, response)
+        return response
+
+
+    async def generate_content_async(self, model: str, contents: list, config, send):
+        """Async variant of generate_content, send() returns an awaitable. The cassettes are read and written in an executor."""
+        if self.mode == PASSTHROUGH:
+            return await send()
+        loop = asyncio.get_running_loop()
+        fingerprint = await loop.run_in_executor(None, request_fingerprint, model, contents, config)
+        if self.mode == REPLAY:
+            response = await loop.run_in_executor(None, self.load, fingerprint, model)
+            if self.replay_latency_seconds:
+                await asyncio.sleep(self.replay_latency_seconds)
+            return response
+        response = await send()
+        await loop.run_in_executor(None, self.save, fingerprint, response)
+        return response
+
+
+    def path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, f"{fingerprint}.json.gz")
+
+
+    def load(self, fingerprint: str, model: str = None) -> types.GenerateContentResponse:
+        try:
+            with gzip.open(self.path(fingerprint), "rt", encoding="utf-8") as f:
+                return types.GenerateContentResponse.model_validate_json(f.read())
+        except FileNotFoundError:
+            raise CassetteNotFoundError(f"No cassette for the request to {model} ({fingerprint}) in {self.directory}, record it first")
+
+
+    def save(self, fingerprint: str, response: types.GenerateContentResponse):
+        data = gzip.compress(response.model_dump_json(exclude_none=True).encode("utf-8"))
+        # write to a temporary file and rename it, so a parallel reader never sees half a cassette
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.path(fingerprint))
+        except BaseException:
+            os.remove(temp_path)
+            raise
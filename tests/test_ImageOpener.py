@@ -2,11 +2,11 @@ import os
 import shutil
 import tempfile
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from PIL import Image
 
-from src.ImageOpener import ImageOpener
+from src.ImageOpener import ImageIndex, ImageOpener
 
 
 class TestImageOpener(unittest.TestCase):
@@ -67,6 +67,83 @@ class TestImageOpener(unittest.TestCase):
             ImageOpener.open_image(self.non_image_path)
 
 
+class TestImageIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Create a directory with two images, a text file and a subdirectory."""
+        self.test_dir = tempfile.mkdtemp()
+        Image.new('RGB', (100, 50), color='red').save(os.path.join(self.test_dir, "b.png"))
+        Image.new('RGB', (30, 20), color='blue').save(os.path.join(self.test_dir, "a.jpg"))
+        with open(os.path.join(self.test_dir, "notes.txt"), "w") as f:
+            f.write("this is not an image")
+        os.makedirs(os.path.join(self.test_dir, "sub"))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_index_reads_headers(self):
+        """Test only the images are indexed, with their format and size, in order of name."""
+        index = ImageIndex(self.test_dir)
+
+        entries = list(index)
+
+        self.assertEqual([entry.name for entry in entries], ["a.jpg", "b.png"])
+        self.assertEqual(index.get("b.png").format, "PNG")
+        self.assertEqual(index.get("b.png").size, (100, 50))
+        self.assertIsNone(index.get("notes.txt"))
+        self.assertEqual(index.first().name, "a.jpg")
+
+    def test_refresh_only_reads_changed_files(self):
+        """Test a refresh reads new and changed files and drops removed files, unchanged files aren't opened again."""
+        index = ImageIndex(self.test_dir)
+        self.assertEqual(index.refresh(), {"added": 2, "updated": 0, "removed": 0})
+
+        Image.new('RGB', (200, 100)).save(os.path.join(self.test_dir, "b.png"))
+        os.utime(os.path.join(self.test_dir, "b.png"), ns=(0, 10 ** 18))
+        Image.new('RGB', (10, 10)).save(os.path.join(self.test_dir, "c.webp"))
+        os.remove(os.path.join(self.test_dir, "a.jpg"))
+
+        with patch("src.ImageOpener.Image.open", wraps=Image.open) as image_open:
+            self.assertEqual(index.refresh(), {"added": 1, "updated": 1, "removed": 1})
+            self.assertEqual(image_open.call_count, 2)
+            self.assertEqual(index.refresh(), {"added": 0, "updated": 0, "removed": 0})
+            self.assertEqual(image_open.call_count, 2)
+        self.assertEqual(index.get("b.png").size, (200, 100))
+
+    def test_lookups_do_not_rescan(self):
+        """Test lookups use the index until it is refreshed or older than max_age_seconds."""
+        index = ImageIndex(self.test_dir)
+        index.refresh()
+        Image.new('RGB', (10, 10)).save(os.path.join(self.test_dir, "c.png"))
+
+        self.assertNotIn("c.png", index)
+        index.max_age_seconds = 0
+        index.scanned_at -= 1
+        self.assertIn("c.png", index)
+
+    def test_open_image_skips_non_images(self):
+        """Test opening a directory opens the first image by name, not the first file."""
+        os.remove(os.path.join(self.test_dir, "a.jpg"))
+        with open(os.path.join(self.test_dir, "0-readme.txt"), "w") as f:
+            f.write("catalogue")
+
+        opened_image = ImageOpener.open_image(self.test_dir)
+
+        self.assertEqual(opened_image.size, (100, 50))
+
+    def test_open_image_uses_the_index_until_a_miss(self):
+        """Test opening a directory again doesn't rescan it, unless the indexed image was removed."""
+        ImageOpener.open_image(self.test_dir)
+
+        with patch("src.ImageOpener.os.scandir", wraps=os.scandir) as scandir:
+            self.assertEqual(ImageOpener.open_image(self.test_dir).size, (30, 20))
+            self.assertEqual(scandir.call_count, 0)
+
+            os.remove(os.path.join(self.test_dir, "a.jpg"))
+            self.assertEqual(ImageOpener.open_image(self.test_dir).size, (100, 50))
+            self.assertEqual(scandir.call_count, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
 
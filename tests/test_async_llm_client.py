@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from unittest.mock import Mock
+
+from src.async_llm_client import AsyncLlmClient
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+
+
+class FakeAioModels:
+    """Records how many generate_content calls are in flight at the same time."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_content(self, model, contents, config):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        part = Mock()
+        part.text = f"{model}: area=1"
+        return Mock(parts=[part])
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Mock()
+        self.config.llm_model_name_dimensions = "dimensions-model"
+        self.config.llm_model_name_image_processing = "image-model"
+        self.config.llm_upload_max_size = {}
+        self.config.llm_upload_max_size_default = 1024
+        self.config.llm_upload_format = "JPEG"
+        self.config.llm_upload_quality = 90
+        self.config.llm_use_files_api = False
+        self.config.metrics_jsonl_path = None
+        self.config.llm_transport_mode = "passthrough"
+        self.config.llm_max_concurrent_requests = {"dimensions-model": 2}
+        self.config.llm_max_concurrent_requests_default = 1
+
+        self.genai_client = Mock()
+        self.genai_client.aio.models = FakeAioModels()
+        self.resilient_caller = ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(0, 0, 0), failure_threshold=5, reset_seconds=30)
+        self.rate_scheduler = RateScheduler({})
+
+    def test_concurrent_requests_are_limited_per_model(self):
+        """Test no more than the configured number of requests per model are in flight."""
+        client = AsyncLlmClient(self.config, client=self.genai_client, resilient_caller=self.resilient_caller, rate_scheduler=self.rate_scheduler)
+
+        async def render_many():
+            return await asyncio.gather(*[client.get_asset_dimensions("room") for _ in range(10)])
+
+        results = asyncio.run(render_many())
+
+        self.assertEqual(results, ["dimensions-model: area=1"] * 10)
+        self.assertEqual(self.genai_client.aio.models.max_in_flight, 2)
+
+    def test_clients_share_the_genai_client(self):
+        """Test multiple async clients can share one genai client and its connection pool."""
+        first = AsyncLlmClient(self.config, client=self.genai_client, resilient_caller=self.resilient_caller, rate_scheduler=self.rate_scheduler)
+        second = AsyncLlmClient(self.config, client=self.genai_client, resilient_caller=self.resilient_caller, rate_scheduler=self.rate_scheduler)
+        self.assertIs(first.client, second.client)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from google.genai import types
+from PIL import Image
+
+from src.batch_renderer import BatchRenderer, RenderJob, load_manifest
+
+
+ROOM_ANALYSIS_JSON = ('{"assets": [{"name": "sofa", "area": 62000, "depth": 100, "width": 620, "height": 75}], '
+                      '"target": {"location": "center", "orientation": "facing the viewer", "bounding_box": [400, 100, 800, 900]}}')
+
+
+def text_response(text):
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]))])
+
+
+def image_response(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color=color).save(buffer, format="PNG")
+    part = types.Part.from_bytes(data=buffer.getvalue(), mime_type="image/png")
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))])
+
+
+class StubBatches:
+    """Local stand-in for the batches API: jobs are pending on creation and succeed on the first poll."""
+
+    def __init__(self, fail_stage=None):
+        self.fail_stage = fail_stage
+        self.created = []
+        self._jobs = {}
+
+    def create(self, model, src, config):
+        name = f"batches/{len(self.created)}"
+        self.created.append((model, config.display_name, src))
+        self._jobs[name] = (config.display_name, src)
+        return types.BatchJob(name=name, state=types.JobState.JOB_STATE_PENDING)
+
+    def get(self, name):
+        display_name, requests = self._jobs[name]
+        if display_name.endswith(self.fail_stage or "-"):
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_FAILED)
+        responses = [types.InlinedResponse(response=self._respond(request)) for request in requests]
+        return types.BatchJob(name=name, state=types.JobState.JOB_STATE_SUCCEEDED, dest=types.BatchJobDestination(inlined_responses=responses))
+
+    @staticmethod
+    def _respond(request):
+        prompt = request.contents[0].parts[0].text
+        if "remove the" in prompt:
+            return image_response('white')
+        if "Place the sofa" in prompt:
+            return image_response('green')
+        return text_response(ROOM_ANALYSIS_JSON)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        for name in ("room-1.jpg", "room-2.jpg"):
+            Image.new('RGB', (16, 16), color='blue').save(os.path.join(self.test_dir, name))
+        Image.new('RGB', (4, 4), color='red').save(os.path.join(self.test_dir, "asset.png"))
+
+        self.config = Mock()
+        self.config.llm_model_name_dimensions = "dimensions-model"
+        self.config.llm_model_name_image_processing = "image-model"
+        self.config.llm_upload_max_size = {}
+        self.config.llm_upload_max_size_default = 1024
+        self.config.llm_upload_format = "JPEG"
+        self.config.llm_upload_quality = 90
+        self.config.image_draft_decoding = False
+        self.config.batch_poll_interval_seconds = 0
+        self.config.batch_timeout_seconds = 10
+        self.config.batch_max_inline_bytes = 16 * 1024 * 1024
+        self.config.output_path = os.path.join(self.test_dir, "output")
+        self.config.get_room_image_path.side_effect = lambda name: os.path.join(self.test_dir, name)
+        self.config.get_asset_image_path.side_effect = lambda name: os.path.join(self.test_dir, name)
+
+        self.jobs = [RenderJob("room-1.jpg", "asset.png", "width=200"), RenderJob("room-2.jpg", "asset.png", "width=200"),
+                     RenderJob("room-1.jpg", "asset.png", "width=150")]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_render_submits_staged_batches(self):
+        """Test the rooms are analysed once per room and every job is combined in one batch."""
+        batches = StubBatches()
+        results = BatchRenderer(self.config, batches=batches).render(self.jobs)
+
+        stages = [(model, display_name, len(requests)) for model, display_name, requests in batches.created]
+        self.assertEqual(stages, [("dimensions-model", "home-design-analysis", 2), ("image-model", "home-design-removal", 2),
+                                  ("image-model", "home-design-combine", 3)])
+        self.assertEqual([result["status"] for result in results], ["succeeded"] * 3)
+        for result in results:
+            self.assertTrue(os.path.exists(os.path.join(self.config.output_path, result["output"])))
+        with open(os.path.join(self.config.output_path, "batch-results.json")) as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+    def test_large_stages_are_split_over_batch_jobs(self):
+        """Test a stage whose inline requests exceed batch_max_inline_bytes is split, and the responses stay in order."""
+        self.config.batch_max_inline_bytes = 1500
+        batches = StubBatches()
+        results = BatchRenderer(self.config, batches=batches).render(self.jobs)
+
+        combine_jobs = [len(requests) for _, display_name, requests in batches.created if display_name.startswith("home-design-combine")]
+        self.assertGreater(len(combine_jobs), 1)
+        self.assertEqual(sum(combine_jobs), 3)
+        self.assertEqual([result["status"] for result in results], ["succeeded"] * 3)
+
+    def test_failed_batch_job_fails_only_its_jobs(self):
+        """Test the jobs of a batch job that doesn't succeed are reported as failed and the other jobs are still rendered."""
+        results = BatchRenderer(self.config, batches=StubBatches(fail_stage="removal")).render(self.jobs)
+        self.assertEqual([result["status"] for result in results], ["failed"] * 3)
+        self.assertIn("JOB_STATE_FAILED", results[0]["error"])
+
+        self.config.batch_max_inline_bytes = 1500
+        results = BatchRenderer(self.config, batches=StubBatches(fail_stage="combine-2")).render(self.jobs)
+        self.assertEqual([result["status"] for result in results], ["succeeded", "failed", "succeeded"])
+        self.assertTrue(results[1]["error"].startswith("stage 2 failed"))
+        with open(os.path.join(self.config.output_path, "batch-results.json")) as f:
+            self.assertEqual([result["status"] for result in json.load(f)], ["succeeded", "failed", "succeeded"])
+
+    def test_missing_room_fails_only_its_jobs(self):
+        """Test a room that can't be loaded fails its jobs in stage 1 without stopping the run."""
+        jobs = self.jobs + [RenderJob("missing.jpg", "asset.png", "width=200")]
+        batches = StubBatches()
+
+        results = BatchRenderer(self.config, batches=batches).render(jobs)
+
+        self.assertEqual([result["status"] for result in results], ["succeeded"] * 3 + ["failed"])
+        self.assertTrue(results[3]["error"].startswith("stage 1 failed"))
+        self.assertEqual([len(requests) for _, _, requests in batches.created], [2, 2, 3])
+
+    def test_combine_prompt_names_the_asset(self):
+        """Test the combine request asks to place the asset type of the job instead of a sofa."""
+        batches = StubBatches()
+        BatchRenderer(self.config, batches=batches).render([RenderJob("room-1.jpg", "asset.png", "width=200", "bed")])
+
+        prompt = batches.created[-1][2][0].contents[0].parts[0].text
+        self.assertIn("Place the bed", prompt)
+        self.assertNotIn("the sofa", prompt.lower())
+
+    def test_load_manifest(self):
+        """Test the render jobs are read from a JSON manifest."""
+        manifest_path = os.path.join(self.test_dir, "manifest.json")
+        with open(manifest_path, "w") as f:
+            json.dump([{"room": "room-1.jpg", "asset": "asset.png", "asset_dimensions": "width=200", "asset_name": "bed"}], f)
+
+        self.assertEqual(load_manifest(manifest_path), [RenderJob("room-1.jpg", "asset.png", "width=200", "bed")])
+
+
+if __name__ == '__main__':
+    unittest.main()
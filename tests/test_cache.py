@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from PIL import Image
+
+from src.cache import CachedLlmClient, DiskCache, with_cache
+from src.room_analysis import AssetDimensions, RoomAnalysis
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_text_and_image_round_trip(self):
+        """Test text and images come back from the cache and hits and misses are counted."""
+        cache = DiskCache(self.test_dir, max_bytes=10_000_000)
+        self.assertIsNone(cache.get("text"))
+
+        cache.put("text", "sofa: area=1")
+        cache.put("image", Image.new('RGB', (10, 10), color='red'))
+
+        self.assertEqual(cache.get("text"), "sofa: area=1")
+        self.assertEqual(cache.get("image").getpixel((0, 0)), (255, 0, 0))
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test the least recently used entry is removed when the cache is full."""
+        cache = DiskCache(self.test_dir, max_bytes=25)
+        cache.put("first", "a" * 10)
+        cache.put("second", "b" * 10)
+        cache.get("first")
+        cache.put("third", "c" * 10)
+
+        self.assertIsNone(cache.get("second"))
+        self.assertEqual(cache.get("first"), "a" * 10)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "second.txt")))
+
+    def test_entries_survive_a_restart(self):
+        """Test a new cache instance on the same directory finds the stored entries."""
+        DiskCache(self.test_dir, max_bytes=1000).put("text", "kept")
+        self.assertEqual(DiskCache(self.test_dir, max_bytes=1000).get("text"), "kept")
+
+
+class TestCachedLlmClient(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.llm_client = Mock()
+        self.llm_client.config.llm_model_name_image_processing = "image-model"
+        self.llm_client.config.llm_model_name_dimensions = "dimensions-model"
+        self.llm_client.get_asset_dimensions.return_value = "sofa: area=1"
+        self.llm_client.get_asset_location_orientation.return_value = "location: center"
+        self.llm_client.remove_asset_from_image.return_value = Image.new('RGB', (10, 10), color='white')
+        self.llm_client.analyze_room.return_value = RoomAnalysis([AssetDimensions("sofa", 1, 2, 3, 4)], "center", "front", [1, 2, 3, 4])
+        self.client = CachedLlmClient(self.llm_client, DiskCache(self.test_dir, max_bytes=10_000_000))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_repeat_render_only_calls_combine(self):
+        """Test the room analysis is served from the cache for a room with the same content."""
+        for _ in range(2):
+            room = Image.new('RGB', (10, 10), color='blue')
+            self.client.get_asset_dimensions(room)
+            self.client.get_asset_location_orientation(room, "sofa")
+            self.client.remove_asset_from_image(room, "sofa")
+            analysis = self.client.analyze_room(room, "sofa")
+            self.client.combine_images(room, room, "", "", "")
+
+        self.llm_client.get_asset_dimensions.assert_called_once()
+        self.llm_client.get_asset_location_orientation.assert_called_once()
+        self.llm_client.remove_asset_from_image.assert_called_once()
+        self.llm_client.analyze_room.assert_called_once()
+        self.assertEqual(analysis, self.llm_client.analyze_room.return_value)
+        self.assertEqual(self.llm_client.combine_images.call_count, 2)
+
+    def test_different_room_or_prompt_is_a_miss(self):
+        """Test another room image or asset name doesn't hit the cache."""
+        self.client.get_asset_location_orientation(Image.new('RGB', (10, 10), color='blue'), "sofa")
+        self.client.get_asset_location_orientation(Image.new('RGB', (10, 10), color='green'), "sofa")
+        self.client.get_asset_location_orientation(Image.new('RGB', (10, 10), color='green'), "bed")
+        self.assertEqual(self.llm_client.get_asset_location_orientation.call_count, 3)
+
+    def test_with_cache_uses_the_configured_cache(self):
+        """Test with_cache puts the shared cache of cache_path and cache_max_bytes in front of the client, unless it is disabled."""
+        self.llm_client.config.cache_enabled = True
+        self.llm_client.config.cache_path = self.test_dir
+        self.llm_client.config.cache_max_bytes = 1234
+        self.addCleanup(setattr, DiskCache, "_shared", None)
+        DiskCache._shared = None
+
+        client = with_cache(self.llm_client)
+
+        self.assertIsInstance(client, CachedLlmClient)
+        self.assertEqual((client.cache.directory, client.cache.max_bytes), (self.test_dir, 1234))
+        self.assertIs(with_cache(self.llm_client).cache, client.cache)
+        self.assertIs(client.with_lane("bulk").cache, client.cache)
+        self.llm_client.config.cache_enabled = False
+        self.assertIs(with_cache(self.llm_client), self.llm_client)
+
+
+if __name__ == '__main__':
+    unittest.main()
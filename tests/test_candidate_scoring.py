@@ -0,0 +1,104 @@
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from src.candidate_scoring import score_composite, score_removal
+
+WEIGHTS = {"background": 0.5, "size": 0.2, "colour": 0.3}
+# [ymin, xmin, ymax, xmax] normalized to 0-1000: the middle of the room
+BOUNDING_BOX = [250, 250, 750, 750]
+# the box of a sofa of 2:1 in the middle of a room of 200x200: x 60-140, y 80-120
+SOFA_BOX = [400, 300, 600, 700]
+
+
+def _room():
+    pixels = np.random.default_rng(1).integers(0, 255, (200, 200, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _with_rectangle(image, box, color):
+    image = image.copy()
+    ImageDraw.Draw(image).rectangle(box, fill=color)
+    return image
+
+
+class ScoreRemovalTestCase(unittest.TestCase):
+
+    def test_changes_outside_the_asset_lower_the_score(self):
+        """Test a candidate that only changed the region of the asset scores higher than one that changed the room."""
+        room = _room()
+        clean = _with_rectangle(room, (60, 60, 140, 140), (128, 128, 128))
+        messy = _with_rectangle(clean, (0, 0, 199, 40), (0, 0, 0))
+
+        clean_score = score_removal(room, clean, BOUNDING_BOX, padding=0)
+        messy_score = score_removal(room, messy, BOUNDING_BOX, padding=0)
+
+        self.assertEqual(clean_score.total, 1.0)
+        self.assertLess(messy_score.total, clean_score.total)
+
+    def test_candidate_of_another_size(self):
+        """Test a candidate in another resolution is resized to the room before it is compared."""
+        room = _room()
+
+        self.assertGreater(score_removal(room, room.resize((400, 400)), BOUNDING_BOX, padding=0).total, 0.8)
+
+
+class ScoreCompositeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.room = Image.new("RGB", (200, 200), color=(200, 200, 190))
+        # a red sofa of 2:1 on a white background
+        self.asset = _with_rectangle(Image.new("RGB", (100, 100), color="white"), (10, 30, 89, 69), (200, 20, 20))
+
+    def test_matching_asset_scores_high(self):
+        """Test a placed asset with the shape and colours of the asset image scores higher than a distorted one."""
+        good = _with_rectangle(self.room, (60, 80, 139, 119), (200, 20, 20))
+        distorted = _with_rectangle(self.room, (90, 60, 109, 139), (20, 20, 200))
+
+        good_score = score_composite(self.room, self.asset, good, SOFA_BOX, 0, WEIGHTS)
+        distorted_score = score_composite(self.room, self.asset, distorted, SOFA_BOX, 0, WEIGHTS)
+
+        self.assertEqual(good_score.background, 1.0)
+        self.assertGreater(good_score.size, 0.9)
+        self.assertGreater(good_score.colour, 0.9)
+        self.assertLess(distorted_score.size, 0.5)
+        self.assertLess(distorted_score.colour, 0.1)
+        self.assertGreater(good_score.total, distorted_score.total)
+
+    def test_asset_of_the_wrong_size_scores_low(self):
+        """Test an asset with the right shape and colours that is placed too large or too small gets a lower size score."""
+        good = _with_rectangle(self.room, (60, 80, 139, 119), (200, 20, 20))
+        too_large = _with_rectangle(self.room, (40, 70, 159, 129), (200, 20, 20))
+        too_small = _with_rectangle(self.room, (80, 90, 119, 109), (200, 20, 20))
+
+        good_score = score_composite(self.room, self.asset, good, SOFA_BOX, 0, WEIGHTS)
+        for placed in (too_large, too_small):
+            score = score_composite(self.room, self.asset, placed, SOFA_BOX, 0, WEIGHTS)
+            self.assertGreater(score.colour, 0.9)
+            self.assertLess(score.size, 0.7)
+            self.assertLess(score.total, good_score.total)
+
+    def test_nothing_placed(self):
+        """Test a candidate without the asset gets no size and colour score."""
+        score = score_composite(self.room, self.asset, self.room, BOUNDING_BOX, 0, WEIGHTS)
+
+        self.assertEqual(score.size, 0.0)
+        self.assertEqual(score.colour, 0.0)
+        self.assertAlmostEqual(score.total, 0.5)
+
+    def test_without_bounding_box(self):
+        """Test only the background is scored when the bounding box is unknown, so a placed asset isn't scored as missing."""
+        placed = _with_rectangle(self.room, (60, 80, 139, 119), (200, 20, 20))
+
+        score = score_composite(self.room, self.asset, placed, [], 0, WEIGHTS)
+
+        self.assertIsNone(score.size)
+        self.assertIsNone(score.colour)
+        self.assertEqual(score.total, score.background)
+        self.assertGreater(score.total, 0.9)
+        self.assertLess(score_composite(self.room, self.asset, _with_rectangle(placed, (0, 0, 199, 99), (0, 0, 0)), [], 0, WEIGHTS).total, score.total)
+
+
+if __name__ == '__main__':
+    unittest.main()
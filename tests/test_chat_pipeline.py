@@ -0,0 +1,108 @@
+import io
+import time
+import unittest
+from unittest.mock import Mock
+
+from google.genai import types
+from PIL import Image
+
+from src.chat_pipeline import ChatPipeline, ChatSessionPool
+from src.image_preparation import ImagePreparer
+from src.metrics import Metrics
+from src.rate_scheduler import INTERACTIVE, RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+from src.room_analysis import AssetDimensions, RoomAnalysis
+
+
+class StubChat:
+    """Answers every message with an image and remembers the messages."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, message):
+        self.messages.append(message)
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), color='green').save(buffer, format="PNG")
+        part = types.Part.from_bytes(data=buffer.getvalue(), mime_type="image/png")
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=100, candidates_token_count=10))
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Mock()
+        self.config.llm_model_name_image_processing = "image-model"
+        self.chats = []
+        self.llm_client = Mock()
+        self.llm_client.analyze_room.return_value = RoomAnalysis([AssetDimensions("sofa", 1, 2, 3, 4)], "center", "front", [])
+        self.llm_client.image_preparer = ImagePreparer({}, default_max_size=64)
+        self.llm_client.resilient_caller = ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(0, 0, 0), failure_threshold=5, reset_seconds=30)
+        self.llm_client.rate_scheduler = RateScheduler({"image-model": {"rpm": 100, "tpm": 100000}}, headroom=1)
+        self.llm_client.lane = INTERACTIVE
+        self.events = []
+        self.llm_client.metrics = Metrics([Mock(record=self.events.append)])
+        self.pool = ChatSessionPool(self._create_chat, idle_seconds=60, max_sessions=2)
+
+    def _create_chat(self):
+        self.chats.append(StubChat())
+        return self.chats[-1]
+
+    def test_render_and_tweak_in_one_session(self):
+        """Test removal, insertion and tweak are turns in the same chat and only the first two send images."""
+        pipeline = ChatPipeline(self.config, self.llm_client, self.pool)
+
+        session_id, image = pipeline.start(Image.new('RGB', (32, 32)), Image.new('RGB', (16, 16)), "width=200")
+        tweaked = pipeline.tweak(session_id, "move it to the left")
+
+        self.assertEqual(image.size, (8, 8))
+        self.assertIsNotNone(tweaked)
+        self.assertEqual(len(self.chats), 1)
+        self.assertEqual([len(message) for message in self.chats[0].messages], [2, 2, 1])
+        self.assertIn("move it to the left", self.chats[0].messages[2][0])
+        self.assertEqual(pipeline.usage(session_id),
+                         {"turns": 3, "prompt_tokens": 300, "candidate_tokens": 30, "turn_prompt_tokens": [100, 100, 100]})
+
+    def test_turns_are_scheduled_and_measured(self):
+        """Test every turn takes its quota from the rate scheduler, with the history in the estimate, and is reported."""
+        acquired = []
+        acquire = self.llm_client.rate_scheduler.acquire
+        self.llm_client.rate_scheduler.acquire = lambda model, tokens, lane: acquired.append((model, tokens, lane)) or acquire(model, tokens, lane)
+        pipeline = ChatPipeline(self.config, self.llm_client, self.pool)
+
+        session_id, _ = pipeline.start(Image.new('RGB', (32, 32)), Image.new('RGB', (16, 16)), "width=200")
+        pipeline.tweak(session_id, "smaller")
+
+        self.assertEqual([(model, lane) for model, _, lane in acquired], [("image-model", INTERACTIVE)] * 3)
+        # the tweak sends the 100 prompt tokens and 10 candidate tokens of the previous turn again
+        self.assertGreater(acquired[2][1], 110)
+        self.assertEqual(self.llm_client.rate_scheduler.stats()["lanes"][INTERACTIVE]["dispatched"], 3)
+        self.assertEqual([(event.kind, event.name, event.prompt_tokens) for event in self.events], [("llm", "chat", 100)] * 3)
+
+    def test_idle_sessions_are_evicted(self):
+        """Test a session that is idle for too long is evicted."""
+        pool = ChatSessionPool(self._create_chat, idle_seconds=0.01, max_sessions=10)
+        session = pool.create()
+        time.sleep(0.02)
+
+        with self.assertRaises(KeyError):
+            pool.get(session.session_id)
+        self.assertEqual(pool.evictions, 1)
+
+    def test_least_recently_used_session_is_evicted_when_full(self):
+        """Test the least recently used session makes room for a new one."""
+        first = self.pool.create()
+        second = self.pool.create()
+        self.pool.get(first.session_id)
+        self.pool.create()
+
+        self.assertEqual(len(self.pool), 2)
+        self.pool.get(first.session_id)
+        with self.assertRaises(KeyError):
+            self.pool.get(second.session_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
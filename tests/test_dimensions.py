@@ -0,0 +1,55 @@
+import unittest
+
+from src.dimensions import asset_dimensions_prompt, parse_asset_dimensions, scale_instruction
+from src.room_analysis import AssetDimensions, RoomAnalysis
+
+
+class ParseDimensionsTestCase(unittest.TestCase):
+
+    def test_parse_dutch_asset_dimensions(self):
+        """Test the overall height wins from the parts and the deepest seat depth is the depth."""
+        asset = parse_asset_dimensions("""
+            Hoogte=80 cm
+            Poot hoogte=2 cm
+            Minimale zitdiepte=60 cm
+            Maximale zitdiepte=90 cm
+            Zithoogte=42 cm
+            Rughoogte=40 cm
+            Breedte armleuning=30 cm
+            Hoogte arm=50 cm""", "sofa")
+
+        self.assertEqual(asset, AssetDimensions("sofa", None, 90, None, 80))
+
+    def test_parse_english_asset_dimensions(self):
+        """Test the English keys, the largest height without an exact key and other units."""
+        asset = parse_asset_dimensions("width: 1,816 m\ndepth: 2087 mm\nheight bed: 45.2 cm\nheight backboard: 107.8 cm", "bed")
+
+        self.assertAlmostEqual(asset.width, 181.6)
+        self.assertAlmostEqual(asset.depth, 208.7)
+        self.assertEqual(asset.height, 107.8)
+
+
+class ScaleInstructionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.analysis = RoomAnalysis([AssetDimensions("rug", 60000, 200, 300, 1), AssetDimensions("sectional sofa", 62000, 100, 620, 75)],
+                                     "center", "facing the viewer", [500, 100, 700, 900])
+
+    def test_scale_and_footprint(self):
+        """Test the scale is relative to the old asset and the footprint follows its bounding box."""
+        instruction = scale_instruction(AssetDimensions("sofa", None, 90, 310, 75), self.analysis, "sofa", (1000, 500))
+
+        self.assertEqual(instruction, "Scale: the new sofa is 0.50x as wide, 0.90x as deep, 1.00x as high as the old sectional sofa. "
+                                      "Footprint: about 40% of the image width and 20% of its height (400x100 px of 1000x500).")
+
+    def test_unknown_old_asset(self):
+        """Test no instruction is made when the room has no asset of that type."""
+        self.assertEqual(scale_instruction(AssetDimensions("bed", None, 200, 180, 100), self.analysis, "bed"), "")
+
+    def test_unparsable_text_is_kept(self):
+        """Test a text without dimensions is passed to the prompt unchanged."""
+        self.assertEqual(asset_dimensions_prompt("a large blue sofa", self.analysis, "sofa"), "a large blue sofa")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from benchmarks.fake_gemini import FakeGeminiServer, FakeGeminiSettings
+from src.batch_renderer import BatchRenderer, RenderJob
+from src.config import Configuration
+from src.exceptions import LlmUnavailableError
+from src.llm_client import LlmClient
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa")
+
+
+class FakeGeminiTestCase(unittest.TestCase):
+    """Runs the real LlmClient and BatchRenderer against the local fake Gemini server."""
+
+    def setUp(self):
+        self.settings = FakeGeminiSettings(latency_seconds=0, batch_seconds=0, image_size=(64, 48), seed=1)
+        self.server = FakeGeminiServer(self.settings, [Configuration.llm_model_name_image_processing]).start()
+        self.addCleanup(self.server.stop)
+
+        self.output = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output.cleanup)
+        self.config = Configuration(RESOURCES_PATH)
+        self.config.llm_api_key = "fake"
+        self.config.llm_base_url = self.server.base_url
+        self.config.output_path = self.output.name
+        self.config.batch_poll_interval_seconds = 0
+        self.room = Image.open(self.config.get_room_image_path("room.jpg"))
+
+
+    def client(self):
+        return LlmClient(self.config, ResilientCaller(RetryPolicy(2, 0, 0), RetryBudget(1, 10, 10), 5, 30, sleep=lambda _: None), rate_scheduler=RateScheduler({}))
+
+
+    def test_generate_content(self):
+        """The analysis is parsed from JSON, the removal returns an image and the room is uploaded once."""
+        client = self.client()
+
+        analysis = client.analyze_room(self.room, "sofa")
+        image = client.remove_asset_from_image(self.room, "sofa")
+
+        self.assertEqual("sofa", analysis.assets[0].name)
+        self.assertEqual(4, len(analysis.bounding_box))
+        self.assertEqual((64, 48), image.size)
+        self.assertEqual(2, self.server.counters["generate_content"])
+        # the room is smaller than the upload size of both models, so both requests reference the same file
+        self.assertEqual(1, self.server.counters["uploads"])
+
+
+    def test_errors_are_retried(self):
+        """When every request fails the client gives up with LlmUnavailableError after retrying."""
+        self.settings.error_rate = 1.0
+
+        with self.assertRaises(LlmUnavailableError):
+            self.client().get_asset_dimensions(self.room)
+        self.assertEqual(2, self.server.counters["errors"])
+
+
+    def test_batch(self):
+        """A batch render runs the analysis, removal and combine batches and saves the image."""
+        results = BatchRenderer(self.config).render([RenderJob("room.jpg", "asset.png", "220x90x80")])
+
+        self.assertEqual("succeeded", results[0]["status"])
+        self.assertTrue(os.path.exists(os.path.join(self.output.name, results[0]["output"])))
+        self.assertEqual(3, self.server.counters["batches"])
+
+
+if __name__ == '__main__':
+    unittest.main()
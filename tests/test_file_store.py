@@ -0,0 +1,115 @@
+import datetime
+import os
+import unittest
+from unittest.mock import Mock
+
+from google.genai import errors, types
+from PIL import Image
+
+from src.config import Configuration
+from src.file_store import UploadedFileStore
+from src.image_preparation import ImagePreparer
+from src.llm_client import LlmClient
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa")
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.files = Mock()
+        self.files.upload.side_effect = self._upload
+        self.expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=48)
+
+    def _upload(self, file, config):
+        return types.File(uri=f"https://files/{self.files.upload.call_count}", mime_type=config.mime_type, expiration_time=self.expiration)
+
+    def test_same_content_is_uploaded_once(self):
+        """Test an image is uploaded once and referenced by URI after that."""
+        store = UploadedFileStore(self.files)
+
+        first = store.part_for(b"room", "image/jpeg")
+        second = store.part_for(b"room", "image/jpeg")
+        other = store.part_for(b"asset", "image/jpeg")
+
+        self.assertEqual(first.file_data.file_uri, "https://files/1")
+        self.assertEqual(second.file_data.file_uri, "https://files/1")
+        self.assertEqual(other.file_data.file_uri, "https://files/2")
+        self.assertEqual((store.uploads, store.reuses), (2, 1))
+
+    def test_expired_file_is_uploaded_again(self):
+        """Test a file that (almost) expired is uploaded again."""
+        store = UploadedFileStore(self.files, expiry_margin_seconds=300)
+        self.expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+
+        store.part_for(b"room", "image/jpeg")
+        part = store.part_for(b"room", "image/jpeg")
+
+        self.assertEqual(part.file_data.file_uri, "https://files/2")
+
+    def test_number_of_files_is_bounded(self):
+        """Test only the most recently used references are kept and expired ones are dropped."""
+        store = UploadedFileStore(self.files, max_files=2)
+
+        store.part_for(b"room", "image/jpeg")
+        store.part_for(b"asset", "image/jpeg")
+        store.part_for(b"room", "image/jpeg")
+        store.part_for(b"plant", "image/jpeg")
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.part_for(b"room", "image/jpeg").file_data.file_uri, "https://files/1")
+        self.assertEqual(store.part_for(b"asset", "image/jpeg").file_data.file_uri, "https://files/4")
+
+        self.expiration = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+        store = UploadedFileStore(self.files, max_files=10)
+        store.part_for(b"room", "image/jpeg")
+        store.part_for(b"asset", "image/jpeg")
+        self.assertEqual(len(store), 0)
+
+    def test_missing_file_is_uploaded_again(self):
+        """Test a request that references a file the server deleted is sent once more with the image uploaded again."""
+        ImagePreparer._memo.clear()
+        config = Configuration(RESOURCES_PATH)
+        config.llm_api_key = "fake"
+        config.llm_use_files_api = True
+        client = LlmClient(config, ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30), rate_scheduler=RateScheduler({}))
+        client.image_preparer.file_store = UploadedFileStore(self.files)
+        sent = []
+
+        def generate_content(model, contents, config):
+            sent.append(contents[1].file_data.file_uri)
+            if len(sent) == 1:
+                raise errors.ClientError(403, {"error": {"code": 403, "message": "You do not have permission to access the File", "status": "PERMISSION_DENIED"}})
+            return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="ok")]))])
+
+        client.client.models.generate_content = generate_content
+
+        response = client._request("dimensions", "model", ["prompt", Image.new('RGB', (10, 10))], None)
+
+        self.assertEqual(response.text, "ok")
+        self.assertEqual(sent, ["https://files/1", "https://files/2"])
+
+    def test_other_client_errors_are_not_sent_again(self):
+        """Test a bad request that isn't about a missing file is raised without uploading again."""
+        preparer = ImagePreparer({}, default_max_size=100, file_store=UploadedFileStore(self.files))
+        prepared = preparer.prepare_contents("model", ["prompt", Image.new('RGB', (10, 10))])
+
+        self.assertFalse(preparer.forget_missing_files(errors.ClientError(400, {"error": {"code": 400, "message": "bad request"}}), prepared))
+        self.assertFalse(preparer.forget_missing_files(errors.ClientError(404, {"error": {"code": 404, "message": "not found"}}), ["prompt"]))
+        self.assertTrue(preparer.forget_missing_files(errors.ClientError(404, {"error": {"code": 404, "message": "not found"}}), prepared))
+
+    def test_preparer_references_uploaded_files(self):
+        """Test the image preparer hands out file references when it has a file store."""
+        ImagePreparer._memo.clear()
+        preparer = ImagePreparer({}, default_max_size=100, file_store=UploadedFileStore(self.files))
+
+        contents = preparer.prepare_contents("model", ["prompt", Image.new('RGB', (10, 10)), Image.new('RGB', (10, 10))])
+
+        self.assertEqual(contents[1].file_data.file_uri, contents[2].file_data.file_uri)
+        self.assertEqual(contents[1].file_data.mime_type, "image/jpeg")
+        self.files.upload.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
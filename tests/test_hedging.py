@@ -0,0 +1,182 @@
+import io
+import os
+import threading
+import time
+import unittest
+
+from google.genai import types
+from PIL import Image
+
+from src.config import Configuration
+from src.exceptions import HedgeCancelledError
+from src.hedging import Hedger, LatencyWindow
+from src.llm_client import LlmClient
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa")
+
+
+def _hedger(budget=None):
+    hedger = Hedger(["combine"], percentile=90, window=10, min_samples=3, min_delay_seconds=0.05, budget=budget or RetryBudget(1, 1, 10))
+    for _ in range(3):
+        hedger.call("combine", "pro", "fallback", lambda model, fallback, cancelled: "fast")
+    return hedger
+
+
+class LatencyWindowTestCase(unittest.TestCase):
+
+    def test_percentile_of_recent_latencies(self):
+        """Test the percentile needs the minimum number of samples and only uses the last [size] latencies."""
+        window = LatencyWindow(10)
+        for seconds in range(1, 4):
+            window.record(seconds)
+        self.assertIsNone(window.percentile(50, min_samples=4))
+
+        for seconds in range(4, 21):
+            window.record(seconds)
+        self.assertEqual(len(window), 10)
+        self.assertEqual(window.percentile(50), 16)
+        self.assertEqual(window.percentile(100), 20)
+
+
+class HedgerTestCase(unittest.TestCase):
+
+    def test_slow_request_is_hedged_to_the_alternate_model(self):
+        """Test a request slower than the percentile is sent to the fallback model, which wins and cancels the primary."""
+        hedger = _hedger()
+        events = {}
+
+        def request(model, fallback, cancelled):
+            events[model] = cancelled
+            if model == "pro":
+                time.sleep(0.5)
+                return "pro"
+            return "fallback"
+
+        self.assertEqual(hedger.call("combine", "pro", "fallback", request), "fallback")
+        self.assertTrue(events["pro"].is_set())
+        self.assertFalse(events["fallback"].is_set())
+        self.assertEqual({name: hedger.counters[name] for name in ("hedged", "hedges_won")}, {"hedged": 1, "hedges_won": 1})
+
+    def test_fast_primary_wins(self):
+        """Test the hedge is cancelled when the primary request returns first."""
+        hedger = _hedger()
+        hedge_cancelled = []
+
+        def request(model, fallback, cancelled):
+            if model == "pro":
+                time.sleep(0.15)
+                return "pro"
+            hedge_cancelled.append(cancelled)
+            time.sleep(0.5)
+            return "fallback"
+
+        self.assertEqual(hedger.call("combine", "pro", "fallback", request), "pro")
+        self.assertTrue(hedge_cancelled[0].is_set())
+        self.assertEqual(hedger.counters["hedges_won"], 0)
+
+    def test_hedge_budget_caps_the_hedges(self):
+        """Test no hedge is sent when the budget is exhausted, the primary request is awaited."""
+        hedger = _hedger(budget=RetryBudget(0, 0, 0))
+        models = []
+
+        def request(model, fallback, cancelled):
+            models.append(model)
+            time.sleep(0.2)
+            return model
+
+        self.assertEqual(hedger.call("combine", "pro", "fallback", request), "pro")
+        self.assertEqual(models, ["pro"])
+        self.assertEqual(hedger.counters["budget_exhausted"], 1)
+
+    def test_both_requests_fail(self):
+        """Test the error of the primary request is raised when the hedge fails as well."""
+        hedger = _hedger()
+
+        def request(model, fallback, cancelled):
+            time.sleep(0.2 if model == "pro" else 0)
+            raise RuntimeError(f"{model} failed")
+
+        with self.assertRaisesRegex(RuntimeError, "pro failed"):
+            hedger.call("combine", "pro", "fallback", request)
+
+    def test_other_stages_are_not_hedged(self):
+        """Test a request of a stage that isn't hedged runs in the calling thread without a latency window."""
+        hedger = _hedger()
+        threads = []
+        hedger.call("analysis", "pro", "fallback", lambda model, fallback, cancelled: threads.append(threading.current_thread()))
+
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertIsNone(hedger.delay("analysis", "pro"))
+
+
+class HedgedLlmClientTestCase(unittest.TestCase):
+
+    def test_combine_images_is_hedged(self):
+        """Test a slow combine request to the image model is answered by the hedge to the fallback model."""
+        config = Configuration(RESOURCES_PATH)
+        config.llm_api_key = "fake"
+        config.llm_use_files_api = False
+        hedger = _hedger()
+        client = LlmClient(config, ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30), rate_scheduler=RateScheduler({}), hedger=hedger)
+        for _ in range(3):
+            hedger._window("combine", config.llm_model_name_image_processing).record(0.01)
+        sent = []
+
+        def generate_content(model, contents, config):
+            sent.append(model)
+            buffer = io.BytesIO()
+            Image.new("RGB", (8, 8), color="green" if model == client.config.llm_model_name_image_processing_fallback else "red").save(buffer, format="PNG")
+            if model == client.config.llm_model_name_image_processing:
+                time.sleep(0.5)
+            part = types.Part.from_bytes(data=buffer.getvalue(), mime_type="image/png")
+            return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))])
+
+        client.client.models.generate_content = generate_content
+        room = Image.new("RGB", (8, 8))
+
+        image = client.combine_images(room, room, "sofa: 200x90x80 cm", "width=180", "center")
+
+        self.assertEqual(image.getpixel((0, 0)), (0, 128, 0))
+        self.assertEqual(sent, [config.llm_model_name_image_processing, config.llm_model_name_image_processing_fallback])
+
+    def test_cancelled_request_is_not_sent(self):
+        """Test a hedged request that lost before it was sent raises HedgeCancelledError instead of sending it."""
+        config = Configuration(RESOURCES_PATH)
+        config.llm_api_key = "fake"
+        config.llm_use_files_api = False
+        client = LlmClient(config, ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30), rate_scheduler=RateScheduler({}))
+        cancelled = threading.Event()
+        cancelled.set()
+
+        with self.assertRaises(HedgeCancelledError):
+            client._request("combine", "model", ["prompt"], None, cancelled=cancelled)
+
+    def test_request_cancelled_while_waiting_for_the_quota_gives_it_back(self):
+        """Test a hedged request that lost while it waited in the rate scheduler gives back its quota and isn't sent."""
+        config = Configuration(RESOURCES_PATH)
+        config.llm_api_key = "fake"
+        config.llm_use_files_api = False
+        config.llm_rate_count_tokens = False
+        rate_scheduler = RateScheduler({"model": {"rpm": 10, "tpm": 10000}}, headroom=1)
+        client = LlmClient(config, ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30), rate_scheduler=rate_scheduler)
+        cancelled = threading.Event()
+        acquire = rate_scheduler.acquire
+
+        def acquire_and_lose(model, tokens, lane):
+            acquire(model, tokens, lane)
+            cancelled.set()
+
+        rate_scheduler.acquire = acquire_and_lose
+        client.client.models.generate_content = lambda **kwargs: self.fail("the cancelled request was sent")
+
+        with self.assertRaises(HedgeCancelledError):
+            client._request("combine", "model", ["prompt"], None, cancelled=cancelled)
+        rpm, tpm = rate_scheduler.buckets["model"]
+        self.assertAlmostEqual(rpm.level, 10)
+        self.assertAlmostEqual(tpm.level, 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
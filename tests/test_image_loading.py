@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from PIL import Image
+
+from src.image_loading import ImageLoader, ImageMemoryBudget, image_bytes, load_image
+
+
+class LoadImageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.jpeg = os.path.join(self.test_dir, "room.jpg")
+        Image.new("RGB", (4000, 3000), color="white").save(self.jpeg)
+        self.png = os.path.join(self.test_dir, "asset.png")
+        Image.new("RGBA", (3000, 1000), color="red").save(self.png)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_jpeg_is_decoded_at_reduced_scale(self):
+        """Test a JPEG is decoded at the smallest scale that is still at least the maximum size."""
+        image = load_image(self.jpeg, max_size=900)
+
+        self.assertEqual(image.size, (1000, 750))
+        self.assertEqual(load_image(self.jpeg, max_size=2048).size, (4000, 3000))
+        self.assertEqual(load_image(self.jpeg).size, (4000, 3000))
+
+    def test_other_formats_are_reduced(self):
+        """Test an image that can't be drafted is reduced by an integer factor after decoding."""
+        self.assertEqual(load_image(self.png, max_size=1000).size, (1000, 334))
+        self.assertEqual(load_image(self.png, max_size=1600).size, (3000, 1000))
+
+    def test_missing_image(self):
+        """Test a missing image raises FileNotFoundError."""
+        with self.assertRaises(FileNotFoundError):
+            load_image(os.path.join(self.test_dir, "missing.jpg"), "Room")
+
+    def test_loader_releases_the_images_on_exit(self):
+        """Test the decoded size of the images is reserved while loaded, and the images are closed on exit."""
+        budget = ImageMemoryBudget(100 * 1024 * 1024)
+        loader = ImageLoader(max_size=900, budget=budget)
+
+        with loader.load((self.jpeg, "Room"), (self.png, "Asset")) as (room, asset):
+            self.assertEqual(budget.in_use, image_bytes((1000, 750), "RGB") + image_bytes((1000, 334), "RGBA"))
+            self.assertEqual(room.getpixel((0, 0)), (255, 255, 255))
+
+        self.assertEqual(budget.in_use, 0)
+        with self.assertRaises(ValueError):
+            room.getpixel((0, 0))
+
+    def test_full_resolution(self):
+        """Test images are not reduced with full_resolution."""
+        with ImageLoader(max_size=900).load((self.jpeg, "Room"), full_resolution=True) as (room,):
+            self.assertEqual(room.size, (4000, 3000))
+
+
+class ImageMemoryBudgetTestCase(unittest.TestCase):
+
+    def test_render_waits_for_room_in_the_budget(self):
+        """Test a request waits until the bytes in use are released, and a request above the budget runs alone."""
+        budget = ImageMemoryBudget(100)
+        budget.acquire(60)
+        acquired = threading.Event()
+
+        def acquire():
+            budget.acquire(60)
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        time.sleep(0.1)
+        self.assertFalse(acquired.is_set())
+        budget.release(60)
+        thread.join(timeout=2)
+
+        self.assertTrue(acquired.is_set())
+        budget.release(60)
+        budget.acquire(500)
+        self.assertEqual((budget.in_use, budget.peak), (500, 500))
+
+
+if __name__ == '__main__':
+    unittest.main()
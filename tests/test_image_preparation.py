@@ -0,0 +1,55 @@
+import io
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+from src.image_preparation import ImagePreparer
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        ImagePreparer._memo.clear()
+        self.preparer = ImagePreparer({"small-model": 100}, default_max_size=400, image_format="JPEG", quality=80)
+
+    def test_image_is_downsized_per_model(self):
+        """Test the image is downsized to the maximum size of the model, keeping the aspect ratio."""
+        image = Image.new('RGB', (800, 400), color='red')
+
+        small = Image.open(io.BytesIO(self.preparer.encode(image, "small-model")))
+        default = Image.open(io.BytesIO(self.preparer.encode(image, "other-model")))
+
+        self.assertEqual(small.format, "JPEG")
+        self.assertEqual(small.size, (100, 50))
+        self.assertEqual(default.size, (400, 200))
+
+    def test_transparent_image_is_flattened_for_jpeg(self):
+        """Test an image with transparency is put on a white background before encoding to JPEG."""
+        image = Image.new('RGBA', (10, 10), color=(0, 0, 0, 0))
+
+        encoded = Image.open(io.BytesIO(self.preparer.encode(image, "small-model")))
+
+        self.assertEqual(encoded.mode, "RGB")
+        self.assertGreater(min(encoded.getpixel((5, 5))), 250)
+
+    def test_same_image_is_encoded_once(self):
+        """Test the encoded bytes are memoized by image content, also for another preparer."""
+        other_preparer = ImagePreparer({"small-model": 100}, default_max_size=400, image_format="JPEG", quality=80)
+        with patch.object(ImagePreparer, "_encode", wraps=self.preparer._encode) as encode:
+            self.preparer.encode(Image.new('RGB', (50, 50), color='blue'), "small-model")
+            other_preparer.encode(Image.new('RGB', (50, 50), color='blue'), "small-model")
+            self.preparer.encode(Image.new('RGB', (50, 50), color='blue'), "other-model")
+
+        self.assertEqual(encode.call_count, 2)
+
+    def test_prepare_contents_only_replaces_images(self):
+        """Test text stays text and images become inline parts with the right mime type."""
+        contents = self.preparer.prepare_contents("small-model", ["prompt", Image.new('RGB', (10, 10))])
+
+        self.assertEqual(contents[0], "prompt")
+        self.assertEqual(contents[1].inline_data.mime_type, "image/jpeg")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,14 @@
+import asyncio
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import CancelledError
+from unittest.mock import Mock
+
+from PIL import Image
 
 # Load environment variables from gemini.env
 # IMPORTANT: make sure this is done before importing any module that relies on these environment variables (like Configuration or LlmClient)
@@ -8,14 +17,22 @@ load_dotenv(find_dotenv('gemini.env'))
 ############
 
 from src.config import Configuration
-from src.image_processor import ImageProcessor
+from src.image_processor import AsyncImageProcessor, ImageProcessor
+from src.metrics import HistogramSink, Metrics
+from src.pipeline_events import AnalysisReady, CleanedRoomReady, CompositeReady
+from src.room_analysis import AssetDimensions, RoomAnalysis
 from src.llm_client import LlmClient
+from src.transport import REPLAY
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
 
 
 class MyTestCase(unittest.TestCase):
     def test_image_processing(self):
-        # init
-        config = Configuration("test-1")
+        # init, the responses are replayed from tests/cassettes unless LLM_TRANSPORT_MODE is set (e.g. to record)
+        config = Configuration(os.path.join(RESOURCES_PATH, "test-sofa"))
+        config.llm_transport_mode = os.getenv("LLM_TRANSPORT_MODE", REPLAY)
+        os.makedirs(config.output_path, exist_ok=True)
         client = LlmClient(config)
         processor = ImageProcessor(config, client)
 
@@ -32,11 +49,11 @@ class MyTestCase(unittest.TestCase):
         """
 
 
+        output_path = os.path.join(config.output_path, 'room-with-new-asset.png')
+
         # cleanup old image
-        if os.path.exists(f'{config.output_path}\\room-without-asset.png'):
-            os.remove(f'{config.output_path}\\room-without-asset.png')
-        if os.path.exists(f'{config.output_path}\\room-with-new-asset.png'):
-            os.remove(f'{config.output_path}\\room-with-new-asset.png')
+        if os.path.exists(output_path):
+            os.remove(output_path)
 
         # call processor to insert the new asset into room
         room_with_new_asset = processor.insert_asset_into_room("asset.png", "room.jpg", asset_dimensions)
@@ -45,8 +62,291 @@ class MyTestCase(unittest.TestCase):
         assert room_with_new_asset is not None
 
         # save image for manual inspection
-        room_with_new_asset.save(f'{config.output_path}\\room-with-new-asset.png')
-        self.assertTrue(os.path.exists(f'{config.output_path}\\room-with-new-asset.png'))
+        room_with_new_asset.save(output_path)
+        self.assertTrue(os.path.exists(output_path))
+
+
+class ConcurrentStagesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a room and asset image and a mock configuration pointing to them."""
+        self.test_dir = tempfile.mkdtemp()
+        Image.new('RGB', (100, 80), color='white').save(os.path.join(self.test_dir, "room.jpg"))
+        Image.new('RGB', (20, 10), color='blue').save(os.path.join(self.test_dir, "asset.png"))
+
+        self.config = Mock()
+        self.config.pipeline_max_workers = 3
+        self.config.pipeline_region_compositing = False
+        self.config.pipeline_candidates = 1
+        self.config.image_draft_decoding = False
+        self.config.image_memory_budget_bytes = None
+        self.config.pipeline_local_scale = False
+        self.config.get_room_image_path.side_effect = lambda name: os.path.join(self.test_dir, name)
+        self.config.get_asset_image_path.side_effect = lambda name: os.path.join(self.test_dir, name)
+
+        # both analysis stages wait until the other one is running, which only succeeds when they run concurrently
+        self.barrier = threading.Barrier(2, timeout=2)
+        self.client = Mock()
+        self.analysis = RoomAnalysis([AssetDimensions("sofa", 20000, 100, 200, 80)], "center", "facing the viewer", [400, 100, 800, 900])
+        self.client.analyze_room.side_effect = lambda room, name: self._after_barrier(self.analysis)
+        self.client.remove_asset_from_image.side_effect = lambda room, name: self._after_barrier(Image.new('RGB', (100, 80)))
+        self.client.combine_images.return_value = Image.new('RGB', (100, 80), color='green')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _after_barrier(self, result):
+        self.barrier.wait()
+        return result
+
+    def test_concurrent_stages_feed_combine(self):
+        """Test the analysis and removal stages run at the same time and their results are passed to combine_images."""
+        processor = ImageProcessor(self.config, self.client)
+
+        result = processor.insert_asset_into_room("asset.png", "room.jpg", "width=180", asset_name="bed", concurrent=True)
+
+        self.assertEqual(result.getpixel((0, 0)), (0, 128, 0))
+        args = self.client.combine_images.call_args[0]
+        self.assertEqual(args[2], "sofa: 200x100x80 cm (w x d x h)")
+        self.assertEqual(args[3], "width=180")
+        self.assertEqual(args[4], "location: center\norientation: facing the viewer")
+        self.client.remove_asset_from_image.assert_called_once()
+        self.assertEqual(self.client.remove_asset_from_image.call_args[0][1], "bed")
+        self.assertEqual(set(processor.last_stage_timings), {"analysis", "remove_asset", "combine", "total"})
+
+    def test_local_scale_in_the_combine_prompt(self):
+        """Test the asset dimensions are replaced by compact dimensions and the scale computed from the analysis."""
+        self.config.pipeline_local_scale = True
+        processor = ImageProcessor(self.config, self.client)
+
+        processor.insert_asset_into_room("asset.png", "room.jpg", "Breedte=100 cm\nHoogte=40 cm", concurrent=True)
+
+        self.assertEqual(self.client.combine_images.call_args[0][3],
+                         "sofa: 100x?x40 cm (w x d x h)\n"
+                         "Scale: the new sofa is 0.50x as wide, 0.50x as high as the old sofa. "
+                         "Footprint: about 40% of the image width and 20% of its height (40x16 px of 100x80).")
+
+    def test_stages_are_reported_to_the_metrics(self):
+        """Test every stage is reported as a stage event, a failing stage with outcome error."""
+        sink = HistogramSink()
+        self.client.analyze_room.side_effect = lambda room, name: self.analysis
+        self.client.remove_asset_from_image.side_effect = lambda room, name: Image.new('RGB', (100, 80))
+        processor = ImageProcessor(self.config, self.client, metrics=Metrics([sink]))
+
+        processor.insert_asset_into_room("asset.png", "room.jpg", "width=180")
+        self.client.combine_images.side_effect = RuntimeError("combine failed")
+        with self.assertRaises(RuntimeError):
+            processor.insert_asset_into_room("asset.png", "room.jpg", "width=180")
+
+        outcomes = {entry["name"]: entry["outcomes"] for entry in sink.summary()}
+        self.assertEqual(outcomes, {"analysis": {"ok": 2}, "remove_asset": {"ok": 2}, "combine": {"ok": 1, "error": 1}, "total": {"ok": 1}})
+
+    def test_region_compositing(self):
+        """Test only the region around the asset is sent to the model and pasted back into the full room."""
+        self.client.analyze_room.side_effect = lambda room, name: self.analysis
+        self.client.remove_asset_from_image.side_effect = lambda room, name: room
+        self.config.pipeline_region_padding = 0
+        self.config.pipeline_region_min_size = 0
+        self.config.pipeline_region_feather = 0
+        processor = ImageProcessor(self.config, self.client)
+
+        result = processor.insert_asset_into_room("asset.png", "room.jpg", "width=180", region=True)
+
+        # bounding box [400, 100, 800, 900] of a 100x80 room
+        self.assertEqual(self.client.remove_asset_from_image.call_args[0][0].size, (80, 32))
+        self.assertEqual(result.size, (100, 80))
+        self.assertEqual(result.getpixel((50, 50)), (0, 128, 0))
+        self.assertEqual(result.getpixel((5, 5)), (255, 255, 255))
+        self.assertIn("paste", processor.last_stage_timings)
+
+    def test_best_candidate_is_kept(self):
+        """Test the candidate that keeps the rest of the room intact is kept and a stage below the threshold is retried."""
+        self.config.pipeline_candidate_mode = "parallel"
+        self.config.pipeline_candidate_threshold = 0.9
+        self.config.pipeline_candidate_retries = 1
+        self.config.pipeline_region_padding = 0
+        self.config.pipeline_candidate_weights = {"background": 1, "size": 0, "colour": 0}
+        self.client.analyze_room.side_effect = lambda room, name: self.analysis
+        white, black = Image.new('RGB', (100, 80), color='white'), Image.new('RGB', (100, 80), color='black')
+        placed = white.copy()
+        placed.paste((0, 128, 0), (30, 40, 70, 60))
+        self.client.remove_asset_candidates.side_effect = lambda room, name, seed: [white if seed == 1 else black]
+        # the first attempt only returns bad candidates, the second attempt has seeds 2 and 3
+        self.client.combine_image_candidates.side_effect = lambda *args, seed, asset_name: [placed if seed == 3 else black]
+        processor = ImageProcessor(self.config, self.client)
+
+        result = processor.insert_asset_into_room("asset.png", "room.jpg", "width=180", candidates=2)
+
+        self.assertIs(result, placed)
+        self.assertEqual(self.client.remove_asset_candidates.call_count, 2)
+        self.assertEqual(self.client.combine_image_candidates.call_count, 4)
+        self.assertIs(self.client.combine_image_candidates.call_args_list[0][0][0], white)
+        self.assertGreaterEqual(processor.last_candidate_scores["combine"].total, 0.9)
+        self.client.remove_asset_from_image.assert_not_called()
+
+    def test_concurrent_stage_failure_is_raised(self):
+        """Test the first failing stage is raised and combine_images is never called."""
+        self.client.analyze_room.side_effect = RuntimeError("analysis failed")
+        self.client.remove_asset_from_image.side_effect = lambda room, name: time.sleep(0.2) or Image.new('RGB', (100, 80))
+        processor = ImageProcessor(self.config, self.client)
+
+        with self.assertRaises(RuntimeError):
+            processor.insert_asset_into_room("asset.png", "room.jpg", "width=180", concurrent=True)
+        self.client.combine_images.assert_not_called()
+
+    def test_many_assets_share_the_room_analysis(self):
+        """Test the room is analysed and cleaned once and the results are yielded in order of completion."""
+        Image.new('RGB', (20, 10), color='red').save(os.path.join(self.test_dir, "slow-asset.png"))
+        self.client.combine_images.side_effect = lambda room, asset, *args, **kwargs: time.sleep(0.3 if asset.getpixel((0, 0)) == (255, 0, 0) else 0) or asset
+        processor = ImageProcessor(self.config, self.client)
+
+        results = list(processor.insert_assets_into_room("room.jpg", [("slow-asset.png", "width=200"), ("asset.png", "width=180")], max_parallel=2))
+
+        self.assertEqual([result.asset_file_name for result in results], ["asset.png", "slow-asset.png"])
+        self.assertTrue(all(result.error is None for result in results))
+        self.client.analyze_room.assert_called_once()
+        self.client.remove_asset_from_image.assert_called_once()
+        self.assertEqual(self.client.combine_images.call_count, 2)
+
+    def test_failing_asset_does_not_stop_the_others(self):
+        """Test a failing combine is reported for that asset only."""
+        self.client.combine_images.side_effect = [RuntimeError("combine failed"), Image.new('RGB', (100, 80))]
+        processor = ImageProcessor(self.config, self.client)
+
+        results = list(processor.insert_assets_into_room("room.jpg", [("asset.png", "width=200"), ("asset.png", "width=180")], max_parallel=1))
+
+        self.assertIsInstance(results[0].error, RuntimeError)
+        self.assertIsNotNone(results[1].image)
+
+    def test_stream_yields_an_event_per_stage(self):
+        """Test the cleaned room is yielded before the slower analysis, followed by the composite."""
+        self.client.analyze_room.side_effect = lambda room, name: time.sleep(0.2) or self.analysis
+        self.client.remove_asset_from_image.side_effect = lambda room, name: Image.new('RGB', (100, 80))
+        processor = ImageProcessor(self.config, self.client)
+
+        events = list(processor.stream_insert_asset_into_room("asset.png", "room.jpg", "width=180"))
+
+        self.assertEqual([type(event) for event in events], [CleanedRoomReady, AnalysisReady, CompositeReady])
+        self.assertEqual(events[1].analysis, self.analysis)
+        self.assertEqual(events[2].image.getpixel((0, 0)), (0, 128, 0))
+        self.assertLessEqual(events[0].elapsed, events[1].elapsed)
+
+    def test_progressive_render_replaces_the_preview(self):
+        """Test the preview of the fast model is ready first and the final render of the pro model replaces it."""
+        sink = HistogramSink()
+        release_final = threading.Event()
+        self.config.llm_model_name_preview = "flash"
+        self.client.analyze_room.side_effect = lambda room, name: self.analysis
+        self.client.remove_asset_from_image.side_effect = lambda room, name, model: (model == "flash" or release_final.wait(2)) and Image.new('RGB', (100, 80))
+        self.client.combine_images.side_effect = lambda *args, model, asset_name: Image.new('RGB', (100, 80), color='yellow' if model == "flash" else 'green')
+        processor = ImageProcessor(self.config, self.client, metrics=Metrics([sink]))
+
+        render = processor.progressive_insert_asset_into_room("asset.png", "room.jpg", "width=180")
+
+        self.assertEqual(render.preview(timeout=2).getpixel((0, 0)), (255, 255, 0))
+        self.assertFalse(render.done())
+        self.assertEqual(render.current().getpixel((0, 0)), (255, 255, 0))
+        release_final.set()
+        self.assertEqual(render.result(timeout=2).getpixel((0, 0)), (0, 128, 0))
+        self.assertEqual(render.current().getpixel((0, 0)), (0, 128, 0))
+        self.client.analyze_room.assert_called_once()
+        self.assertLess(render.seconds["preview"], render.seconds["final"])
+        outcomes = {entry["name"]: entry["outcomes"] for entry in sink.summary()}
+        self.assertEqual(outcomes["time_to_preview"], {"ok": 1})
+        self.assertEqual(outcomes["time_to_final"], {"ok": 1})
+
+    def test_renders_in_parallel_share_one_stage_pool(self):
+        """Test threads that start at the same time get the same thread pool, which reserve_workers can grow."""
+        processor = ImageProcessor(self.config, self.client)
+        start = threading.Barrier(8)
+        executors = []
+
+        def get_executor():
+            start.wait()
+            executors.append(processor._get_executor())
+
+        threads = [threading.Thread(target=get_executor) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(executor) for executor in executors}), 1)
+
+        processor.reserve_workers(self.config.pipeline_max_workers * 4)
+        self.assertEqual(processor._get_executor()._max_workers, self.config.pipeline_max_workers * 4)
+        processor._executor.shutdown(wait=True)
+
+    def test_cancelled_progressive_render_skips_the_pro_requests(self):
+        """Test the pro combine request is never sent when the render is cancelled while the pro removal runs."""
+        release_final = threading.Event()
+        self.config.llm_model_name_preview = "flash"
+        self.client.analyze_room.side_effect = lambda room, name: self.analysis
+        self.client.remove_asset_from_image.side_effect = lambda room, name, model: (model == "flash" or release_final.wait(2)) and Image.new('RGB', (100, 80))
+        self.client.combine_images.side_effect = lambda *args, model, asset_name: Image.new('RGB', (100, 80))
+        processor = ImageProcessor(self.config, self.client)
+
+        render = processor.progressive_insert_asset_into_room("asset.png", "room.jpg", "width=180")
+        render.preview(timeout=2)
+        self.assertTrue(render.cancel())
+        release_final.set()
+        processor._executor.shutdown(wait=True)
+
+        self.assertTrue(render.cancelled())
+        with self.assertRaises(CancelledError):
+            render.result()
+        self.assertEqual([call.kwargs["model"] for call in self.client.combine_images.call_args_list], ["flash"])
+        self.assertIsNotNone(render.current())
+
+    def test_async_stream_yields_an_event_per_stage(self):
+        """Test the async stream yields the same events in order of completion."""
+        async def analyze_room(room, name):
+            await asyncio.sleep(0.05)
+            return self.analysis
+
+        async def remove_asset_from_image(room, name):
+            return Image.new('RGB', (100, 80))
+
+        async def combine_images(*args, **kwargs):
+            return Image.new('RGB', (100, 80), color='green')
+
+        client = Mock()
+        client.analyze_room.side_effect = analyze_room
+        client.remove_asset_from_image.side_effect = remove_asset_from_image
+        client.combine_images.side_effect = combine_images
+        processor = AsyncImageProcessor(self.config, client)
+
+        async def collect():
+            return [event async for event in processor.stream_insert_asset_into_room("asset.png", "room.jpg", "width=180")]
+
+        events = asyncio.run(collect())
+        self.assertEqual([type(event) for event in events], [CleanedRoomReady, AnalysisReady, CompositeReady])
+
+    def test_async_processor_cancels_stages_on_failure(self):
+        """Test the async pipeline raises the failing stage and cancels the stages still running."""
+        cancelled = []
+
+        async def slow_stage(*args):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def failing_stage(*args):
+            raise RuntimeError("analysis failed")
+
+        client = Mock()
+        client.analyze_room.side_effect = failing_stage
+        client.remove_asset_from_image.side_effect = slow_stage
+        processor = AsyncImageProcessor(self.config, client)
+
+        async def render():
+            await processor.insert_asset_into_room("asset.png", "room.jpg", "width=180")
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(render())
+        self.assertEqual(len(cancelled), 1)
+        client.combine_images.assert_not_called()
 
 
 if __name__ == '__main__':
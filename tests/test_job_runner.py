@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from src.batch_renderer import RenderJob
+from src.config import Configuration
+from src.job_runner import JOURNAL_FILE_NAME, RenderJournal, create_processor, discover_jobs, job_id, run_jobs
+
+
+class FakeProcessor:
+    """Renders a green image, or fails for the rooms in [failing]. Picklable, so it can be used in worker processes."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+        self.last_stage_timings = {}
+
+    def __call__(self):
+        return self
+
+    def insert_asset_into_room(self, asset_file_name, room_file_name, asset_dimensions, asset_name="sofa"):
+        self.calls.append(room_file_name)
+        if room_file_name in self.failing:
+            raise ValueError("no image returned")
+        self.last_stage_timings = {"analysis": 0.1, "total": 0.2}
+        return Image.new("RGB", (20, 10), color="green")
+
+
+class JobRunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.test_dir, "output")
+        self.jobs = [RenderJob(f"room-{index}.jpg", "asset.png", "width=180") for index in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_discover_jobs_in_a_tree(self):
+        """Test every directory with a room and an asset image is a job, with the dimensions of dimensions.txt."""
+        for name in ("b", os.path.join("a", "nested"), "c"):
+            os.makedirs(os.path.join(self.test_dir, "tree", name))
+        for name in ("b", os.path.join("a", "nested")):
+            Image.new("RGB", (4, 4)).save(os.path.join(self.test_dir, "tree", name, "room.jpg"))
+            Image.new("RGB", (4, 4)).save(os.path.join(self.test_dir, "tree", name, "asset.png"))
+        Image.new("RGB", (4, 4)).save(os.path.join(self.test_dir, "tree", "c", "room.jpg"))
+        with open(os.path.join(self.test_dir, "tree", "b", "dimensions.txt"), "w", encoding="utf-8") as f:
+            f.write("Hoogte=80 cm\n")
+
+        jobs = discover_jobs(os.path.join(self.test_dir, "tree"), "bed")
+
+        self.assertEqual([os.path.relpath(job.room, self.test_dir) for job in jobs],
+                         [os.path.join("tree", "a", "nested", "room.jpg"), os.path.join("tree", "b", "room.jpg")])
+        self.assertEqual([(job.asset_dimensions, job.asset_name) for job in jobs], [("", "bed"), ("Hoogte=80 cm", "bed")])
+
+    def test_outputs_and_metadata_are_written(self):
+        """Test every job writes its image and metadata, and the summary counts the jobs and their latency."""
+        summary = run_jobs(self.jobs, self.output_path, FakeProcessor(failing={"room-3.jpg"}), workers=2)
+
+        self.assertEqual((summary["rendered"], summary["succeeded"], summary["failed"], summary["skipped"]), (5, 4, 1, 0))
+        self.assertIn("p99", summary["latency_seconds"])
+        name = f"room-0-asset-{job_id(self.jobs[0])}"
+        with open(os.path.join(self.output_path, name + ".json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata["stage_timings"], {"analysis": 0.1, "total": 0.2})
+        self.assertEqual(Image.open(os.path.join(self.output_path, metadata["output"])).size, (20, 10))
+        self.assertTrue(os.path.exists(os.path.join(self.output_path, "run-summary.json")))
+
+    def test_resume_skips_the_finished_jobs(self):
+        """Test a second run only renders the failed jobs and ignores a journal line that was cut off."""
+        run_jobs(self.jobs, self.output_path, FakeProcessor(failing={"room-3.jpg"}), workers=2)
+        with open(os.path.join(self.output_path, JOURNAL_FILE_NAME), "a", encoding="utf-8") as f:
+            f.write('{"job_id": "cut')
+
+        processor = FakeProcessor()
+        summary = run_jobs(self.jobs, self.output_path, processor, workers=2)
+
+        self.assertEqual(processor.calls, ["room-3.jpg"])
+        self.assertEqual((summary["succeeded"], summary["skipped"]), (1, 4))
+        entries = RenderJournal(os.path.join(self.output_path, JOURNAL_FILE_NAME)).entries()
+        self.assertEqual({entry["status"] for entry in entries.values()}, {"succeeded"})
+
+    def test_worker_processes(self):
+        """Test the jobs are rendered in worker processes and journaled by the parent."""
+        summary = run_jobs(self.jobs, self.output_path, FakeProcessor(), workers=2, processes=True)
+
+        self.assertEqual(summary["succeeded"], 5)
+        self.assertEqual(len(RenderJournal(os.path.join(self.output_path, JOURNAL_FILE_NAME)).succeeded(self.output_path)), 5)
+
+
+class CreateProcessorTestCase(unittest.TestCase):
+
+    def test_processor_shares_the_metrics_of_the_client(self):
+        """Test the processor reports to the metrics of its client, so only one sink appends to the metrics file."""
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(Configuration, "llm_api_key", "fake"), \
+                mock.patch.object(Configuration, "metrics_jsonl_path", os.path.join(directory, "metrics.jsonl")):
+            processor = create_processor(os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa"))
+
+            self.assertTrue(processor.metrics.enabled)
+            self.assertIs(processor.metrics, processor.llm_client.metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
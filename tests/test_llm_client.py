@@ -14,6 +14,9 @@ from src.ImageOpener import ImageOpener
 from src.config import Configuration
 from src.llm_client import LlmClient
 from src.exceptions import LlmUnavailableError
+from src.transport import REPLAY
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
 
 CONFIGS = [("test-sofa",
                 {"dimension_items": {"sofa", "rug", "plant"},
@@ -64,6 +67,19 @@ CONFIGS = [("test-sofa",
                     orientation: The head of the bed is oriented towards the back wall, with the foot of the bed facing towards the viewer."""}
             )]
 
+
+def create_config(config_name):
+    """Returns the configuration of the test resources [config_name].
+
+    The responses are replayed from the cassettes in tests/cassettes, so the tests run offline without an API key.
+    Set LLM_TRANSPORT_MODE=record (with LLM_API_KEY) to record them again.
+    """
+    config = Configuration(os.path.join(RESOURCES_PATH, config_name))
+    config.llm_transport_mode = os.getenv("LLM_TRANSPORT_MODE", REPLAY)
+    os.makedirs(config.output_path, exist_ok=True)
+    return config
+
+
 class MyTestCase(unittest.TestCase):
 
 
@@ -74,7 +90,7 @@ class MyTestCase(unittest.TestCase):
                 config_name, prop_set = config_props
 
                 # init
-                config = Configuration(config_name)
+                config = create_config(config_name)
 
                 # create input image object
                 room_image_path = config.get_room_image_path("room.jpg")
@@ -88,8 +104,8 @@ class MyTestCase(unittest.TestCase):
                 # print results for manual inspection
                 print(f"Dimensions:\n{dimensions}")
 
-                print(f"Expected dimensions:\n{prop_set[0]['dimension_items']}")
-                for check_dimension in prop_set[0]["dimension_items"]:
+                print(f"Expected dimensions:\n{prop_set['dimension_items']}")
+                for check_dimension in prop_set["dimension_items"]:
                     self.assertTrue(contains(dimensions.casefold(), check_dimension))
 
     def test_determine_asset_location_orientation (self):
@@ -98,7 +114,7 @@ class MyTestCase(unittest.TestCase):
                 # unpack tuple (name, prop_set)
                 config_name, _ = config_props
                 # init
-                config = Configuration(config_name)
+                config = create_config(config_name)
 
                 # create input image object
                 room_image_path = config.get_room_image_path("room.jpg")
@@ -122,12 +138,13 @@ class MyTestCase(unittest.TestCase):
                 config_name, _ = config_props
 
                 # init
-                config = Configuration(config_name)
+                config = create_config(config_name)
                 client = LlmClient(config)
+                output_path = os.path.join(config.output_path, 'room-without-asset.png')
 
                 # cleanup old image
-                if os.path.exists(f'{config.output_path}\\room-without-asset.png'):
-                    os.remove(f'{config.output_path}\\room-without-asset.png')
+                if os.path.exists(output_path):
+                    os.remove(output_path)
 
                 # create input image object
                 room_image_path = config.get_room_image_path("room.jpg")
@@ -138,8 +155,8 @@ class MyTestCase(unittest.TestCase):
                 self.assertIsNotNone(image_without_asset)
 
                 # save image for manual inspection
-                image_without_asset.save(f'{config.output_path}\\room-without-asset.png')
-                self.assertTrue(os.path.exists(f'{config.output_path}\\room-without-asset.png'))
+                image_without_asset.save(output_path)
+                self.assertTrue(os.path.exists(output_path))
 
 
     def test_place_new_asset_in_empty_room(self):
@@ -149,11 +166,12 @@ class MyTestCase(unittest.TestCase):
                 config_name, prop_set = config_props
 
                 # init
-                config = Configuration(config_name)
+                config = create_config(config_name)
                 client = LlmClient(config)
 
-                # load images
-                room_image_with_missing_asset = Image.open(f'{config.output_path}\\room-without-asset.png')
+                # load images, the room without the asset is the (replayed) result of the removal
+                room_img = Image.open(config.get_room_image_path("room.jpg"))
+                room_image_with_missing_asset = client.remove_asset_from_image(room_img, config_name.split('-')[1])
                 asset_image = ImageOpener.open_image(config.get_asset_image_path(''))
 
                 # define prompts
@@ -169,8 +187,8 @@ class MyTestCase(unittest.TestCase):
                 try:
                     # call llm client to combine the images
                     room_with_new_asset = client.combine_images(room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, asset_location_orientation)
-                    room_with_new_asset.save(f'{config.output_path}\\room_with_new_asset.png')
-                    self.assertTrue(os.path.exists(f'{config.output_path}\\room_with_new_asset.png'))
+                    room_with_new_asset.save(os.path.join(config.output_path, 'room_with_new_asset.png'))
+                    self.assertTrue(os.path.exists(os.path.join(config.output_path, 'room_with_new_asset.png')))
 
                 except LlmUnavailableError as e:
                     self.fail(f"LLM failed to combine images: {e}")
@@ -178,13 +196,17 @@ class MyTestCase(unittest.TestCase):
     def test_10x_place_new_asset_in_empty_room(self):
         for config_props in CONFIGS:
             with self.subTest(config=config_props):
+                # unpack tuple (name, prop_set)
+                config_name, _ = config_props
+
                 # init
-                config = Configuration(config_props)
+                config = create_config(config_name)
                 client = LlmClient(config)
 
-                # load images
-                room_image_with_missing_asset = Image.open(f'{config.output_path}\\room-without-asset.png')
-                asset_image = Image.open(config.get_asset_image_path('asset.png'))
+                # load images, the room without the asset is the (replayed) result of the removal
+                room_img = Image.open(config.get_room_image_path("room.jpg"))
+                room_image_with_missing_asset = client.remove_asset_from_image(room_img, config_name.split('-')[1])
+                asset_image = ImageOpener.open_image(config.get_asset_image_path(''))
 
                 # define prompts
                 room_dimensions = """
@@ -215,15 +237,14 @@ class MyTestCase(unittest.TestCase):
                 """
 
                 # create folder 'loop' if it doesn't exist
-                if not os.path.exists(f'{config.output_path}\\loop'):
-                    os.makedirs(f'{config.output_path}\\loop')
+                os.makedirs(os.path.join(config.output_path, 'loop'), exist_ok=True)
 
 
                 for i in range(10):
                     try:
                         # call llm client to combine the images
                         room_with_new_asset = client.combine_images(room_image_with_missing_asset, asset_image, room_dimensions, asset_dimensions, asset_location_orientation)
-                        room_with_new_asset.save(f'{config.output_path}\\loop\\room_with_new_asset_{i}.png')
+                        room_with_new_asset.save(os.path.join(config.output_path, 'loop', f'room_with_new_asset_{i}.png'))
                     except LlmUnavailableError as e:
                         self.fail(f"LLM failed to combine images: {e}")
 
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from benchmarks.fake_gemini import FakeGeminiServer, FakeGeminiSettings
+from src.config import Configuration
+from src.llm_client import LlmClient
+from src.metrics import DISABLED, HistogramSink, JsonLinesSink, MetricEvent, Metrics
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa")
+
+
+class SinkTestCase(unittest.TestCase):
+
+    def test_histogram_sink(self):
+        """Events are aggregated per kind, name and model with the percentiles taken from the buckets."""
+        sink = HistogramSink(buckets=(1, 2, 5))
+        for seconds in (0.5, 0.5, 1.5, 4):
+            sink.record(MetricEvent("llm", "analysis", seconds=seconds, model="model", prompt_tokens=10, bytes_up=100))
+        sink.record(MetricEvent("llm", "analysis", seconds=10, model="model", outcome="error", retries=3))
+
+        summary, = sink.summary()
+
+        self.assertEqual(5, summary["count"])
+        self.assertEqual({"ok": 4, "error": 1}, summary["outcomes"])
+        self.assertEqual(40, summary["prompt_tokens"])
+        self.assertEqual(400, summary["bytes_up"])
+        self.assertEqual(3, summary["retries"])
+        self.assertEqual(2, summary["p50"])
+        # the slowest event is above the largest bucket
+        self.assertIsNone(summary["p99"])
+
+    def test_json_lines_sink(self):
+        """Every event is written as one line of JSON."""
+        with tempfile.TemporaryDirectory() as directory:
+            sink = JsonLinesSink(os.path.join(directory, "metrics.jsonl"))
+            sink.record(MetricEvent("stage", "combine", seconds=1.5))
+            sink.record(MetricEvent("cache", "analysis", outcome="hit"))
+            sink.close()
+
+            with open(sink.path, encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+
+        self.assertEqual(["combine", "analysis"], [line["name"] for line in lines])
+        self.assertEqual("hit", lines[1]["outcome"])
+
+    def test_disabled_by_default(self):
+        """Without a metrics path in the configuration the metrics are disabled."""
+        config = Configuration(RESOURCES_PATH)
+        config.metrics_jsonl_path = None
+
+        self.assertIs(DISABLED, Metrics.from_config(config))
+        self.assertFalse(DISABLED.enabled)
+
+
+class LlmClientMetricsTestCase(unittest.TestCase):
+    """Runs LlmClient against the local fake Gemini server and checks what it reports."""
+
+    def setUp(self):
+        self.settings = FakeGeminiSettings(latency_seconds=0, image_size=(64, 48), seed=1)
+        self.server = FakeGeminiServer(self.settings, [Configuration.llm_model_name_image_processing]).start()
+        self.addCleanup(self.server.stop)
+
+        self.config = Configuration(RESOURCES_PATH)
+        self.config.llm_api_key = "fake"
+        self.config.llm_base_url = self.server.base_url
+        self.sink = HistogramSink()
+        resilient_caller = ResilientCaller(RetryPolicy(2, 0, 0), RetryBudget(1, 10, 10), 5, 30, sleep=lambda _: None)
+        self.client = LlmClient(self.config, resilient_caller, metrics=Metrics([self.sink]), rate_scheduler=RateScheduler({}))
+        self.room = Image.open(self.config.get_room_image_path("room.jpg"))
+
+    def summary(self, kind, name):
+        return next(entry for entry in self.sink.summary() if entry["kind"] == kind and entry["name"] == name)
+
+    def test_request_metrics(self):
+        """A request reports its model, token usage and bytes, the room upload is reported once and reused once."""
+        self.client.analyze_room(self.room, "sofa")
+        self.client.remove_asset_from_image(self.room, "sofa")
+
+        analysis = self.summary("llm", "analysis")
+        self.assertEqual(self.config.llm_model_name_dimensions, analysis["model"])
+        self.assertEqual(1290, analysis["prompt_tokens"])
+        self.assertEqual(1258, analysis["image_tokens"])
+        self.assertGreater(analysis["bytes_up"], 0)
+        self.assertGreater(analysis["bytes_down"], 0)
+        removal = self.summary("llm", "remove_asset")
+        self.assertEqual(1258 + 1290, removal["image_tokens"])
+        self.assertEqual({"uploaded": 1, "reused": 1}, self.summary("upload", "image/jpeg")["outcomes"])
+
+    def test_failed_request_metrics(self):
+        """A request that keeps failing is reported once, as an error with its retries."""
+        self.settings.error_rate = 1.0
+
+        with self.assertRaises(Exception):
+            self.client.get_asset_dimensions(self.room)
+
+        dimensions = self.summary("llm", "dimensions")
+        self.assertEqual({"error": 1}, dimensions["outcomes"])
+        self.assertEqual(1, dimensions["retries"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from PIL import Image
+
+from src.rate_scheduler import BULK, INTERACTIVE, RateScheduler, TokenBucket, estimate_tokens
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_bucket_refills_per_minute(self):
+        """Test the bucket starts full, is emptied by take and refills at its capacity per minute."""
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock)
+
+        self.assertEqual(bucket.wait_seconds(60), 0)
+        bucket.take(60)
+        self.assertEqual(bucket.wait_seconds(10), 10)
+        clock.now = 10
+        self.assertEqual(bucket.wait_seconds(10), 0)
+
+    def test_estimate_tokens(self):
+        """Test text is counted as 4 characters per token and images per 768x768 tile after downsizing."""
+        self.assertEqual(estimate_tokens(["abcd" * 10]), 10)
+        self.assertEqual(estimate_tokens([Image.new("RGB", (300, 200))]), 258)
+        self.assertEqual(estimate_tokens([Image.new("RGB", (1536, 1024))]), 4 * 258)
+        self.assertEqual(estimate_tokens([Image.new("RGB", (1536, 1024))], max_image_size=768), 258)
+
+
+class RateSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RateScheduler({"model": {"rpm": 1, "tpm": 1000}}, headroom=1, clock=self.clock)
+        self.scheduler.max_wait_seconds = 0.01
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.005)
+
+    def test_interactive_requests_go_before_bulk_requests(self):
+        """Test a waiting interactive request is dispatched before a bulk request that was waiting longer."""
+        self.scheduler.acquire("model", 10)
+        order = []
+
+        def acquire(lane):
+            self.scheduler.acquire("model", 10, lane)
+            order.append(lane)
+
+        bulk = threading.Thread(target=acquire, args=(BULK,))
+        bulk.start()
+        self.wait_until(lambda: self.scheduler.stats()["waiting"]["model"][BULK] == 1)
+        interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+        interactive.start()
+        self.wait_until(lambda: self.scheduler.stats()["waiting"]["model"][INTERACTIVE] == 1)
+
+        self.clock.now = 60
+        self.wait_until(lambda: len(order) == 1)
+        self.clock.now = 120
+        self.wait_until(lambda: len(order) == 2)
+        bulk.join()
+        interactive.join()
+
+        self.assertEqual(order, [INTERACTIVE, BULK])
+        self.assertEqual(self.scheduler.stats()["lanes"][BULK]["dispatched"], 1)
+
+    def test_actual_usage_corrects_the_estimate(self):
+        """Test the tokens used above the estimate are paid back before the next request."""
+        scheduler = RateScheduler({"model": {"tpm": 1000}}, headroom=1, clock=self.clock)
+        scheduler.acquire("model", 100)
+        scheduler.record_usage("model", 100, 1000)
+
+        rpm, tpm = scheduler.buckets["model"]
+        self.assertIsNone(rpm)
+        self.assertEqual(tpm.wait_seconds(100), 6)
+
+    def test_release_gives_back_the_quota(self):
+        """Test a request that isn't sent after acquire gives back its request and tokens, but never more than the capacity."""
+        scheduler = RateScheduler({"model": {"rpm": 2, "tpm": 1000}}, headroom=1, clock=self.clock)
+        scheduler.acquire("model", 600)
+        scheduler.release("model", 600)
+
+        rpm, tpm = scheduler.buckets["model"]
+        self.assertEqual((rpm.level, tpm.level), (2, 1000))
+        scheduler.release("model", 600)
+        self.assertEqual((rpm.level, tpm.level), (2, 1000))
+
+    def test_async_acquire(self):
+        """Test the async variant waits for the bucket without blocking the event loop."""
+        self.scheduler.acquire("model", 10)
+
+        async def acquire_later():
+            task = asyncio.ensure_future(self.scheduler.acquire_async("model", 10))
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            self.clock.now = 60
+            await asyncio.wait_for(task, timeout=2)
+
+        asyncio.run(acquire_later())
+        self.assertEqual(self.scheduler.stats()["lanes"][INTERACTIVE]["dispatched"], 2)
+
+    def test_models_without_limits_are_not_scheduled(self):
+        """Test requests to a model without limits go through immediately."""
+        for _ in range(100):
+            self.scheduler.acquire("other-model", 10 ** 6)
+
+        self.assertNotIn("other-model", self.scheduler.stats()["waiting"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from src.region_compositing import feather_mask, paste_region, region_box
+
+
+class RegionBoxTestCase(unittest.TestCase):
+
+    def test_padded_box(self):
+        """Test the normalized bounding box is converted to pixels and padded on every side."""
+        box = region_box([400, 250, 600, 750], (1000, 500), padding=0.1)
+
+        self.assertEqual(box, (200, 190, 800, 310))
+
+    def test_box_is_clamped_and_keeps_its_size(self):
+        """Test a box at the border of the image is shifted into the image before it is clamped."""
+        box = region_box([0, 900, 100, 1000], (1000, 1000), padding=0, min_size=300)
+
+        self.assertEqual(box, (700, 0, 1000, 300))
+
+    def test_min_size_is_limited_by_the_image(self):
+        """Test the minimum size never makes the box larger than the image."""
+        self.assertEqual(region_box([450, 450, 550, 550], (200, 100), padding=0, min_size=512), (0, 0, 200, 100))
+
+    def test_unusable_bounding_box(self):
+        """Test no box is returned for a missing or empty bounding box."""
+        self.assertIsNone(region_box([], (100, 100), 0.1))
+        self.assertIsNone(region_box([500, 500, 500, 600], (100, 100), 0.1))
+
+
+class PasteRegionTestCase(unittest.TestCase):
+
+    def test_feather_mask(self):
+        """Test the mask is 1 inside and falls off towards the soft edges only."""
+        mask = feather_mask(20, 10, feather=4, soft_edges=(True, True, False, True))
+
+        self.assertEqual(mask.shape, (10, 20))
+        self.assertEqual(mask[5, 10], 1.0)
+        self.assertLess(mask[5, 0], 0.2)
+        self.assertEqual(mask[5, 19], 1.0)
+        self.assertTrue(np.all(np.diff(mask[5, :5]) > 0))
+
+    def test_outside_the_box_is_unchanged(self):
+        """Test the generated crop is resized into the box and the rest of the room is pixel-identical."""
+        room = Image.fromarray(np.random.default_rng(1).integers(0, 255, (100, 200, 3), dtype=np.uint8))
+        generated = Image.new("RGB", (30, 20), color=(0, 255, 0))
+
+        result = paste_region(room, generated, (50, 20, 110, 60), feather=5)
+
+        original, pasted = np.asarray(room), np.asarray(result)
+        self.assertEqual(result.size, room.size)
+        outside = np.ones((100, 200), dtype=bool)
+        outside[20:60, 50:110] = False
+        self.assertTrue(np.array_equal(original[outside], pasted[outside]))
+        self.assertEqual(tuple(pasted[40, 80]), (0, 255, 0))
+        # the edge of the box is a mix of the room and the generated crop
+        self.assertFalse(np.array_equal(pasted[40, 50], [0, 255, 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+from PIL import Image
+
+from src.exceptions import InvalidFileNameError, QueueFullError
+from src.image_processor import ImageProcessor
+from src.render_service import RenderRequest, RenderService
+from src.room_analysis import RoomAnalysis
+
+
+class StubLlmClient:
+    """Renders a green image after [release] is set, counting the combine calls."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.combines = 0
+
+    def analyze_room(self, room_image, asset_name):
+        return RoomAnalysis([], "center", "front", [])
+
+    def remove_asset_from_image(self, room, asset_name):
+        return Image.new('RGB', (10, 10))
+
+    def combine_images(self, *args, **kwargs):
+        self.release.wait(timeout=5)
+        self.combines += 1
+        return Image.new('RGB', (10, 10), color='green')
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        Image.new('RGB', (10, 10), color='white').save(os.path.join(self.test_dir, "room.jpg"))
+        Image.new('RGB', (5, 5), color='red').save(os.path.join(self.test_dir, "asset.png"))
+
+        self.config = Mock()
+        self.config.pipeline_max_workers = 2
+        self.config.pipeline_region_compositing = False
+        self.config.pipeline_candidates = 1
+        self.config.image_draft_decoding = False
+        self.config.image_memory_budget_bytes = None
+        self.config.service_workers = 1
+        self.config.service_max_queue = 1
+        self.config.service_queue_timeout_seconds = 0
+        self.config.service_max_finished_jobs = 10
+        self.config.get_room_image_path.side_effect = lambda name: os.path.join(self.test_dir, name)
+        self.config.get_asset_image_path.side_effect = lambda name: os.path.join(self.test_dir, name)
+
+        self.llm_client = StubLlmClient()
+        self.service = RenderService(self.config, ImageProcessor(self.config, self.llm_client))
+        self.service.start()
+
+    def tearDown(self):
+        self.llm_client.release.set()
+        self.service.stop(timeout=5)
+        shutil.rmtree(self.test_dir)
+
+    def _wait_until(self, job_id, state):
+        for _ in range(100):
+            if self.service.status(job_id)["state"] == state:
+                return
+            time.sleep(0.02)
+        self.fail(f"job {job_id} did not reach state {state}")
+
+    def test_identical_submissions_are_collapsed(self):
+        """Test a second identical submission gets the id of the job in flight and only one render is done."""
+        first = self.service.submit(RenderRequest("room.jpg", "asset.png", "width=200"))
+        second = self.service.submit(RenderRequest("room.jpg", "asset.png", "width=200"))
+        self.assertEqual(first, second)
+
+        self.llm_client.release.set()
+        self._wait_until(first, "succeeded")
+        self.assertEqual(self.service.result(first).getpixel((0, 0)), (0, 128, 0))
+        self.assertEqual(self.service.status(first)["duplicates"], 1)
+        self.assertEqual(self.llm_client.combines, 1)
+
+    def test_full_queue_rejects_submissions(self):
+        """Test submissions are rejected when the worker is busy and the queue is full."""
+        running = self.service.submit(RenderRequest("room.jpg", "asset.png", "width=200"))
+        self._wait_until(running, "running")
+        self.service.submit(RenderRequest("room.jpg", "asset.png", "width=180"))
+
+        with self.assertRaises(QueueFullError):
+            self.service.submit(RenderRequest("room.jpg", "asset.png", "width=160"))
+
+    def test_result_is_none_until_finished(self):
+        """Test the result can be polled and is None while the render is running."""
+        job_id = self.service.submit(RenderRequest("room.jpg", "asset.png", "width=200"))
+        self.assertIsNone(self.service.result(job_id))
+        with self.assertRaises(KeyError):
+            self.service.status("unknown")
+
+    def test_file_names_outside_the_catalogue_are_rejected(self):
+        """Test a path, a parent directory or a link out of the catalogue directory is rejected before the file is opened."""
+        outside = tempfile.NamedTemporaryFile(delete=False)
+        outside.close()
+        self.addCleanup(os.remove, outside.name)
+        names = [outside.name, os.path.join("..", os.path.basename(outside.name)), "..", ""]
+        if hasattr(os, "symlink"):
+            os.symlink(outside.name, os.path.join(self.test_dir, "link.jpg"))
+            names.append("link.jpg")
+
+        for name in names:
+            with self.subTest(name=name), self.assertRaises(InvalidFileNameError):
+                self.service.submit(RenderRequest(name, "asset.png", "width=200"))
+        with self.assertRaises(InvalidFileNameError):
+            self.service.submit(RenderRequest("room.jpg", "../asset.png", "width=200"))
+
+    def test_stage_timings_are_kept_per_job(self):
+        """Test every job gets the timings of its own render, and the stage pool has room for all workers."""
+        self.llm_client.release.set()
+        first = self.service.submit(RenderRequest("room.jpg", "asset.png", "width=200"))
+        self._wait_until(first, "succeeded")
+
+        self.assertEqual(set(self.service.status(first)["stage_timings"]), {"analysis", "remove_asset", "combine", "total"})
+        self.assertEqual(self.service.processor.max_workers, self.config.service_workers * self.config.pipeline_max_workers)
+
+    def test_http_endpoints(self):
+        """Test submit, poll and result through the HTTP API."""
+        try:
+            from fastapi.testclient import TestClient
+        except ImportError:
+            self.skipTest("fastapi is not installed")
+        from src.render_service import create_app
+
+        http = TestClient(create_app(self.service))
+        job_id = http.post("/renders", json={"room_file_name": "room.jpg", "asset_file_name": "asset.png", "asset_dimensions": "width=200"}).json()["job_id"]
+        self.assertEqual(http.get(f"/renders/{job_id}/result").status_code, 409)
+
+        self.llm_client.release.set()
+        self._wait_until(job_id, "succeeded")
+        response = http.get(f"/renders/{job_id}/result")
+        self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(http.get("/renders/unknown").status_code, 404)
+        self.assertEqual(http.post("/renders", json={"room_file_name": "/etc/passwd", "asset_file_name": "asset.png", "asset_dimensions": "width=200"}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import asyncio
+import unittest
+
+from google.genai import errors
+
+from src.exceptions import CircuitOpenError, LlmUnavailableError
+from src.resilience import CircuitBreaker, ResilientCaller, RetryBudget, RetryPolicy, retry_after_seconds
+
+
+def server_error(code=503, retry_delay=None):
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay}] if retry_delay else []
+    return errors.ServerError(code, {"error": {"code": code, "status": "UNAVAILABLE", "message": "high demand", "details": details}})
+
+
+class FlakyRequest:
+    """Fails with the given errors per model before it succeeds."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, model):
+        self.calls.append(model)
+        if self.failures.get(model):
+            raise self.failures[model].pop(0)
+        return f"response of {model}"
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.caller = ResilientCaller(RetryPolicy(max_attempts=3, base_delay=1, max_delay=10), RetryBudget(ratio=0.5, min_tokens=10, max_tokens=10),
+                                      failure_threshold=3, reset_seconds=60, sleep=self.sleeps.append)
+
+    def test_temporary_errors_are_retried(self):
+        """Test a 503 is retried with backoff until the request succeeds."""
+        request = FlakyRequest({"model": [server_error(), server_error(429)]})
+
+        self.assertEqual(self.caller.call("model", request), "response of model")
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertEqual(self.caller.stats()["retries"], 2)
+
+    def test_retry_delay_of_the_server_is_honoured(self):
+        """Test the delay from RetryInfo is used when it is longer than the backoff."""
+        request = FlakyRequest({"model": [server_error(retry_delay="7s")]})
+
+        self.caller.call("model", request)
+        self.assertEqual(self.sleeps, [7.0])
+        self.assertEqual(retry_after_seconds(server_error(retry_delay="2.5s")), 2.5)
+
+    def test_client_errors_are_not_retried(self):
+        """Test a bad request is raised immediately."""
+        request = FlakyRequest({"model": [errors.ClientError(400, {"error": {"code": 400, "message": "bad request"}})]})
+
+        with self.assertRaises(errors.ClientError):
+            self.caller.call("model", request)
+        self.assertEqual(request.calls, ["model"])
+
+    def test_fallback_model_is_used_when_retries_run_out(self):
+        """Test the fallback model gets the request after all attempts on the primary model failed."""
+        request = FlakyRequest({"primary": [server_error(), server_error(), server_error()]})
+
+        self.assertEqual(self.caller.call("primary", request, fallback_model="secondary"), "response of secondary")
+        self.assertEqual(request.calls, ["primary"] * 3 + ["secondary"])
+        self.assertEqual(self.caller.stats()["fallbacks"], 1)
+
+    def test_open_breaker_fails_fast(self):
+        """Test requests are refused without calling the model once its circuit breaker is open."""
+        request = FlakyRequest({"model": [server_error()] * 3})
+        with self.assertRaises(LlmUnavailableError):
+            self.caller.call("model", request)
+        self.assertEqual(self.caller.stats()["breakers"]["model"]["state"], CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            self.caller.call("model", request)
+        self.assertEqual(len(request.calls), 3)
+
+    def test_retry_budget_limits_retries(self):
+        """Test no more retries are done when the process wide budget is used up."""
+        caller = ResilientCaller(RetryPolicy(max_attempts=5, base_delay=0, max_delay=0), RetryBudget(ratio=0, min_tokens=1, max_tokens=1),
+                                 failure_threshold=100, reset_seconds=60, sleep=self.sleeps.append)
+        request = FlakyRequest({"model": [server_error()] * 5})
+
+        with self.assertRaises(LlmUnavailableError):
+            caller.call("model", request)
+        self.assertEqual(len(request.calls), 2)
+        self.assertEqual(caller.stats()["budget_exhausted"], 1)
+
+    def test_half_open_breaker_closes_after_success(self):
+        """Test the breaker lets one trial through after the reset time and closes when it succeeds."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_client_error_during_half_open_trial_releases_the_trial(self):
+        """Test a bad request on the half open trial doesn't leave the breaker refusing every request."""
+        caller = ResilientCaller(RetryPolicy(max_attempts=1, base_delay=0, max_delay=0), RetryBudget(ratio=0.5, min_tokens=10, max_tokens=10),
+                                 failure_threshold=1, reset_seconds=0, sleep=self.sleeps.append)
+        request = FlakyRequest({"model": [server_error(), errors.ClientError(400, {"error": {"code": 400, "message": "bad request"}})]})
+        with self.assertRaises(LlmUnavailableError):
+            caller.call("model", request)
+
+        with self.assertRaises(errors.ClientError):
+            caller.call("model", request)
+        self.assertEqual(caller.call("model", request), "response of model")
+        self.assertEqual(caller.stats()["breakers"]["model"]["state"], CircuitBreaker.CLOSED)
+
+    def test_cancelled_half_open_trial_releases_the_trial(self):
+        """Test a trial request that is cancelled counts as neither a success nor a failure."""
+        caller = ResilientCaller(RetryPolicy(max_attempts=1, base_delay=0, max_delay=0), RetryBudget(ratio=0.5, min_tokens=10, max_tokens=10),
+                                 failure_threshold=1, reset_seconds=0, sleep=self.sleeps.append)
+        caller._breaker("model").record_failure()
+
+        async def cancelled_request(model):
+            raise asyncio.CancelledError()
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(caller.call_async("model", cancelled_request))
+        self.assertEqual(caller.stats()["breakers"]["model"]["state"], CircuitBreaker.HALF_OPEN)
+        self.assertTrue(caller._breaker("model").allow_request())
+
+    def test_async_call_retries(self):
+        """Test the async variant retries in the same way."""
+        request = FlakyRequest({"model": [server_error()]})
+
+        async def async_request(model):
+            return request(model)
+
+        self.assertEqual(asyncio.run(self.caller.call_async("model", async_request)), "response of model")
+        self.assertEqual(request.calls, ["model", "model"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from src.room_analysis import AssetDimensions, RoomAnalysis
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_parse_model_output(self):
+        """Test the JSON of the room analysis schema is parsed into typed records."""
+        analysis = RoomAnalysis.from_json("""
+            {"assets": [{"name": "sectional sofa", "area": 62000, "depth": 100, "width": 620, "height": 75},
+                        {"name": "rug", "area": 60000, "depth": 200, "width": 300, "height": 1}],
+             "target": {"location": "in front of the wall", "orientation": "facing the viewer", "bounding_box": [450, 120, 820, 880]}}""")
+
+        self.assertEqual(analysis.assets[0], AssetDimensions("sectional sofa", 62000, 100, 620, 75))
+        self.assertEqual(analysis.bounding_box, [450, 120, 820, 880])
+        self.assertEqual(analysis.dimensions_text(), "sectional sofa: 620x100x75 cm (w x d x h)\nrug: 300x200x1 cm (w x d x h)")
+        self.assertEqual(analysis.location_orientation_text(), "location: in front of the wall\norientation: facing the viewer")
+
+    def test_unknown_dimensions(self):
+        """Test an asset with an unknown dimension is written with a question mark."""
+        analysis = RoomAnalysis.from_json('{"assets": [{"name": "plant", "area": null, "depth": 50, "width": 50, "height": null}]}')
+
+        self.assertEqual(analysis.dimensions_text(), "plant: 50x50x? cm (w x d x h)")
+
+    def test_json_round_trip(self):
+        """Test to_json gives back the same analysis, so it can be cached."""
+        analysis = RoomAnalysis([AssetDimensions("bed", 44000, 220, 200, 120)], "center-right", "head to the back wall", [300, 500, 900, 950])
+        self.assertEqual(RoomAnalysis.from_json(analysis.to_json()), analysis)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from PIL import Image
+
+from src.config import Configuration
+from src.image_processor import ImageProcessor
+from src.room_analysis import AssetDimensions, RoomAnalysis
+from src.room_index import RoomIndex, build_index
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa")
+
+
+class RoomIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a catalogue of two rooms (one in a sub directory) and a file that isn't an image."""
+        self.test_dir = tempfile.mkdtemp()
+        self.catalogue = os.path.join(self.test_dir, "catalogue")
+        os.makedirs(os.path.join(self.catalogue, "showroom"))
+        self.rooms = [os.path.join(self.catalogue, "living.jpg"), os.path.join(self.catalogue, "showroom", "bedroom.png")]
+        for color, path in zip(("white", "gray"), self.rooms):
+            Image.new("RGB", (40, 30), color=color).save(path)
+        with open(os.path.join(self.catalogue, "notes.txt"), "w") as f:
+            f.write("not an image")
+
+        self.config = Configuration(RESOURCES_PATH)
+        self.index_dir = os.path.join(self.test_dir, "index")
+        self.analysis = RoomAnalysis([AssetDimensions("sofa", 20000, 100, 200, 80)], "center", "facing the viewer", [400, 100, 800, 900])
+        self.client = Mock()
+        self.client.analyze_room.return_value = self.analysis
+        self.client.remove_asset_from_image.side_effect = lambda room, name: Image.new("RGB", room.size, color="blue")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_rooms_are_indexed_once(self):
+        """Test every room is analysed and cleaned once and the entries survive a reload of the index."""
+        counts = build_index(self.catalogue, self.client, RoomIndex(self.index_dir, self.config), max_workers=2)
+        self.assertEqual(counts, {"indexed": 2, "skipped": 0, "failed": 0, "removed": 0})
+
+        index = RoomIndex(self.index_dir, self.config)
+        counts = build_index(self.catalogue, self.client, index)
+
+        self.assertEqual(counts["skipped"], 2)
+        self.assertEqual(self.client.analyze_room.call_count, 2)
+        entry = index.lookup(self.rooms[1], "sofa")
+        self.assertEqual(entry.analysis, self.analysis)
+        self.assertEqual(entry.room_without_asset().getpixel((0, 0)), (0, 0, 255))
+        self.assertIsNone(index.lookup(self.rooms[1], "bed"))
+
+    def test_changed_and_removed_rooms_are_invalidated(self):
+        """Test a changed room is indexed again, and the entries of the old image and of a deleted room are removed."""
+        index = RoomIndex(self.index_dir, self.config)
+        build_index(self.catalogue, self.client, index)
+
+        Image.new("RGB", (40, 30), color="red").save(self.rooms[0])
+        os.utime(self.rooms[0], ns=(1, 1))
+        os.remove(self.rooms[1])
+        counts = build_index(self.catalogue, self.client, index)
+
+        self.assertEqual(counts, {"indexed": 1, "skipped": 0, "failed": 0, "removed": 2})
+        self.assertEqual(len(index), 1)
+        self.assertEqual(len([name for name in os.listdir(self.index_dir) if name.endswith(".png")]), 1)
+
+    def test_model_configuration_change_makes_entries_stale(self):
+        """Test entries made with another image model or of another index version are not used."""
+        build_index(self.catalogue, self.client, RoomIndex(self.index_dir, self.config))
+
+        self.config.llm_model_name_image_processing = "another-model"
+        self.assertIsNone(RoomIndex(self.index_dir, self.config).lookup(self.rooms[0], "sofa"))
+
+        with open(os.path.join(self.index_dir, "index.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        data["version"] = 0
+        with open(os.path.join(self.index_dir, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        self.assertEqual(len(RoomIndex(self.index_dir, Configuration(RESOURCES_PATH))), 0)
+
+    def test_image_processor_skips_to_combine(self):
+        """Test an indexed room goes straight to combine_images with the indexed analysis and cleaned room."""
+        index = RoomIndex(self.index_dir, self.config)
+        build_index(self.catalogue, self.client, index)
+        config = Mock()
+        config.pipeline_region_compositing = False
+        config.pipeline_candidates = 1
+        config.image_draft_decoding = False
+        config.image_memory_budget_bytes = None
+        config.get_room_image_path.side_effect = lambda name: os.path.join(self.catalogue, name)
+        config.get_asset_image_path.side_effect = lambda name: os.path.join(self.catalogue, name)
+        client = Mock()
+        client.combine_images.return_value = Image.new("RGB", (40, 30), color="green")
+        processor = ImageProcessor(config, client, room_index=index)
+
+        processor.insert_asset_into_room("living.jpg", "living.jpg", "width=180")
+
+        client.analyze_room.assert_not_called()
+        client.remove_asset_from_image.assert_not_called()
+        args = client.combine_images.call_args[0]
+        self.assertEqual(args[0].getpixel((0, 0)), (0, 0, 255))
+        self.assertEqual(args[2], self.analysis.dimensions_text())
+        self.assertIn("index", processor.last_stage_timings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from benchmarks.fake_gemini import FakeGeminiServer, FakeGeminiSettings
+from src.async_llm_client import AsyncLlmClient
+from src.config import Configuration
+from src.exceptions import CassetteNotFoundError
+from src.image_utils import image_digest
+from src.llm_client import LlmClient
+from src.prompts import REMOVE_ASSET_CONFIG, ROOM_ANALYSIS_CONFIG
+from src.rate_scheduler import RateScheduler
+from src.resilience import ResilientCaller, RetryBudget, RetryPolicy
+from src.transport import PASSTHROUGH, RECORD, REPLAY, CassetteTransport, request_fingerprint
+
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "test-sofa")
+
+
+class RequestFingerprintTestCase(unittest.TestCase):
+
+    def test_fingerprint(self):
+        """Test the fingerprint depends on the image content, the prompt, the model and the generation config."""
+        image = Image.new("RGB", (10, 10), color="red")
+        fingerprint = request_fingerprint("model", ["prompt", image], REMOVE_ASSET_CONFIG)
+
+        self.assertEqual(fingerprint, request_fingerprint("model", ["prompt", image.copy()], REMOVE_ASSET_CONFIG))
+        self.assertNotEqual(fingerprint, request_fingerprint("model", ["prompt", Image.new("RGB", (10, 10))], REMOVE_ASSET_CONFIG))
+        self.assertNotEqual(fingerprint, request_fingerprint("model", ["other prompt", image], REMOVE_ASSET_CONFIG))
+        self.assertNotEqual(fingerprint, request_fingerprint("other-model", ["prompt", image], REMOVE_ASSET_CONFIG))
+        self.assertNotEqual(fingerprint, request_fingerprint("model", ["prompt", image], ROOM_ANALYSIS_CONFIG))
+
+    def test_invalid_mode(self):
+        """Test an unknown mode, or recording without a directory, is refused."""
+        with self.assertRaises(ValueError):
+            CassetteTransport("rewind", "cassettes")
+        with self.assertRaises(ValueError):
+            CassetteTransport(RECORD)
+
+
+class RecordReplayTestCase(unittest.TestCase):
+    """Records the responses of the local fake Gemini server and replays them after the server is stopped."""
+
+    def setUp(self):
+        self.server = FakeGeminiServer(FakeGeminiSettings(latency_seconds=0, image_size=(64, 48), seed=1),
+                                       [Configuration.llm_model_name_image_processing]).start()
+        self.addCleanup(self.server.stop)
+        self.cassettes = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cassettes.cleanup)
+
+        self.config = Configuration(RESOURCES_PATH)
+        self.config.llm_api_key = "fake"
+        self.config.llm_base_url = self.server.base_url
+        self.room = Image.open(self.config.get_room_image_path("room.jpg"))
+
+    def client(self, mode):
+        resilient_caller = ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30, sleep=lambda _: None)
+        return LlmClient(self.config, resilient_caller, rate_scheduler=RateScheduler({}), transport=CassetteTransport(mode, self.cassettes.name))
+
+    def test_replay_without_the_api(self):
+        """Test the recorded responses, including images, are replayed without sending a request."""
+        recorder = self.client(RECORD)
+        recorded_analysis = recorder.analyze_room(self.room, "sofa")
+        recorded_image = recorder.remove_asset_from_image(self.room, "sofa")
+        self.server.stop()
+        self.assertEqual(len([name for name in os.listdir(self.cassettes.name) if name.endswith(".json.gz")]), 2)
+
+        player = self.client(REPLAY)
+        analysis = player.analyze_room(self.room.copy(), "sofa")
+        image = player.remove_asset_from_image(self.room, "sofa")
+
+        self.assertEqual(analysis, recorded_analysis)
+        self.assertEqual(image_digest(image), image_digest(recorded_image))
+        self.assertEqual(self.server.counters["generate_content"], 2)
+        self.assertEqual(self.server.counters["uploads"], 1)
+
+    def test_replay_without_an_api_key(self):
+        """Test a client in replay mode is created and replays without an API key."""
+        recorded = self.client(RECORD).get_asset_dimensions(self.room)
+        self.server.stop()
+        self.config.llm_api_key = None
+        self.config.llm_base_url = None
+
+        client = self.client(REPLAY)
+
+        self.assertIsNone(client.client)
+        self.assertEqual(client.get_asset_dimensions(self.room), recorded)
+
+    def test_request_that_was_not_recorded(self):
+        """Test replaying a request without a cassette fails instead of calling the API."""
+        with self.assertRaises(CassetteNotFoundError):
+            self.client(REPLAY).get_asset_dimensions(self.room)
+        self.assertEqual(self.server.counters["generate_content"], 0)
+
+    def test_async_replay(self):
+        """Test the async client replays the cassettes recorded by the sync client."""
+        recorded = self.client(RECORD).get_asset_dimensions(self.room)
+        self.server.stop()
+
+        client = AsyncLlmClient(self.config, resilient_caller=ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30),
+                                rate_scheduler=RateScheduler({}), transport=CassetteTransport(REPLAY, self.cassettes.name))
+
+        self.assertEqual(asyncio.run(client.get_asset_dimensions(self.room)), recorded)
+
+    def test_passthrough_does_not_record(self):
+        """Test passthrough sends every request and writes no cassettes."""
+        client = LlmClient(self.config, ResilientCaller(RetryPolicy(1, 0, 0), RetryBudget(1, 10, 10), 5, 30),
+                           rate_scheduler=RateScheduler({}), transport=CassetteTransport(PASSTHROUGH))
+
+        client.get_asset_dimensions(self.room)
+        client.get_asset_dimensions(self.room)
+
+        self.assertEqual(self.server.counters["generate_content"], 2)
+        self.assertEqual(os.listdir(self.cassettes.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()